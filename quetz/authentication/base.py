@@ -1,4 +1,6 @@
+import hashlib
 import sys
+import time
 import uuid
 from typing import Dict, List, Optional, Type, Union
 
@@ -10,6 +12,7 @@ from quetz.authorization import ServerRole
 from quetz.config import Config
 from quetz.dao import Dao
 from quetz.deps import get_config, get_dao
+from quetz.metrics.middleware import AUTH_PROVIDER_REQUEST_TIME, TOKEN_VALIDATIONS
 
 if sys.version_info >= (3, 8):
     from typing import TypedDict  # pylint: disable=no-name-in-module
@@ -175,6 +178,10 @@ class BaseAuthenticator:
     default_role: Optional[str] = None
     default_channel: Optional[str] = None
 
+    # seconds a valid token is trusted before it is validated again
+    token_revalidation_interval: float = 60
+    max_validated_tokens = 10000
+
     @property
     def router(self):
         return self.handler.router
@@ -183,6 +190,8 @@ class BaseAuthenticator:
         if provider is not None:
             self.provider = str(provider)
         self.handler = self.handler_cls(self, app)
+        # token sha256 -> time until which the token is trusted
+        self._validated_tokens: Dict[str, float] = {}
 
         self.configure(config)
 
@@ -204,10 +213,42 @@ class BaseAuthenticator:
             self._maintainers = []
             self._members = []
 
+        self.token_revalidation_interval = config.general_token_revalidation_interval
+
     async def validate_token(self, token):
         "check token validity"
         return True
 
+    async def check_token(self, token) -> bool:
+        """check token validity with :py:meth:`validate_token`
+
+        Valid tokens are not validated again with the provider for
+        ``token_revalidation_interval`` seconds.
+        """
+
+        key = hashlib.sha256(str(token).encode()).hexdigest()
+        now = time.monotonic()
+        if self._validated_tokens.get(key, 0) > now:
+            TOKEN_VALIDATIONS.labels(self.provider, "cached").inc()
+            return True
+
+        with AUTH_PROVIDER_REQUEST_TIME.labels(self.provider, "validate_token").time():
+            valid = await self.validate_token(token)
+        TOKEN_VALIDATIONS.labels(self.provider, "valid" if valid else "invalid").inc()
+
+        if not valid:
+            self._validated_tokens.pop(key, None)
+        elif self.token_revalidation_interval > 0:
+            if len(self._validated_tokens) >= self.max_validated_tokens:
+                self._validated_tokens = {
+                    k: expires
+                    for k, expires in self._validated_tokens.items()
+                    if expires > now
+                }
+            if len(self._validated_tokens) < self.max_validated_tokens:
+                self._validated_tokens[key] = now + self.token_revalidation_interval
+        return valid
+
     async def user_role(self, request: Request, profile: UserProfile) -> Optional[str]:
         """return default role of the new user"""
         login = profile["login"]
@@ -9,6 +9,7 @@ from fastapi import Request
 from starlette.responses import RedirectResponse
 
 from quetz.config import Config
+from quetz.metrics.middleware import AUTH_PROVIDER_REQUEST_TIME
 
 from .base import BaseAuthenticationHandlers, BaseAuthenticator
 
@@ -95,9 +96,10 @@ class OAuthAuthenticator(BaseAuthenticator):
         raise NotImplementedError("subclasses need to implement userinfo")
 
     async def authenticate(self, request, data=None, dao=None, config=None):
-        token = await self.client.authorize_access_token(request)
+        with AUTH_PROVIDER_REQUEST_TIME.labels(self.provider, "authenticate").time():
+            token = await self.client.authorize_access_token(request)
 
-        profile = await self.userinfo(request, token)
+            profile = await self.userinfo(request, token)
 
         username = profile["login"]
         auth_state = {"token": json.dumps(token), "provider": self.provider}
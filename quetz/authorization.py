@@ -2,9 +2,10 @@
 # Distributed under the terms of the Modified BSD License.
 
 import enum
+import hashlib
 import uuid
 from datetime import date
-from typing import Optional
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
 
 from fastapi import HTTPException, status
 from sqlalchemy import or_
@@ -13,6 +14,7 @@ from sqlalchemy.orm import Session
 import quetz.config
 
 from .db_models import ApiKey, ChannelMember, PackageMember, User
+from .utils import GenerationCache, invalidate_on_changes
 
 OWNER = "owner"
 MAINTAINER = "maintainer"
@@ -33,11 +35,118 @@ class ServerRole(str, enum.Enum):
     USER = None
 
 
+class AuthorizationCache(GenerationCache):
+    """Cache of API key identities, server roles and channel/package roles
+    shared by requests.
+
+    Entries expire after ttl seconds. All entries are dropped when a session
+    of this process changes users, API keys or members, changes committed by
+    other processes are seen after at most ttl seconds.
+    """
+
+    generation = 0
+
+
+invalidate_on_changes(AuthorizationCache, (User, ApiKey, ChannelMember, PackageMember))
+
+
+_shared_caches: Dict[float, AuthorizationCache] = {}
+
+
+def get_shared_cache(ttl: float) -> Optional[AuthorizationCache]:
+    """Cache shared by all requests of the process, None if ttl is 0."""
+
+    if ttl <= 0:
+        return None
+    if ttl not in _shared_caches:
+        _shared_caches[ttl] = AuthorizationCache(ttl)
+    return _shared_caches[ttl]
+
+
 class Rules:
-    def __init__(self, API_key: Optional[str], session: dict, db: Session):
+    """Authorization checks of a request.
+
+    Identities and roles are looked up once per request, and in the shared
+    cache if one is given.
+    """
+
+    def __init__(
+        self,
+        API_key: Optional[str],
+        session: dict,
+        db: Session,
+        cache: Optional[AuthorizationCache] = None,
+    ):
         self.API_key = API_key
         self.session = session
         self.db = db
+        self.cache = cache
+        self._memo: Dict[Hashable, Any] = {}
+        self._memo_generation = AuthorizationCache.generation
+
+    def _cached(
+        self,
+        key: Hashable,
+        load: Callable[[], Any],
+        shared: bool = True,
+        cache_none: bool = True,
+    ) -> Any:
+        if self._memo_generation != AuthorizationCache.generation:
+            self._memo.clear()
+            self._memo_generation = AuthorizationCache.generation
+        if key not in self._memo:
+            if shared and self.cache is not None:
+                self._memo[key] = self.cache.get(key, load, cache_none)
+            else:
+                self._memo[key] = load()
+        return self._memo[key]
+
+    def _api_key_identity(self) -> Optional[Tuple[bytes, bytes]]:
+        """(user_id, owner_id) of the API key if it is valid."""
+
+        def load():
+            api_key = self.get_valid_api_key()
+            if api_key:
+                return api_key.user_id, api_key.owner_id
+            return None
+
+        # the shared cache keeps hashes of the keys, and no invalid keys
+        key = hashlib.sha256(str(self.API_key).encode()).hexdigest()
+        return self._cached(("api_key", key), load, cache_none=False)
+
+    def _user_role(self, user_id: bytes) -> Tuple[bool, Optional[str]]:
+        """Whether the user exists and its server role."""
+
+        def load():
+            res = self.db.query(User.role).filter(User.id == user_id).one_or_none()
+            return (True, res.role) if res else (False, None)
+
+        return self._cached(("user", user_id), load)
+
+    def _channel_role(self, user_id: bytes, channel_name: str) -> Optional[str]:
+        def load():
+            return (
+                self.db.query(ChannelMember.role)
+                .filter(ChannelMember.user_id == user_id)
+                .filter(ChannelMember.channel_name == channel_name)
+                .scalar()
+            )
+
+        return self._cached(("channel_role", user_id, channel_name), load)
+
+    def _package_role(
+        self, user_id: bytes, channel_name: str, package_name: str
+    ) -> Optional[str]:
+        def load():
+            return (
+                self.db.query(PackageMember.role)
+                .filter(PackageMember.user_id == user_id)
+                .filter(PackageMember.channel_name == channel_name)
+                .filter(PackageMember.package_name == package_name)
+                .scalar()
+            )
+
+        return self._cached(("package_role", user_id, channel_name, package_name), load)
 
     def get_valid_api_key(self) -> Optional[ApiKey]:
         if not self.API_key:
@@ -61,9 +170,9 @@ class Rules:
         owner_id = None
 
         if self.API_key:
-            api_key = self.get_valid_api_key()
-            if api_key:
-                owner_id = api_key.owner_id
+            identity = self._api_key_identity()
+            if identity:
+                _, owner_id = identity
         else:
             user_id = self.session.get("user_id")
             if user_id:
@@ -74,7 +183,7 @@ class Rules:
     def assert_owner(self) -> bytes:
         owner_id = self.get_owner()
 
-        if not owner_id or not self.db.query(User).filter(User.id == owner_id).count():
+        if not owner_id or not self._user_role(owner_id)[0]:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Not logged in",
@@ -91,9 +200,9 @@ class Rules:
         user_id = None
 
         if self.API_key:
-            api_key = self.get_valid_api_key()
-            if api_key:
-                user_id = api_key.user_id
+            identity = self._api_key_identity()
+            if identity:
+                user_id, _ = identity
         else:
             user_id = self.session.get("user_id")
             if user_id:
@@ -104,7 +213,7 @@ class Rules:
     def assert_user(self) -> bytes:
         user_id = self.get_user()
 
-        if not user_id or not self.db.query(User).filter(User.id == user_id).count():
+        if not user_id or not self._user_role(user_id)[0]:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Not logged in",
@@ -146,48 +255,35 @@ class Rules:
 
         return user_id
 
-    def has_server_roles(self, user_id, roles: list):
-        pm = quetz.config.get_plugin_manager()
-        res = self.db.query(User).filter(User.id == user_id).one_or_none()
+    def has_server_roles(self, user_id, roles: list) -> bool:
+        exists, user_role = self._user_role(user_id)
 
-        if res:
-            user_role = res.role
-            if user_role in roles:
-                permissions_check = pm.hook.check_additional_permissions(
-                    db=self.db, user_id=user_id, user_role=user_role
-                )
-                if len(permissions_check):
-                    if all(permissions_check):
-                        return res
-                    else:
-                        return None
-                else:
-                    return res
-            else:
-                return None
-        else:
-            return None
+        if not exists or user_role not in roles:
+            return False
 
-    def has_channel_role(self, user_id: bytes, channel_name: str, roles: list):
-        return (
-            self.db.query(ChannelMember)
-            .filter(ChannelMember.user_id == user_id)
-            .filter(ChannelMember.channel_name == channel_name)
-            .filter(ChannelMember.role.in_(roles))
-            .one_or_none()
+        def check_additional_permissions():
+            pm = quetz.config.get_plugin_manager()
+            permissions_check = pm.hook.check_additional_permissions(
+                db=self.db, user_id=user_id, user_role=user_role
+            )
+            return all(permissions_check)
+
+        # plugin checks are only memoized for the request
+        return self._cached(
+            ("additional_permissions", user_id, user_role),
+            check_additional_permissions,
+            shared=False,
         )
 
+    def has_channel_role(self, user_id: bytes, channel_name: str, roles: list):
+        role = self._channel_role(user_id, channel_name)
+        return role is not None and role in roles
+
     def has_package_role(
         self, user_id, channel_name: str, package_name: str, roles: list
     ):
-        return (
-            self.db.query(PackageMember)
-            .filter(PackageMember.user_id == user_id)
-            .filter(PackageMember.channel_name == channel_name)
-            .filter(PackageMember.package_name == package_name)
-            .filter(PackageMember.role.in_(roles))
-            .one_or_none()
-        )
+        role = self._package_role(user_id, channel_name, package_name)
+        return role is not None and role in roles
 
     def has_channel_or_package_roles(
         self,
@@ -748,18 +748,24 @@ def plugin(
 
 def start_supervisor_daemon(path: Path, num_procs=None):
     from quetz.jobs.runner import Supervisor
-    from quetz.tasks.workers import get_worker
+    from quetz.jobs.scheduling import ConcurrencyLimits
+    from quetz.tasks.workers import SubprocessWorker, get_worker
 
     configure_logger(loggers=("quetz",))
     config = _get_config(path)
     manager = get_worker(config, num_procs=num_procs)
+    if isinstance(manager, SubprocessWorker):
+        manager.warm_up()
 
     # If the config file exists, we assume that the database path
     # is set there (it only matters for sqlite database).
     db_path = path if path.joinpath("config.toml").exists() else os.getcwd()
     with working_directory(db_path):
         db = get_session(config.sqlalchemy_database_url)
-        supervisor = Supervisor(db, manager)
+        supervisor_args = {"limits": ConcurrencyLimits.from_config(config)}
+        if config.configured_section("worker"):
+            supervisor_args["task_batch_size"] = config.worker_task_batch_size
+        supervisor = Supervisor(db, manager, **supervisor_args)
         try:
             supervisor.run()
         except KeyboardInterrupt:
@@ -62,6 +62,9 @@ class Config:
                 ConfigEntry("package_unpack_threads", int, 1),
                 ConfigEntry("frontend_dir", str, default=""),
                 ConfigEntry("redirect_http_to_https", bool, False),
+                ConfigEntry("authorization_cache_ttl", int, default=5),
+                ConfigEntry("channel_cache_ttl", int, default=5),
+                ConfigEntry("token_revalidation_interval", int, default=60),
             ],
         ),
         ConfigSection(
@@ -108,6 +111,8 @@ class Config:
                 ConfigEntry("echo_sql", bool, default=False, required=False),
                 ConfigEntry("postgres_pool_size", int, default=10, required=False),
                 ConfigEntry("postgres_max_overflow", int, default=100, required=False),
+                ConfigEntry("async_enabled", bool, default=False, required=False),
+                ConfigEntry("replica_urls", list, default=list, required=False),
             ],
         ),
         ConfigSection(
@@ -193,6 +198,17 @@ class Config:
                 ConfigEntry("redis_ip", str, default="127.0.0.1"),
                 ConfigEntry("redis_port", int, default=6379),
                 ConfigEntry("redis_db", int, default=0),
+                ConfigEntry("task_batch_size", int, default=100),
+                ConfigEntry("max_tasks_per_child", int, default=100),
+            ],
+            required=False,
+        ),
+        ConfigSection(
+            "jobs",
+            [
+                ConfigEntry("max_running_tasks", int, required=False),
+                ConfigEntry("max_running_per_channel", int, required=False),
+                ConfigEntry("max_running_per_action", dict, default=dict),
             ],
             required=False,
         ),
@@ -208,8 +224,30 @@ class Config:
                 ConfigEntry("batch_length", int, default=10),
                 ConfigEntry("batch_size", int, default=int(1e8)),
                 ConfigEntry("num_parallel_downloads", int, default=int(10)),
+                ConfigEntry("num_parallel_extractions", int, default=1),
+                ConfigEntry("max_pending_batches", int, default=1),
+                ConfigEntry("prefetch_count", int, default=100),
+            ],
+        ),
+        ConfigSection(
+            "validation",
+            [
+                ConfigEntry("page_size", int, default=1000),
+                ConfigEntry("sha256_sample_rate", float, default=0.0),
+                ConfigEntry("num_parallel_checks", int, default=4),
+                ConfigEntry("remove_missing_subdirs", bool, default=False),
             ],
         ),
+        ConfigSection(
+            "metrics",
+            [
+                ConfigEntry("hourly_retention_days", int, required=False),
+                ConfigEntry("daily_retention_days", int, required=False),
+                ConfigEntry("monthly_retention_days", int, required=False),
+                ConfigEntry("yearly_retention_days", int, required=False),
+            ],
+            required=False,
+        ),
         ConfigSection(
             "quotas",
             [
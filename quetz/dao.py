@@ -1,25 +1,57 @@
 # Copyright 2020 QuantStack
 # Distributed under the terms of the Modified BSD License.
 
+import base64
+import binascii
 import json
 import logging
 import uuid
-from collections import defaultdict
-from datetime import date, datetime
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta
+from functools import wraps
 from itertools import groupby
-from typing import TYPE_CHECKING, Dict, List, Optional
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+)
 
-from sqlalchemy import and_, func, insert, or_
+from sqlalchemy import (
+    and_,
+    bindparam,
+    delete,
+    event,
+    func,
+    insert,
+    inspect,
+    literal,
+    or_,
+    select,
+    update,
+)
 from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.exc import IntegrityError, NoResultFound  # type: ignore
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.ext.compiler import compiles
-from sqlalchemy.orm import Query, Session, aliased, joinedload
-from sqlalchemy.sql.expression import FunctionElement, Insert
-from sqlalchemy.types import DateTime
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import ColumnProperty, Query, Session, aliased, joinedload
+from sqlalchemy.orm.util import identity_key
+from sqlalchemy.sql.expression import BindParameter, FunctionElement, Insert
+from sqlalchemy.types import JSON, DateTime, LargeBinary
+from starlette.concurrency import run_in_threadpool
 
 from quetz import channel_data, errors, rest_models, versionorder
+from quetz.database import use_replica
 from quetz.database_extensions import version_match
-from quetz.utils import apply_custom_query
+from quetz.utils import apply_custom_query, package_search_order
 
 from .db_models import (
     ApiKey,
@@ -28,6 +60,7 @@ from .db_models import (
     ChannelMirror,
     Email,
     Identity,
+    MirrorSyncCheckpoint,
     Package,
     PackageMember,
     PackageVersion,
@@ -36,7 +69,9 @@ from .db_models import (
 )
 from .jobs.models import Job, JobStatus, Task, TaskStatus
 from .metrics.db_models import (
+    ChannelMetricSummary,
     IntervalType,
+    PackageMetricSummary,
     PackageVersionMetric,
     next_timestamp,
     round_timestamp,
@@ -47,6 +82,18 @@ if TYPE_CHECKING:
 
 logger = logging.getLogger("quetz")
 
+T = TypeVar("T")
+
+# sort attributes with True for descending order
+SortKeys = List[Tuple[Any, bool]]
+
+# maximum number of rows in a single multi-row INSERT statement
+UPSERT_BATCH_SIZE = 1000
+
+
+def _package_name_from_filename(filename: str) -> str:
+    return filename.rsplit("-", 2)[0]
+
 
 class date_trunc(FunctionElement):
     """round timestamp to nearest starting edge of an interval
@@ -73,11 +120,72 @@ def pg_date_trunc(element, compiler, **kw):
 @compiles(date_trunc, "sqlite")
 def sqlite_date_trunc(element, compiler, **kw):
     period, date = list(element.clauses)
+    if not isinstance(date, BindParameter):
+        # timestamps are stored as strings in the format of sqlalchemy
+        sqlite_map = {
+            "H": "%Y-%m-%d %H:00:00.000000",
+            "D": "%Y-%m-%d 00:00:00.000000",
+            "M": "%Y-%m-01 00:00:00.000000",
+            "Y": "%Y-01-01 00:00:00.000000",
+        }
+        date_sql = compiler.process(date, **kw)
+        return f"strftime('{sqlite_map[period.value.value]}', {date_sql})"
     now_interval = round_timestamp(date.value, period.value)
     date.value = now_interval
     return compiler.process(date)
 
 
+class random_uuid(FunctionElement):
+    """random 16 bytes generated by the database, for ids of inserted rows"""
+
+    name = "random_uuid"
+    type = LargeBinary(length=16)
+    inherit_cache = True
+
+
+@compiles(random_uuid, "postgresql")
+def pg_random_uuid(element, compiler, **kw):
+    return "decode(md5(random()::text || clock_timestamp()::text), 'hex')"
+
+
+@compiles(random_uuid, "sqlite")
+def sqlite_random_uuid(element, compiler, **kw):
+    return "randomblob(16)"
+
+
+class metric_series(FunctionElement):
+    """aggregate metrics into a JSON list of their timestamp and count
+
+    Arguments
+    ---------
+
+    timestamp: timestamp column, the order of the list
+
+    count: count column
+    """
+
+    name = "metric_series"
+    type = JSON()
+    inherit_cache = True
+
+
+@compiles(metric_series, "postgresql")
+def pg_metric_series(element, compiler, **kw):
+    timestamp, count = (compiler.process(c, **kw) for c in element.clauses)
+    return (
+        f"json_agg(json_build_object('timestamp', {timestamp}, 'count', {count}) "
+        f"ORDER BY {timestamp})"
+    )
+
+
+@compiles(metric_series, "sqlite")
+def sqlite_metric_series(element, compiler, **kw):
+    # the aggregate follows the order of the rows, which should be sorted by
+    # timestamp (ORDER BY in aggregates requires sqlite 3.44)
+    timestamp, count = (compiler.process(c, **kw) for c in element.clauses)
+    return f"json_group_array(json_object('timestamp', {timestamp}, 'count', {count}))"
+
+
 class Upsert(Insert):
     """Upsert for PackageVersionMetrics table. Requires a unique
     constraint to be defined.
@@ -93,7 +201,7 @@ class Upsert(Insert):
 
     column: Column to be incremented
 
-    incr: increment
+    incr: increment, if None the column is incremented by the inserted value
     """
 
     inherit_cache = False
@@ -117,6 +225,8 @@ def upsert_pg(element, compiler, **kw):
     table = element.table
 
     stmt = pg_insert(table).values(values)
+    if incr is None:
+        incr = stmt.excluded[column.name]
     stmt = stmt.on_conflict_do_update(
         index_elements=index_elements,
         set_={column.name: column + incr},
@@ -142,6 +252,8 @@ def upsert_sql(element, compiler, **kw):
 
     stmt = insert(table).values(values)
     raw_sql = compiler.process(stmt)
+    if incr is None:
+        incr = f"excluded.{column.name}"
     upsert_stmt = (
         f"ON CONFLICT ({','.join(index_elements)}) "
         f"DO UPDATE SET {column.name}={column.name}+{incr}"
@@ -150,17 +262,276 @@ def upsert_sql(element, compiler, **kw):
     return raw_sql + " " + upsert_stmt
 
 
-def get_paginated_result(query: Query, skip: int, limit: int):
-    count = query.order_by(None).count()
+def read_only(method):
+    """Run the queries of a Dao method on a read replica, if configured."""
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with use_replica(self.db):
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+def add_channel_sizes(db: Session, deltas: Mapping[str, int]):
+    """Add the size deltas (in bytes) to the channels in the current transaction."""
+
+    # sorted to lock the rows always in the same order
+    items = sorted((name, delta) for name, delta in deltas.items() if delta)
+    if not items:
+        return
+    table = Channel.__table__
+    stmt = (
+        update(table)
+        .where(table.c.name == bindparam("b_name"))
+        .values(size=func.coalesce(table.c.size, 0) + bindparam("b_delta"))
+    )
+    db.connection().execute(
+        stmt, [{"b_name": name, "b_delta": delta} for name, delta in items]
+    )
+    for name, _ in items:
+        channel = db.identity_map.get(identity_key(Channel, name))
+        if channel is not None:
+            db.expire(channel, ["size"])
+
+
+@event.listens_for(Session, "before_flush")
+def _collect_channel_sizes(session, flush_context, instances):
+    # sizes are collected before the flush, when the attributes of deleted
+    # package versions can still be loaded
+    deltas = flush_context.attributes["channel_size_deltas"] = defaultdict(int)
+    for version in session.new:
+        if isinstance(version, PackageVersion):
+            deltas[version.channel_name] += version.size or 0
+    for version in session.deleted:
+        if isinstance(version, PackageVersion):
+            deltas[version.channel_name] -= version.size or 0
+    for version in session.dirty:
+        if isinstance(version, PackageVersion):
+            history = inspect(version).attrs.size.history
+            if history.deleted or history.added:
+                deltas[version.channel_name] += sum(
+                    size or 0 for size in history.added
+                ) - sum(size or 0 for size in history.deleted)
+
+
+@event.listens_for(Session, "after_flush")
+def _update_channel_sizes(session, flush_context):
+    deltas = flush_context.attributes.get("channel_size_deltas")
+    if deltas:
+        add_channel_sizes(session, deltas)
+
+
+def _is_version_order_consistent(versions, orders) -> bool:
+    """Whether the versions sorted by version_order are sorted by VersionOrder.
+
+    Versions sharing a version_order (for example of different platforms) may
+    come in any order, but must not be newer than the versions of a lower
+    version_order. The newest versions must have version_order 0.
+    """
+
+    if versions and versions[0].version_order != 0:
+        return False
+    previous_min, group_min, group_order = None, None, None
+    for version, order in zip(versions, orders):
+        if version.version_order != group_order:
+            previous_min, group_min = group_min, order
+            group_order = version.version_order
+        elif order < group_min:
+            group_min = order
+        if previous_min is not None and order > previous_min:
+            return False
+    return True
+
+
+def count_records(query: Query, count: Optional[str] = "exact") -> Optional[int]:
+    """Number of records of the query: "exact", "estimate" or "none".
+
+    Estimates are read from the query plan on PostgreSQL, other databases
+    count exactly.
+    """
+
+    if not count or count == "none":
+        return None
+    query = query.order_by(None)
+    if count == "estimate":
+        connection = query.session.connection()
+        if connection.dialect.name == "postgresql":
+            compiled = query.statement.compile(dialect=connection.dialect)
+            plan = connection.exec_driver_sql(
+                f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params
+            ).scalar()
+            return int(plan[0]["Plan"]["Plan Rows"])
+    return query.count()
+
+
+def get_paginated_result(
+    query: Query,
+    skip: int,
+    limit: int,
+    cursor: Optional[str] = None,
+    sort_keys: Optional[SortKeys] = None,
+    count: Optional[str] = None,
+):
+    """Page of the query results, with offset or keyset pagination.
+
+    With a cursor (an empty string for the first page), the page starts
+    after the key of the previous page in the sort_keys order, instead of
+    skipping the records of all previous pages. Records are counted exactly
+    for offset pagination and not at all for keyset pagination, unless
+    count says otherwise (see :py:func:`count_records`).
+    """
+
+    if cursor is not None:
+        if sort_keys is None:
+            raise errors.ValidationError("cursor pagination is not supported")
+        return get_keyset_result(query, sort_keys, cursor, limit, count)
+
+    query_count = count_records(query, count or "exact")
     query = query.offset(skip)
     if limit >= 0:
         query = query.limit(limit)
     return {
-        "pagination": {"skip": skip, "limit": limit, "all_records_count": count},
+        "pagination": {"skip": skip, "limit": limit, "all_records_count": query_count},
         "result": query.all(),
     }
 
 
+def _encode_cursor_value(value):
+    if isinstance(value, datetime):
+        return {"datetime": value.isoformat()}
+    if isinstance(value, bytes):
+        return {"bytes": value.hex()}
+    return value
+
+
+def _decode_cursor_value(value):
+    if isinstance(value, dict) and "datetime" in value:
+        return datetime.fromisoformat(value["datetime"])
+    if isinstance(value, dict) and "bytes" in value:
+        return bytes.fromhex(value["bytes"])
+    return value
+
+
+def encode_cursor(sort_keys: SortKeys, values: list) -> str:
+    payload = {
+        "keys": [f"{attr}:{'desc' if desc else 'asc'}" for attr, desc in sort_keys],
+        "values": [_encode_cursor_value(v) for v in values],
+    }
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+
+def decode_cursor(sort_keys: SortKeys, cursor: str) -> list:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        keys, values = payload["keys"], payload["values"]
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        raise errors.ValidationError("invalid cursor")
+    if keys != [f"{attr}:{'desc' if desc else 'asc'}" for attr, desc in sort_keys]:
+        raise errors.ValidationError("cursor of a different sort order")
+    return [_decode_cursor_value(v) for v in values]
+
+
+def get_keyset_result(
+    query: Query,
+    sort_keys: SortKeys,
+    cursor: str,
+    limit: int,
+    count: Optional[str] = None,
+):
+    """Page of the query results following the cursor.
+
+    sort_keys must identify records uniquely (see :py:func:`_sort_keys`),
+    the cost of a page then does not depend on its depth. NULL values of
+    nullable keys come last in both directions.
+    """
+
+    query_count = count_records(query, count)
+
+    order = []
+    for attr, desc in sort_keys:
+        attr_order = attr.desc() if desc else attr.asc()
+        order.append(attr_order.nulls_last() if _is_nullable(attr) else attr_order)
+    query = query.order_by(None).order_by(*order)
+    if cursor:
+        values = decode_cursor(sort_keys, cursor)
+        after = []
+        for i, (attr, desc) in enumerate(sort_keys):
+            if values[i] is None:
+                # no value comes after NULL
+                continue
+            equal = [
+                a.is_(None) if v is None else a == v
+                for (a, _), v in zip(sort_keys[:i], values)
+            ]
+            following = attr < values[i] if desc else attr > values[i]
+            if _is_nullable(attr):
+                following = or_(following, attr.is_(None))
+            after.append(and_(*equal, following))
+        query = query.filter(or_(*after))
+
+    if limit >= 0:
+        # one more record tells whether there is a next page
+        rows = query.limit(limit + 1).all()
+        has_next = len(rows) > limit
+        rows = rows[:limit]
+    else:
+        rows = query.all()
+        has_next = False
+
+    next_cursor = None
+    if has_next:
+        last = rows[-1][0] if isinstance(rows[-1], Row) else rows[-1]
+        values = [getattr(last, attr.key) for attr, _ in sort_keys]
+        next_cursor = encode_cursor(sort_keys, values)
+
+    return {
+        "pagination": {
+            "limit": limit,
+            "all_records_count": query_count,
+            "next_cursor": next_cursor,
+        },
+        "result": rows,
+    }
+
+
+def _is_nullable(attr) -> bool:
+    return any(column.nullable for column in attr.property.columns)
+
+
+def _sort_keys(model, sortstr: str, strict: bool = False) -> SortKeys:
+    """Attributes and directions (True for descending) of a sort string.
+
+    The primary key is appended, so that the keys identify records. With
+    strict, fields which are not columns of the model raise an error.
+    """
+
+    keys = []
+    for s in sortstr.split(","):
+        split_result = s.split(":")
+        if len(split_result) == 2:
+            field, order = split_result
+        else:
+            field = s
+            order = "desc"
+
+        attr = getattr(model, field, None)
+        if attr is None or not isinstance(
+            getattr(attr, "property", None), ColumnProperty
+        ):
+            if strict:
+                raise errors.ValidationError(f"can not sort by {field}")
+            continue
+        keys.append((attr, order == "desc"))
+
+    mapper = inspect(model)
+    for column in mapper.primary_key:
+        attr = getattr(model, mapper.get_property_by_column(column).key)
+        if all(attr is not a for a, _ in keys):
+            keys.append((attr, False))
+    return keys
+
+
 def _parse_sort_by(query, model, sortstr: str):
     sorts = sortstr.split(",")
 
@@ -202,7 +573,15 @@ class Dao:
         except NoResultFound:
             logger.error("User not found")
 
-    def get_users(self, skip: int, limit: int, q: str, order_by: str = "username:asc"):
+    def get_users(
+        self,
+        skip: int,
+        limit: int,
+        q: str,
+        order_by: str = "username:asc",
+        cursor: Optional[str] = None,
+        count: Optional[str] = None,
+    ):
         query = (
             self.db.query(User)
             .filter(User.username.isnot(None))
@@ -220,7 +599,10 @@ class Dao:
         if limit < 0:
             return query.all()
 
-        return get_paginated_result(query, skip, limit)
+        sort_keys = None
+        if cursor is not None:
+            sort_keys = _sort_keys(User, order_by or "username:asc", strict=True)
+        return get_paginated_result(query, skip, limit, cursor, sort_keys, count)
 
     def get_user_by_username(self, username: str) -> Optional[User]:
         return (
@@ -247,6 +629,7 @@ class Dao:
             user.role = role
             self.db.commit()
 
+    @read_only
     def get_channels(
         self,
         skip: int,
@@ -254,6 +637,8 @@ class Dao:
         q: Optional[str],
         user_id: Optional[bytes],
         include_public: bool = True,
+        cursor: Optional[str] = None,
+        count: Optional[str] = None,
     ):
         query = self.db.query(Channel)
 
@@ -278,7 +663,8 @@ class Dao:
         if limit < 0:
             return query.all()
 
-        return get_paginated_result(query, skip, limit)
+        sort_keys = _sort_keys(Channel, "name:asc")
+        return get_paginated_result(query, skip, limit, cursor, sort_keys, count)
 
     def get_user_channels_with_role(
         self,
@@ -338,112 +724,151 @@ class Dao:
         package_name: Optional[str] = None,
         dry_run: bool = False,
     ):
+        """Fix inconsistencies of the packages of a channel in the database.
+
+        Packages without package versions are removed (only when cleaning up
+        the whole channel), the subdirs of the channeldata are deduplicated and
+        sorted and the version_order of the package versions is recomputed for
+        the packages where it does not follow VersionOrder. Only the rows to
+        fix are updated.
+        """
+
+        db = self.db
+
         # remove all Packages without PackageVersions
-        package_without_package_versions = []
-        all_packages = self.db.query(Package).filter(
-            Package.channel_name == channel_name
+        empty_packages = (
+            select(Package.name)
+            .where(Package.channel_name == channel_name)
+            .where(
+                ~select(PackageVersion.id)
+                .where(PackageVersion.channel_name == Package.channel_name)
+                .where(PackageVersion.package_name == Package.name)
+                .exists()
+            )
         )
         if package_name:
-            all_packages = all_packages.filter(
-                PackageVersion.package_name == package_name
-            )
-        for each_package in all_packages:
-            all_package_versions = (
-                self.db.query(PackageVersion)
-                .filter(PackageVersion.channel_name == channel_name)
-                .filter(PackageVersion.package_name == each_package.name)
+            # a package may exist without versions, it is kept when its
+            # last version is removed
+            n_empty = 0
+        else:
+            n_empty = len(db.execute(empty_packages).all())
+
+        if n_empty and not dry_run:
+            db.execute(
+                delete(PackageMember)
+                .where(PackageMember.channel_name == channel_name)
+                .where(PackageMember.package_name.in_(empty_packages))
+                .execution_options(synchronize_session=False)
             )
-            if all_package_versions.count() == 0:
-                package_without_package_versions.append(each_package.name)
-
-        for each_package_name in package_without_package_versions:
-            if not dry_run:
-                self.db.query(PackageMember).filter(
-                    PackageMember.channel_name == channel_name
-                ).filter(PackageMember.package_name == each_package_name).delete()
-
-                self.db.query(Package).filter(
-                    Package.channel_name == channel_name
-                ).filter(Package.name == each_package_name).delete()
-
-            logger.info(
-                f"removing Package {channel_name}/{each_package_name} from db as "
-                "it has no PackageVersions"
+            db.execute(
+                delete(Package)
+                .where(Package.channel_name == channel_name)
+                .where(Package.name.in_(empty_packages))
+                .execution_options(synchronize_session=False)
             )
-
-        if not dry_run:
-            self.db.commit()
+            db.commit()
+        logger.info(
+            f"removing {n_empty} Packages from {channel_name} db as "
+            "they have no PackageVersions"
+        )
 
         # clean platforms / channeldata for Packages
-        all_packages = self.db.query(Package).filter(
-            Package.channel_name == channel_name
-        )
+        packages = db.query(
+            Package.name, Package.channeldata, Package.url, Package.platforms
+        ).filter(Package.channel_name == channel_name)
         if package_name:
-            all_packages = all_packages.filter(
-                PackageVersion.package_name == package_name
+            packages = packages.filter(Package.name == package_name)
+        package_updates = []
+        for name, channeldata, url, platforms in packages.yield_per(1000):
+            if channeldata is None:
+                continue
+            data = json.loads(channeldata)
+            subdirs = data.get("subdirs")
+            if not subdirs:
+                continue
+            data["subdirs"] = sorted(set(subdirs))
+            new_values = {
+                "b_channeldata": json.dumps(data),
+                "b_url": data.get("home", ""),
+                "b_platforms": ":".join(data["subdirs"]),
+            }
+            if (channeldata, url, platforms) != tuple(new_values.values()):
+                package_updates.append({"b_name": name, **new_values})
+
+        if package_updates and not dry_run:
+            table = Package.__table__
+            db.execute(
+                update(table)
+                .where(table.c.channel_name == channel_name)
+                .where(table.c.name == bindparam("b_name"))
+                .values(
+                    channeldata=bindparam("b_channeldata"),
+                    url=bindparam("b_url"),
+                    platforms=bindparam("b_platforms"),
+                ),
+                package_updates,
             )
-        for each_package in all_packages:
-            if each_package.channeldata is not None:
-                each_package_channeldata = json.loads(each_package.channeldata)
-                subdirs = each_package_channeldata["subdirs"]
-                if subdirs:
-                    if not dry_run:
-                        subdirs = sorted(list(set(subdirs)))
-                        each_package_channeldata["subdirs"] = subdirs
-                        each_package.channeldata = json.dumps(each_package_channeldata)
-                        each_package.url = each_package_channeldata.get("home", "")
-                        each_package.platforms = ":".join(
-                            each_package_channeldata.get("subdirs", [])
-                        )
-                    logger.info(
-                        "cleaning platforms and "
-                        f"channeldata for {channel_name}/{each_package.name}"
-                    )
-
-        if not dry_run:
-            self.db.commit()
+            db.commit()
+        logger.info(
+            f"cleaning platforms and channeldata of {len(package_updates)} "
+            f"Packages in {channel_name}"
+        )
         if not package_name:
             logger.info(f"Done cleaning up db for {channel_name}")
         else:
             logger.info(f"Done cleaning up db for {channel_name}/{package_name}")
 
-        # Re-sort all PackageVersions
-        all_packages = self.db.query(Package).filter(
-            Package.channel_name == channel_name
+        # Re-sort PackageVersions of the packages where version_order
+        # is inconsistent with VersionOrder
+        versions = (
+            db.query(
+                PackageVersion.package_name,
+                PackageVersion.id,
+                PackageVersion.version,
+                PackageVersion.version_order,
+            )
+            .filter(PackageVersion.channel_name == channel_name)
+            .filter(PackageVersion.version.isnot(None))
+            .order_by(PackageVersion.package_name, PackageVersion.version_order)
         )
         if package_name:
-            all_packages = all_packages.filter(
-                PackageVersion.package_name == package_name
+            versions = versions.filter(PackageVersion.package_name == package_name)
+
+        version_updates = []
+        n_resorted = 0
+        for name, package_versions in groupby(
+            versions.yield_per(1000), key=lambda v: v.package_name
+        ):
+            package_versions = list(package_versions)
+            orders = [versionorder.VersionOrder(v.version) for v in package_versions]
+            if _is_version_order_consistent(package_versions, orders):
+                continue
+            # the sort is stable, equal versions keep their previous order
+            ranked = sorted(
+                range(len(package_versions)), key=orders.__getitem__, reverse=True
             )
-        for x, each_package in enumerate(all_packages):
-            all_versions_for_each_package = (
-                self.db.query(PackageVersion)
-                .filter(PackageVersion.channel_name == channel_name)
-                .filter(PackageVersion.package_name == each_package.name)
-                .order_by(PackageVersion.version_order.asc())
-            ).all()
-
-            if not dry_run:
-                v_dict = {}
-                for each_package_version in all_versions_for_each_package:
-                    if each_package_version.version is not None:
-                        v_dict[each_package_version] = versionorder.VersionOrder(
-                            each_package_version.version
-                        )
-                sorted_v = sorted(
-                    v_dict.items(), key=lambda item: item[1], reverse=True
-                )
-
-                for i, (each_package_version, version) in enumerate(sorted_v):
-                    each_package_version.version_order = i
-            logger.info(
-                f"Re-sorted PackageVersions for {channel_name}/{each_package.name}"
+            version_updates.extend(
+                {"b_id": package_versions[j].id, "b_version_order": i}
+                for i, j in enumerate(ranked)
+                if package_versions[j].version_order != i
             )
-
-        if not dry_run:
-            self.db.commit()
+            n_resorted += 1
+            logger.info(f"Re-sorted PackageVersions for {channel_name}/{name}")
+
+        if version_updates and not dry_run:
+            table = PackageVersion.__table__
+            db.execute(
+                update(table)
+                .where(table.c.id == bindparam("b_id"))
+                .values(version_order=bindparam("b_version_order")),
+                version_updates,
+            )
+            db.commit()
         if not package_name:
-            logger.info(f"Done sorting package versions for {channel_name}")
+            logger.info(
+                f"Done sorting package versions for {channel_name}: "
+                f"{n_resorted} packages re-sorted"
+            )
         else:
             logger.info(
                 f"Done sorting package versions for {channel_name}/{package_name}"
@@ -470,6 +895,39 @@ class Dao:
         ).delete()
         self.db.commit()
 
+    def get_mirror_checkpoint(
+        self, channel_name: str, subdir: str
+    ) -> Optional[MirrorSyncCheckpoint]:
+        return self.db.get(MirrorSyncCheckpoint, (channel_name, subdir))
+
+    def save_mirror_checkpoint(
+        self,
+        channel_name: str,
+        subdir: str,
+        repodata_sha256: str,
+        last_filename: Optional[str] = None,
+        completed: bool = False,
+    ) -> MirrorSyncCheckpoint:
+        """Record the progress of the synchronization of a mirror subdir."""
+
+        checkpoint = self.get_mirror_checkpoint(channel_name, subdir)
+        if checkpoint is None:
+            checkpoint = MirrorSyncCheckpoint(channel_name=channel_name, subdir=subdir)
+            self.db.add(checkpoint)
+        checkpoint.repodata_sha256 = repodata_sha256
+        checkpoint.last_filename = last_filename
+        checkpoint.completed = completed
+        checkpoint.time_modified = datetime.utcnow()
+        self.db.commit()
+
+        return checkpoint
+
+    def delete_mirror_checkpoints(self, channel_name: str):
+        self.db.query(MirrorSyncCheckpoint).filter(
+            MirrorSyncCheckpoint.channel_name == channel_name
+        ).delete()
+        self.db.commit()
+
     def update_channel(self, channel_name, data: dict):
         self.db.query(Channel).filter(Channel.name == channel_name).update(
             data, synchronize_session=False
@@ -482,6 +940,7 @@ class Dao:
         self.db.delete(channel)
         self.db.commit()
 
+    @read_only
     def get_packages(
         self,
         channel_name: str,
@@ -489,6 +948,8 @@ class Dao:
         limit: int,
         q: Optional[str] = None,
         order_by: Optional[str] = None,
+        cursor: Optional[str] = None,
+        count: Optional[str] = None,
     ):
         query = self.db.query(Package).filter(Package.channel_name == channel_name)
 
@@ -512,7 +973,10 @@ class Dao:
                 else:
                     query = _parse_sort_by(query, Package, order_by)
 
-        return get_paginated_result(query, skip, limit)
+        sort_keys = None
+        if cursor is not None:
+            sort_keys = _sort_keys(Package, order_by or "name:asc", strict=True)
+        return get_paginated_result(query, skip, limit, cursor, sort_keys, count)
 
     def get_user_packages(self, skip: int, limit: int, user_id: bytes):
         query = (
@@ -526,13 +990,18 @@ class Dao:
 
         return get_paginated_result(query, skip, limit)
 
+    @read_only
     def search_packages(
         self,
         keywords: List[str],
         filters: Optional[List[tuple]],
         user_id: Optional[bytes],
-        order_by: str = "name:asc",
+        order_by: Optional[str] = None,
     ):
+        """Search the packages visible to the user.
+
+        Without order_by, the results are ranked by relevance to the keywords
+        and by downloads."""
         db = self.db.query(Package).join(Channel)
         query = apply_custom_query("package", db, keywords, filters)
         if user_id:
@@ -547,9 +1016,12 @@ class Dao:
 
         if order_by:
             query = _parse_sort_by(query, Package, order_by)
+        else:
+            query = query.order_by(*package_search_order(self.db, keywords))
 
         return query.all()
 
+    @read_only
     def search_channels(
         self,
         keywords: List[str],
@@ -821,6 +1293,7 @@ class Dao:
         uploader_id,
         size,
         upsert: bool = False,
+        commit: bool = True,
     ):
         # hold a lock on the package
         package = (  # noqa
@@ -906,23 +1379,23 @@ class Dao:
             )
 
         elif upsert:
-            existing_versions.update(
-                {
-                    "filename": filename,
-                    "info": info,
-                    "uploader_id": uploader_id,
-                    "time_modified": datetime.utcnow(),
-                    "size": size,
-                },
-                synchronize_session="evaluate",
-            )
+            # updated through the ORM to account for the change of size
+            package_version.filename = filename
+            package_version.info = info
+            package_version.uploader_id = uploader_id
+            package_version.time_modified = datetime.utcnow()
+            package_version.size = size
         else:
             raise IntegrityError("duplicate package version", "", "")
 
-        self.db.commit()
+        if commit:
+            self.db.commit()
+        else:
+            self.db.flush()
 
         return package_version
 
+    @read_only
     def get_package_versions(
         self,
         package,
@@ -930,6 +1403,8 @@ class Dao:
         version_match_str: str = None,
         skip: int = 0,
         limit: int = -1,
+        cursor: Optional[str] = None,
+        count: Optional[str] = None,
     ):
         ApiKeyProfile = aliased(Profile)
 
@@ -959,7 +1434,8 @@ class Dao:
         if limit < 0:
             return query.all()
         else:
-            return get_paginated_result(query, skip, limit)
+            sort_keys = _sort_keys(PackageVersion, "version_order:asc")
+            return get_paginated_result(query, skip, limit, cursor, sort_keys, count)
 
     def get_package_version_by_filename(
         self, channel_name: str, package_name: str, filename: str, platform: str
@@ -978,13 +1454,12 @@ class Dao:
         if platform == "noarch":
             return True
 
-        return (
+        return self.db.query(
             self.db.query(PackageVersion)
             .filter(PackageVersion.channel_name == channel_name)
             .filter(PackageVersion.platform == platform)
-            .count()
-            > 0
-        )
+            .exists()
+        ).scalar()
 
     def get_package_infos(self, channel_name: str, subdir: str):
         # Returns iterator
@@ -1023,17 +1498,50 @@ class Dao:
                     f"{channel_name} is above quota of {channel_size_limit} bytes"
                 )
 
-    def update_channel_size(self, channel_name: str):
+    def update_channel_size(self, channel_name: str) -> int:
+        """Recompute the size of the channel from its package versions.
+
+        The sizes are otherwise updated incrementally when package versions
+        are added, removed or overwritten through the ORM (see
+        _collect_channel_sizes), this is only needed to reconcile them.
+
+        Returns the difference between the new and the previous size."""
+        previous_size = (
+            self.db.query(Channel.size).filter(Channel.name == channel_name).scalar()
+        )
         channel_size = (
-            self.db.query(func.sum(PackageVersion.size).label("size"))
-            .filter(PackageVersion.channel_name == channel_name)
-            .scalar()
+            select(func.coalesce(func.sum(PackageVersion.size), 0))
+            .where(PackageVersion.channel_name == channel_name)
+            .scalar_subquery()
+        )
+        self.update_channel(channel_name, {"size": channel_size})
+        new_size = (
+            self.db.query(Channel.size).filter(Channel.name == channel_name).scalar()
         )
+        return new_size - (previous_size or 0)
 
-        if channel_size is None:
-            channel_size = 0
+    def delete_package_versions(self, channel_name: str, ids: List[bytes]) -> int:
+        """Delete the package versions of a channel with the given ids in bulk.
 
-        self.update_channel(channel_name, {"size": channel_size})
+        The rows are deleted without loading them in the session, so their
+        tasks are deleted and the channel size is updated here.
+
+        Returns the number of deleted package versions."""
+        if not ids:
+            return 0
+        versions = self.db.query(PackageVersion).filter(
+            PackageVersion.channel_name == channel_name,
+            PackageVersion.id.in_(ids),
+        )
+        size = versions.with_entities(
+            func.coalesce(func.sum(PackageVersion.size), 0)
+        ).scalar()
+        self.db.query(Task).filter(Task.package_version_id.in_(ids)).delete(
+            synchronize_session=False
+        )
+        n_deleted = versions.delete(synchronize_session=False)
+        add_channel_sizes(self.db, {channel_name: -size})
+        return n_deleted
 
     def create_user_with_role(self, user_name: str, role: Optional[str] = None):
         """
@@ -1170,6 +1678,7 @@ class Dao:
             items_spec=job_model.items_spec,
             start_at=job_model.start_at,
             repeat_every_seconds=job_model.repeat_every_seconds,
+            priority=job_model.priority,
         )
         self.db.add(job)
         self.db.commit()
@@ -1183,30 +1692,50 @@ class Dao:
         timestamp: Optional[datetime] = None,
         incr: int = 1,
     ):
-        metric_name = "download"
+        self.incr_download_counts({(channel, filename, platform): incr}, timestamp)
 
-        self.db.query(PackageVersion).filter(
-            PackageVersion.channel_name == channel
-        ).filter(PackageVersion.filename == filename).filter(
-            PackageVersion.platform == platform
-        ).update({PackageVersion.download_count: PackageVersion.download_count + incr})
+    def incr_download_counts(
+        self,
+        counts: Mapping[Tuple[str, str, str], int],
+        timestamp: Optional[datetime] = None,
+    ):
+        """Increment download counts of many package files in one transaction.
+
+        counts maps (channel_name, filename, platform) to the number of
+        downloads to add.
+        """
+
+        if not counts:
+            return
+
+        metric_name = "download"
 
         if timestamp is None:
             timestamp = datetime.utcnow()
 
-        all_values = []
-        for interval in IntervalType:
-            values = {
-                "channel_name": channel,
-                "platform": platform,
-                "metric_name": metric_name,
-                "filename": filename,
-                "timestamp": date_trunc(interval, timestamp),
-                "period": interval,
-                "count": incr,
-            }
+        # sorted to lock the rows always in the same order
+        items = sorted((key, incr) for key, incr in counts.items() if incr)
 
-            all_values.append(values)
+        table = PackageVersion.__table__
+        stmt = (
+            update(table)
+            .where(table.c.channel_name == bindparam("b_channel_name"))
+            .where(table.c.filename == bindparam("b_filename"))
+            .where(table.c.platform == bindparam("b_platform"))
+            .values(download_count=table.c.download_count + bindparam("b_incr"))
+        )
+        self.db.execute(
+            stmt,
+            [
+                {
+                    "b_channel_name": channel,
+                    "b_filename": filename,
+                    "b_platform": platform,
+                    "b_incr": incr,
+                }
+                for (channel, filename, platform), incr in items
+            ],
+        )
 
         index_elements = [
             "channel_name",
@@ -1217,18 +1746,72 @@ class Dao:
             "timestamp",
         ]
 
-        stmt = Upsert(
-            PackageVersionMetric.__table__,
-            all_values,
-            index_elements,
-            PackageVersionMetric.count,
-            incr=incr,
-        )
+        channel_counts: Counter = Counter()
+        package_counts: Counter = Counter()
+        for (channel, filename, platform), incr in items:
+            channel_counts[channel] += incr
+            package_counts[(channel, _package_name_from_filename(filename))] += incr
 
-        self.db.execute(stmt)
+        for interval in IntervalType:
+            common_values = {
+                "metric_name": metric_name,
+                "timestamp": date_trunc(interval, timestamp),
+                "period": interval,
+            }
+            self._upsert_counts(
+                PackageVersionMetric,
+                [
+                    {
+                        "channel_name": channel,
+                        "platform": platform,
+                        "filename": filename,
+                        "count": incr,
+                        **common_values,
+                    }
+                    for (channel, filename, platform), incr in items
+                ],
+                index_elements,
+            )
+            self._upsert_counts(
+                ChannelMetricSummary,
+                [
+                    {"channel_name": channel, "count": incr, **common_values}
+                    for channel, incr in sorted(channel_counts.items())
+                ],
+            )
+            self._upsert_counts(
+                PackageMetricSummary,
+                [
+                    {
+                        "channel_name": channel,
+                        "package_name": package_name,
+                        "count": incr,
+                        **common_values,
+                    }
+                    for (channel, package_name), incr in sorted(package_counts.items())
+                ],
+            )
 
         self.db.commit()
 
+    def _upsert_counts(self, model, all_values: List[dict], index_elements=None):
+        """Add counts to the count column of model, inserting missing rows."""
+
+        table = model.__table__
+        if index_elements is None:
+            index_elements = [column.name for column in table.primary_key]
+
+        for start in range(0, len(all_values), UPSERT_BATCH_SIZE):
+            stmt = Upsert(
+                table,
+                all_values[start : start + UPSERT_BATCH_SIZE],
+                index_elements,
+                model.count,
+                incr=None,
+            )
+            self.db.execute(stmt)
+
+    @read_only
     def get_package_version_metrics(
         self,
         package_version_id,
@@ -1295,6 +1878,7 @@ class Dao:
         else:
             return items
 
+    @read_only
     def get_channel_metrics(
         self,
         channel_name,
@@ -1303,11 +1887,52 @@ class Dao:
         platform: Optional[str] = None,
         start: Optional[datetime] = None,
         end: Optional[datetime] = None,
+    ):
+        """Get the metrics series of each file of a channel.
+
+        The series are aggregated by the database, one row per file.
+        """
+
+        rows = (
+            self._channel_metrics_rows(
+                channel_name, period, metric_name, platform, start, end
+            )
+            .order_by(
+                PackageVersionMetric.platform,
+                PackageVersionMetric.filename,
+                PackageVersionMetric.timestamp,
+            )
+            .subquery()
+        )
+        q = (
+            select(
+                rows.c.platform,
+                rows.c.filename,
+                metric_series(rows.c.timestamp, rows.c.count),
+            )
+            .group_by(rows.c.platform, rows.c.filename)
+            .order_by(rows.c.platform, rows.c.filename)
+        )
+
+        return {
+            f"{platform}/{filename}": {"series": series}
+            for platform, filename, series in self.db.execute(q)
+        }
+
+    def _channel_metrics_rows(
+        self,
+        channel_name: str,
+        period: IntervalType,
+        metric_name: str,
+        platform: Optional[str] = None,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        after: Optional[datetime] = None,
     ):
         m = PackageVersionMetric
 
         q = (
-            self.db.query(m)
+            self.db.query(m.timestamp, m.platform, m.filename, m.count)
             .filter(m.channel_name == channel_name)
             .filter(m.period == period)
             .filter(m.metric_name == metric_name)
@@ -1316,7 +1941,101 @@ class Dao:
         if platform:
             q = q.filter(m.platform == platform)
 
-        q = q.order_by(m.platform, m.filename, m.timestamp)
+        if start:
+            q = q.filter(m.timestamp >= start)
+
+        if end:
+            q = q.filter(m.timestamp < end)
+
+        if after:
+            q = q.filter(m.timestamp > after)
+
+        return q
+
+    def get_channel_metrics_page_end(
+        self,
+        channel_name: str,
+        period: IntervalType,
+        metric_name: str,
+        limit: int,
+        platform: Optional[str] = None,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        after: Optional[datetime] = None,
+    ) -> Optional[datetime]:
+        """Timestamp of the last interval of a page of about limit metrics rows.
+
+        Pages contain whole intervals, so that the timestamp can be used as
+        cursor for the next page. Returns None if the rows after the cursor
+        fit on one page.
+        """
+
+        q = self._channel_metrics_rows(
+            channel_name, period, metric_name, platform, start, end, after
+        )
+        timestamps = q.with_entities(PackageVersionMetric.timestamp).order_by(
+            PackageVersionMetric.timestamp
+        )
+
+        page_end = timestamps.offset(limit - 1).limit(1).scalar()
+        if page_end is None:
+            return None
+
+        has_more = self.db.query(
+            timestamps.filter(PackageVersionMetric.timestamp > page_end).exists()
+        ).scalar()
+        return page_end if has_more else None
+
+    def iter_channel_metrics(
+        self,
+        channel_name: str,
+        period: IntervalType,
+        metric_name: str,
+        platform: Optional[str] = None,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        after: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        batch_size: int = 1000,
+    ):
+        """Stream (timestamp, platform, filename, count) rows in timestamp order.
+
+        Rows are fetched in batches of batch_size without creating ORM objects.
+        """
+
+        m = PackageVersionMetric
+        q = self._channel_metrics_rows(
+            channel_name, period, metric_name, platform, start, end, after
+        )
+        if until:
+            q = q.filter(m.timestamp <= until)
+
+        return q.order_by(m.timestamp, m.platform, m.filename).yield_per(batch_size)
+
+    @read_only
+    def get_metric_summary(
+        self,
+        channel_name: str,
+        period: IntervalType,
+        metric_name: str,
+        package_name: Optional[str] = None,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+    ):
+        """Get metrics summed over a channel or a package of the channel."""
+
+        if package_name is None:
+            m = ChannelMetricSummary
+            q = self.db.query(m)
+        else:
+            m = PackageMetricSummary
+            q = self.db.query(m).filter(m.package_name == package_name)
+
+        q = (
+            q.filter(m.channel_name == channel_name)
+            .filter(m.period == period)
+            .filter(m.metric_name == metric_name)
+        )
 
         if start:
             q = q.filter(m.timestamp >= start)
@@ -1324,8 +2043,207 @@ class Dao:
         if end:
             q = q.filter(m.timestamp < end)
 
-        rows_per_filename = groupby(q, key=lambda row: f"{row.platform}/{row.filename}")
+        return q.order_by(m.timestamp).all()
 
-        return {
-            filename: {"series": list(group)} for filename, group in rows_per_filename
-        }
+    def compact_metrics(
+        self,
+        channel_name: str,
+        retention: Mapping[IntervalType, Optional[timedelta]],
+        now: Optional[datetime] = None,
+    ) -> Dict[IntervalType, int]:
+        """Remove file metrics older than the retention time of their period.
+
+        Before removing rows, their counts are rolled up into the rows of the
+        next coarser period (e.g. hours into days), and only rows of complete
+        coarser intervals are removed, so that the totals are preserved.
+        Channel and package summaries are kept.
+
+        Returns the number of removed rows per period.
+        """
+
+        if now is None:
+            now = datetime.utcnow()
+
+        m = PackageVersionMetric
+        intervals = list(IntervalType)
+        removed = {}
+
+        for interval, coarser in zip(intervals, intervals[1:] + [None]):
+            if retention.get(interval) is None:
+                continue
+
+            cutoff = now - retention[interval]
+            if coarser:
+                cutoff = round_timestamp(cutoff, coarser)
+                self._rollup_metrics(channel_name, interval, coarser, cutoff)
+
+            removed[interval] = (
+                self.db.query(m)
+                .filter(m.channel_name == channel_name)
+                .filter(m.period == interval)
+                .filter(m.timestamp < cutoff)
+                .delete(synchronize_session=False)
+            )
+
+        self.db.commit()
+
+        return removed
+
+    def _rollup_metrics(
+        self,
+        channel_name: str,
+        interval: IntervalType,
+        coarser: IntervalType,
+        cutoff: datetime,
+    ):
+        """Add the counts of rows of interval older than cutoff to coarser rows.
+
+        Coarser rows are normally updated together with the finer ones, so
+        they are only raised to the sum of their finer rows (e.g. for metrics
+        imported at a single resolution), in one INSERT ... SELECT upsert.
+        """
+
+        m = PackageVersionMetric
+        timestamp = date_trunc(coarser, m.timestamp)
+        rollup = (
+            select(
+                random_uuid(),
+                m.channel_name,
+                m.platform,
+                m.filename,
+                m.metric_name,
+                literal(coarser, m.period.type),
+                timestamp,
+                func.sum(m.count),
+            )
+            .where(m.channel_name == channel_name)
+            .where(m.period == interval)
+            .where(m.timestamp < cutoff)
+            .group_by(m.platform, m.filename, m.metric_name, timestamp)
+        )
+
+        if self.db.get_bind().dialect.name == "postgresql":
+            stmt, greatest = pg_insert(m), func.greatest
+        else:
+            # max with several arguments is the scalar function in sqlite
+            stmt, greatest = sqlite_insert(m), func.max
+        stmt = stmt.from_select(
+            [
+                m.id,
+                m.channel_name,
+                m.platform,
+                m.filename,
+                m.metric_name,
+                m.period,
+                m.timestamp,
+                m.count,
+            ],
+            rollup,
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[
+                "channel_name",
+                "platform",
+                "filename",
+                "metric_name",
+                "period",
+                "timestamp",
+            ],
+            set_={"count": greatest(m.count, stmt.excluded.count)},
+        )
+        self.db.execute(stmt)
+
+
+class AsyncDao:
+    """Awaitable variants of the read methods of Dao for async endpoints.
+
+    With an AsyncSession the queries run on the asyncio engine, without
+    occupying a thread, otherwise the Dao methods run in the threadpool.
+
+    Relationships can not be lazy loaded from the event loop, so results
+    are converted (e.g. to REST models) by ``convert`` in the same context
+    as the query.
+    """
+
+    def __init__(self, db: Union[Session, AsyncSession]):
+        self.db = db
+
+    async def run(self, func: Callable[[Dao], T]) -> T:
+        """Call func with a Dao of the session."""
+
+        if isinstance(self.db, AsyncSession):
+            return await self.db.run_sync(lambda session: func(Dao(session)))
+        return await run_in_threadpool(func, Dao(self.db))
+
+    async def _call(self, method: str, *args, convert=None, **kwargs):
+        def call(dao: Dao):
+            result = getattr(dao, method)(*args, **kwargs)
+            return convert(result) if convert else result
+
+        return await self.run(call)
+
+    async def get_channel(self, channel_name: str, convert=None):
+        return await self._call("get_channel", channel_name, convert=convert)
+
+    async def get_channels(
+        self,
+        skip: int,
+        limit: int,
+        q: Optional[str],
+        user_id: Optional[bytes],
+        include_public: bool = True,
+        cursor: Optional[str] = None,
+        count: Optional[str] = None,
+        convert=None,
+    ):
+        return await self._call(
+            "get_channels",
+            skip,
+            limit,
+            q,
+            user_id,
+            include_public=include_public,
+            cursor=cursor,
+            count=count,
+            convert=convert,
+        )
+
+    async def get_package(self, channel_name: str, package_name: str, convert=None):
+        return await self._call(
+            "get_package", channel_name, package_name, convert=convert
+        )
+
+    async def get_package_versions(
+        self,
+        package,
+        time_created_ge: datetime = None,
+        version_match_str: str = None,
+        skip: int = 0,
+        limit: int = -1,
+        cursor: Optional[str] = None,
+        count: Optional[str] = None,
+        convert=None,
+    ):
+        return await self._call(
+            "get_package_versions",
+            package,
+            time_created_ge,
+            version_match_str,
+            skip,
+            limit,
+            cursor=cursor,
+            count=count,
+            convert=convert,
+        )
+
+    async def search_packages(
+        self,
+        keywords: List[str],
+        filters: Optional[List[tuple]],
+        user_id: Optional[bytes],
+        order_by: Optional[str] = None,
+        convert=None,
+    ):
+        return await self._call(
+            "search_packages", keywords, filters, user_id, order_by, convert=convert
+        )
@@ -1,22 +1,35 @@
 # Copyright 2020 QuantStack
 # Distributed under the terms of the Modified BSD License.
 import logging
+import random
 import re
 from contextlib import contextmanager
-from typing import Callable
+from typing import Callable, Dict, List, Optional, Sequence
 
-from sqlalchemy import create_engine, event
+from sqlalchemy import Select, create_engine, event
 from sqlalchemy.engine import Engine
 from sqlalchemy.engine.url import make_url
 from sqlalchemy.exc import ArgumentError
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm.session import Session
 from sqlalchemy.pool import StaticPool
+from sqlalchemy.sql.dml import UpdateBase
 
 from quetz.config import Config
 from quetz.metrics.middleware import DATABASE_CONNECTIONS_USED, DATABASE_POOL_SIZE
 
 engine = None
+async_engine = None
+replica_engines: Dict[str, Engine] = {}
+
+# asyncio drivers of the supported databases
+ASYNC_DRIVERS = {"postgresql": "asyncpg", "sqlite": "aiosqlite"}
 
 logger = logging.getLogger("quetz")
 
@@ -62,17 +75,141 @@ def get_engine(db_url, reuse_engine=True, postgres_kwargs=None, **kwargs) -> Eng
     return engine
 
 
-def get_session_maker(engine) -> Callable[[], Session]:
+def get_replica_engines(
+    replica_urls: Sequence[str], postgres_kwargs=None, **kwargs
+) -> List[Engine]:
+    """Engines of the read replicas, created once per URL."""
+
+    kwargs.pop("reuse_engine", None)
+    engines = []
+    for replica_url in replica_urls:
+        if replica_url not in replica_engines:
+            if replica_url.startswith("postgres"):
+                replica_engines[replica_url] = create_engine(
+                    replica_url,
+                    **(postgres_kwargs if postgres_kwargs else {}),
+                    **kwargs,
+                )
+            else:
+                replica_engines[replica_url] = create_engine(replica_url, **kwargs)
+        engines.append(replica_engines[replica_url])
+    return engines
+
+
+class RoutingSession(Session):
+    """Session running the queries of read-only code on read replicas.
+
+    Queries go to the primary database, except SELECT statements executed
+    within :py:meth:`use_replica` (used by the read-only Dao methods). Once
+    the session has written to the database it sticks to the primary, so
+    that it reads its own writes even though replicas lag behind.
+    """
+
+    def __init__(self, *args, replicas: Sequence[Engine] = (), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.replicas = list(replicas)
+        self.has_written = False
+        self._replica_depth = 0
+        self._replica: Optional[Engine] = None
+
+    @contextmanager
+    def use_replica(self):
+        self._replica_depth += 1
+        try:
+            yield self
+        finally:
+            self._replica_depth -= 1
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self._flushing or isinstance(clause, UpdateBase):
+            self.has_written = True
+        elif (
+            self._replica_depth
+            and self.replicas
+            and not self.has_written
+            and isinstance(clause, Select)
+            and clause._for_update_arg is None
+        ):
+            # one replica per session for consistent reads
+            if self._replica is None:
+                self._replica = random.choice(self.replicas)
+            return self._replica
+        return super().get_bind(mapper=mapper, clause=clause, **kwargs)
+
+
+def get_session_maker(
+    engine, replicas: Optional[Sequence[Engine]] = None
+) -> Callable[[], Session]:
+    if replicas:
+        return sessionmaker(
+            class_=RoutingSession,
+            autocommit=False,
+            autoflush=True,
+            bind=engine,
+            replicas=replicas,
+        )
     return sessionmaker(autocommit=False, autoflush=True, bind=engine)
 
 
-def get_session(db_url: str, **kwargs) -> Session:
+def get_session(db_url: str, replica_urls: Sequence[str] = (), **kwargs) -> Session:
     """Get a database session.
 
+    With replica_urls, read-only queries are run on the replicas (see
+    :py:class:`RoutingSession`).
+
     Important note: this function is mocked during tests!
 
     """
-    return get_session_maker(get_engine(db_url, **kwargs))()
+    replicas = get_replica_engines(replica_urls, **kwargs) if replica_urls else None
+    return get_session_maker(get_engine(db_url, **kwargs), replicas)()
+
+
+@contextmanager
+def use_replica(db: Session):
+    """Run the queries of the block on a read replica, if db has any."""
+
+    if isinstance(db, RoutingSession):
+        with db.use_replica():
+            yield
+    else:
+        yield
+
+
+def get_async_url(db_url: str) -> str:
+    """Database URL with the asyncio driver of its database."""
+
+    url = make_url(db_url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"no asyncio driver for {backend} databases")
+    url = url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}")
+    return url.render_as_string(hide_password=False)
+
+
+def get_async_engine(
+    db_url, reuse_engine=True, postgres_kwargs=None, **kwargs
+) -> AsyncEngine:
+    global async_engine
+
+    if not async_engine or not reuse_engine:
+        async_url = get_async_url(db_url)
+        if async_url.startswith("postgres"):
+            async_engine = create_async_engine(
+                async_url, **(postgres_kwargs if postgres_kwargs else {}), **kwargs
+            )
+        else:
+            async_engine = create_async_engine(async_url, **kwargs)
+
+    return async_engine
+
+
+def get_async_session(db_url: str, **kwargs) -> AsyncSession:
+    """Get a database session of the asyncio engine.
+
+    The driver of the database (asyncpg or aiosqlite) needs to be installed.
+    """
+    engine = get_async_engine(db_url, **kwargs)
+    return async_sessionmaker(engine, expire_on_commit=False)()
 
 
 @contextmanager
@@ -80,6 +217,7 @@ def get_db_manager():
     config = Config()
     db = get_session(
         db_url=config.sqlalchemy_database_url,
+        replica_urls=config.sqlalchemy_replica_urls,
         echo=config.sqlalchemy_echo_sql,
         postgres_kwargs=dict(
             pool_size=config.sqlalchemy_postgres_pool_size,
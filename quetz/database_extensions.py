@@ -74,7 +74,13 @@ class _version_match(expression.FunctionElement):
 
 @compiles(_version_match, "sqlite")
 def sqlite_version_match(element, compiler, **kw):
-    return compiler.visit_function(element)
+    return compiler.visit_function(element, **kw)
+
+
+@compiles(_version_match, "postgresql")
+def pg_version_match(element, compiler, **kw):
+    # the postgres extension registers the function as version_compare
+    return f"version_compare({compiler.process(element.clauses, **kw)})"
 
 
 if not sqlite_plugin and not pg_plugin:
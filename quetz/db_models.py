@@ -216,6 +216,10 @@ class Channel(Base):
 
     mirrors = relationship("ChannelMirror", cascade="all, delete", uselist=True)
 
+    mirror_checkpoints = relationship(
+        "MirrorSyncCheckpoint", cascade="all, delete", uselist=True
+    )
+
     members_count = column_property(
         select(func.count(ChannelMember.user_id))
         .where(ChannelMember.channel_name == name)
@@ -361,12 +365,32 @@ class ChannelMirror(Base):
     last_synchronised = Column(DateTime, default=None)
 
 
+class MirrorSyncCheckpoint(Base):
+    """Progress of an unfinished synchronization of a mirror channel subdir."""
+
+    __tablename__ = "mirror_sync_checkpoints"
+
+    channel_name = Column(String, ForeignKey("channels.name"), primary_key=True)
+    subdir = Column(String, primary_key=True)
+    repodata_sha256 = Column(String, nullable=False)
+    last_filename = Column(String, nullable=True)
+    completed = Column(Boolean, default=False, nullable=False)
+    time_modified = Column(DateTime, default=None)
+
+
 Index(
     "package_version_name_index",
     PackageVersion.channel_name,
     PackageVersion.package_name,
 )
 
+Index(
+    "package_version_platform_index",
+    PackageVersion.channel_name,
+    PackageVersion.platform,
+    PackageVersion.filename,
+)
+
 Index(
     "package_version_filename_index",
     PackageVersion.channel_name,
@@ -399,3 +423,174 @@ event.listen(
     "before_create",
     collation.execute_if(dialect="postgresql"),  # type: ignore
 )
+
+
+# Search index of the packages: on PostgreSQL, the names are indexed with
+# trigrams (pg_trgm) to serve the ILIKE '%term%' conditions and the summaries
+# and descriptions with a full-text tsvector index. SQLite uses an FTS5 table
+# with the trigram tokenizer kept in sync with triggers. packages has no
+# stable integer key (a VACUUM renumbers its rowids), so the FTS rows are
+# keyed by the id of the package in packages_fts_keys, which is indexed by
+# channel_name and name.
+#
+# Batch migrations recreate the packages table on SQLite, which drops its
+# triggers: the migration environment calls restore_sqlite_package_search_index
+# afterwards to re-create them and rebuild the index.
+PACKAGE_SEARCH_DOCUMENT = (
+    "to_tsvector('english', "
+    "coalesce(packages.summary, '') || ' ' || coalesce(packages.description, ''))"
+)
+
+pg_trgm_extension = DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+pg_package_search_indexes = [
+    DDL(
+        "CREATE INDEX IF NOT EXISTS package_name_trgm_index "
+        "ON packages USING gin (name gin_trgm_ops)"
+    ),
+    DDL(
+        "CREATE INDEX IF NOT EXISTS package_search_document_index "
+        f"ON packages USING gin (({PACKAGE_SEARCH_DOCUMENT}))"
+    ),
+]
+
+sqlite_package_search_tables = [
+    DDL(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS packages_fts USING fts5("
+        "channel_name UNINDEXED, name, summary, description, "
+        "tokenize = 'trigram')"
+    ),
+    DDL(
+        "CREATE TABLE IF NOT EXISTS packages_fts_keys ("
+        "id INTEGER PRIMARY KEY, channel_name VARCHAR NOT NULL, "
+        "name VARCHAR NOT NULL, UNIQUE (channel_name, name))"
+    ),
+]
+
+
+def _fts_key(row: str) -> str:
+    return (
+        "(SELECT id FROM packages_fts_keys "
+        f"WHERE channel_name = {row}.channel_name AND name = {row}.name)"
+    )
+
+
+def _delete_fts_row(row: str) -> str:
+    return (
+        f"DELETE FROM packages_fts WHERE rowid = {_fts_key(row)}; "
+        "DELETE FROM packages_fts_keys "
+        f"WHERE channel_name = {row}.channel_name AND name = {row}.name; "
+    )
+
+
+def _insert_fts_row(row: str) -> str:
+    return (
+        "INSERT INTO packages_fts_keys (channel_name, name) "
+        f"VALUES ({row}.channel_name, {row}.name); "
+        "INSERT INTO packages_fts (rowid, channel_name, name, summary, description) "
+        f"VALUES ({_fts_key(row)}, {row}.channel_name, {row}.name, "
+        f"{row}.summary, {row}.description); "
+    )
+
+
+# rows left behind while the triggers were missing are replaced
+sqlite_package_search_triggers = {
+    "packages_fts_insert": DDL(
+        "CREATE TRIGGER IF NOT EXISTS packages_fts_insert AFTER INSERT ON packages "
+        f"BEGIN {_delete_fts_row('new')}{_insert_fts_row('new')}END"
+    ),
+    "packages_fts_delete": DDL(
+        "CREATE TRIGGER IF NOT EXISTS packages_fts_delete AFTER DELETE ON packages "
+        f"BEGIN {_delete_fts_row('old')}END"
+    ),
+    "packages_fts_update": DDL(
+        "CREATE TRIGGER IF NOT EXISTS packages_fts_update "
+        "AFTER UPDATE OF channel_name, name, summary, description ON packages "
+        f"BEGIN {_delete_fts_row('old')}{_delete_fts_row('new')}"
+        f"{_insert_fts_row('new')}END"
+    ),
+}
+
+sqlite_package_search_indexes = sqlite_package_search_tables + list(
+    sqlite_package_search_triggers.values()
+)
+
+
+def sqlite_fts_available(ddl, target, bind, **kw):
+    """Whether the SQLite library supports FTS5 with the trigram tokenizer."""
+    if bind.dialect.name != "sqlite":
+        return False
+    version = bind.exec_driver_sql("SELECT sqlite_version()").scalar()
+    if tuple(int(v) for v in version.split(".")) < (3, 34, 0):
+        return False
+    options = bind.exec_driver_sql("PRAGMA compile_options").scalars().all()
+    return "ENABLE_FTS5" in options
+
+
+event.listen(
+    Package.__table__,
+    "before_create",
+    pg_trgm_extension.execute_if(dialect="postgresql"),  # type: ignore
+)
+
+for index_ddl in pg_package_search_indexes:
+    event.listen(
+        Package.__table__,
+        "after_create",
+        index_ddl.execute_if(dialect="postgresql"),  # type: ignore
+    )
+
+for index_ddl in sqlite_package_search_indexes:
+    event.listen(
+        Package.__table__,
+        "after_create",
+        index_ddl.execute_if(callable_=sqlite_fts_available),  # type: ignore
+    )
+
+
+def restore_sqlite_package_search_index(connection) -> bool:
+    """Re-create missing triggers of the SQLite search index and rebuild it.
+
+    Returns whether the index had to be restored.
+    """
+    tables = (
+        connection.exec_driver_sql(
+            "SELECT name FROM sqlite_master "
+            "WHERE name IN ('packages_fts', 'packages_fts_keys')"
+        )
+        .scalars()
+        .all()
+    )
+    if "packages_fts" not in tables:
+        return False
+    triggers = (
+        connection.exec_driver_sql(
+            "SELECT name FROM sqlite_master "
+            "WHERE type = 'trigger' AND tbl_name = 'packages'"
+        )
+        .scalars()
+        .all()
+    )
+    if "packages_fts_keys" in tables and set(sqlite_package_search_triggers) <= set(
+        triggers
+    ):
+        return False
+
+    for ddl in sqlite_package_search_tables:
+        connection.execute(ddl)
+    connection.exec_driver_sql("DELETE FROM packages_fts")
+    connection.exec_driver_sql("DELETE FROM packages_fts_keys")
+    connection.exec_driver_sql(
+        "INSERT INTO packages_fts_keys (channel_name, name) "
+        "SELECT channel_name, name FROM packages"
+    )
+    connection.exec_driver_sql(
+        "INSERT INTO packages_fts (rowid, channel_name, name, summary, description) "
+        "SELECT packages_fts_keys.id, packages.channel_name, packages.name, "
+        "packages.summary, packages.description FROM packages "
+        "JOIN packages_fts_keys ON packages_fts_keys.channel_name = "
+        "packages.channel_name AND packages_fts_keys.name = packages.name"
+    )
+    for ddl in sqlite_package_search_triggers.values():
+        connection.execute(ddl)
+    return True
@@ -3,24 +3,30 @@ Define common dependencies for fastapi dependency injection system
 """
 
 import logging
+from typing import Callable, Dict, FrozenSet, NamedTuple, Optional, TypeVar
 
 import requests
 from fastapi import BackgroundTasks, Depends, HTTPException, Request, status
 from requests.adapters import HTTPAdapter
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 from urllib3.util.retry import Retry
 
 from quetz import authorization, db_models
 from quetz.config import Config
-from quetz.dao import Dao
+from quetz.dao import AsyncDao, Dao
+from quetz.database import get_async_session as get_async_db_session
 from quetz.database import get_session as get_db_session
 from quetz.tasks.common import Task
+from quetz.utils import GenerationCache, invalidate_on_changes
 
 DEFAULT_TIMEOUT = 5  # seconds
 MAX_RETRIES = 3
 
 logger = logging.getLogger("quetz")
 
+T = TypeVar("T")
+
 
 class TimeoutHTTPAdapter(HTTPAdapter):
     def __init__(self, *args, **kwargs):
@@ -42,16 +48,20 @@ def get_config():
     return config
 
 
-def get_db(config: Config = Depends(get_config)):
-    database_url = config.sqlalchemy_database_url
-    db = get_db_session(
-        database_url,
+def _create_db_session(config: Config) -> Session:
+    return get_db_session(
+        config.sqlalchemy_database_url,
+        replica_urls=config.sqlalchemy_replica_urls,
         echo=config.sqlalchemy_echo_sql,
         postgres_kwargs=dict(
             pool_size=config.sqlalchemy_postgres_pool_size,
             max_overflow=config.sqlalchemy_postgres_max_overflow,
         ),
     )
+
+
+def get_db(config: Config = Depends(get_config)):
+    db = _create_db_session(config)
     try:
         yield db
     finally:
@@ -62,6 +72,38 @@ def get_dao(db: Session = Depends(get_db)):
     return Dao(db)
 
 
+async def get_async_dao():
+    """AsyncDao of the asyncio engine if async_enabled is set.
+
+    Otherwise the AsyncDao wraps a sync session and its queries run in the
+    threadpool. Unlike sync dependencies (get_db, get_config), resolving it
+    does not take a thread of the threadpool.
+    """
+
+    config = get_config()
+    if config.sqlalchemy_async_enabled:
+        async_db = get_async_db_session(
+            config.sqlalchemy_database_url,
+            echo=config.sqlalchemy_echo_sql,
+            postgres_kwargs=dict(
+                pool_size=config.sqlalchemy_postgres_pool_size,
+                max_overflow=config.sqlalchemy_postgres_max_overflow,
+            ),
+        )
+        try:
+            yield AsyncDao(async_db)
+        finally:
+            await async_db.close()
+        return
+
+    # no connection is checked out until the first query in the threadpool
+    db = _create_db_session(config)
+    try:
+        yield AsyncDao(db)
+    finally:
+        await run_in_threadpool(db.close)
+
+
 def get_session(request: Request):
     return request.session
 
@@ -84,8 +126,53 @@ def get_rules(
     request: Request,
     session: dict = Depends(get_session),
     db: Session = Depends(get_db),
+    config: Config = Depends(get_config),
 ):
-    return authorization.Rules(request.headers.get("x-api-key"), session, db)
+    return authorization.Rules(
+        request.headers.get("x-api-key"),
+        session,
+        db,
+        cache=authorization.get_shared_cache(config.general_authorization_cache_ttl),
+    )
+
+
+class AsyncRules:
+    """Authorization checks of a request for async endpoints.
+
+    The checks run with the session of the AsyncDao, on the asyncio engine
+    or in the threadpool, so the lookups of API keys and roles do not block
+    the event loop.
+    """
+
+    def __init__(self, rules: authorization.Rules, dao: AsyncDao):
+        self.rules = rules
+        self.dao = dao
+
+    async def run(self, func: Callable[[Dao, authorization.Rules], T]) -> T:
+        """Call func with a Dao and the Rules of the session of the AsyncDao."""
+
+        def call(dao: Dao):
+            self.rules.db = dao.db
+            return func(dao, self.rules)
+
+        return await self.dao.run(call)
+
+    async def get_user(self) -> Optional[bytes]:
+        return await self.run(lambda dao, auth: auth.get_user())
+
+
+async def get_async_rules(
+    request: Request,
+    dao: AsyncDao = Depends(get_async_dao),
+) -> AsyncRules:
+    config = get_config()
+    rules = authorization.Rules(
+        request.headers.get("x-api-key"),
+        request.session,
+        None,
+        cache=authorization.get_shared_cache(config.general_authorization_cache_ttl),
+    )
+    return AsyncRules(rules, dao)
 
 
 def get_tasks_worker(
@@ -98,6 +185,56 @@ def get_tasks_worker(
     return Task(auth, dao.db)
 
 
+class ChannelInfo(NamedTuple):
+    """Snapshot of the channel attributes needed to serve its files."""
+
+    name: str
+    private: bool
+    mirror_channel_url: Optional[str]
+    mirror_mode: Optional[str]
+    ttl: int
+    proxylist: FrozenSet[str]
+    lazy: bool
+
+    @classmethod
+    def from_channel(cls, channel: db_models.Channel) -> "ChannelInfo":
+        channel_metadata = channel.load_channel_metadata()
+        return cls(
+            channel.name,
+            bool(channel.private),
+            channel.mirror_channel_url,
+            channel.mirror_mode,
+            channel.ttl,
+            frozenset(channel_metadata.get("proxylist") or ()),
+            bool(channel_metadata.get("lazy")),
+        )
+
+
+class ChannelCache(GenerationCache):
+    """Channel snapshots shared by the download requests.
+
+    Entries are dropped when a session of this process changes a channel,
+    changes committed by other processes are seen after at most ttl seconds.
+    """
+
+    generation = 0
+
+
+invalidate_on_changes(ChannelCache, (db_models.Channel,))
+
+_channel_caches: Dict[float, ChannelCache] = {}
+
+
+def get_channel_cache(ttl: float) -> Optional[ChannelCache]:
+    """Cache shared by all requests of the process, None if ttl is 0."""
+
+    if ttl <= 0:
+        return None
+    if ttl not in _channel_caches:
+        _channel_caches[ttl] = ChannelCache(ttl)
+    return _channel_caches[ttl]
+
+
 class ChannelChecker:
     def __init__(
         self,
@@ -124,7 +261,10 @@ class ChannelChecker:
             )
 
         auth.assert_channel_read(channel)
+        self.check_mirror_mode(channel)
+        return channel
 
+    def check_mirror_mode(self, channel):
         mirror_url = channel.mirror_channel_url
 
         is_proxy = mirror_url and channel.mirror_mode == "proxy"
@@ -145,12 +285,47 @@ class ChannelChecker:
                 status_code=status.HTTP_405_METHOD_NOT_ALLOWED,
                 detail="This method is not implemented for local channels",
             )
+
+
+class ChannelInfoChecker(ChannelChecker):
+    """Like ChannelChecker, but returns a ChannelInfo from the channel cache.
+
+    Serving files of public channels then needs no database query.
+    """
+
+    def __call__(
+        self,
+        channel_name: str,
+        dao: Dao = Depends(get_dao),
+        auth: authorization.Rules = Depends(get_rules),
+        config: Config = Depends(get_config),
+    ) -> ChannelInfo:
+        def load():
+            channel = dao.get_channel(channel_name.lower())
+            return ChannelInfo.from_channel(channel) if channel else None
+
+        cache = get_channel_cache(config.general_channel_cache_ttl)
+        if cache is None:
+            channel = load()
+        else:
+            # unknown channels are not cached, any name can be requested
+            channel = cache.get(channel_name.lower(), load, cache_none=False)
+
+        if not channel:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Channel {channel_name} not found",
+            )
+
+        auth.assert_channel_read(channel)
+        self.check_mirror_mode(channel)
         return channel
 
 
 get_channel_or_fail = ChannelChecker(allow_proxy=False, allow_mirror=True)
 get_channel_allow_proxy = ChannelChecker(allow_proxy=True, allow_mirror=True)
 get_channel_mirror_only = ChannelChecker(allow_mirror=True, allow_local=False)
+get_channel_info_allow_proxy = ChannelInfoChecker(allow_proxy=True, allow_mirror=True)
 
 
 def get_package_or_fail(
@@ -169,3 +344,16 @@ def get_package_or_fail(
 
     auth.assert_package_read(package)
     return package
+
+
+async def get_async_package_or_fail(
+    package_name: str,
+    channel_name: str,
+    auth: AsyncRules = Depends(get_async_rules),
+) -> db_models.Package:
+    """get_package_or_fail for async endpoints, the package is loaded in the
+    session of their AsyncDao."""
+
+    return await auth.run(
+        lambda dao, rules: get_package_or_fail(package_name, channel_name, dao, rules)
+    )
@@ -91,9 +91,12 @@ def update_job(
     job: job_db_models.Job = Depends(get_job_or_fail),
     auth: authorization.Rules = Depends(get_rules),
 ):
-    """refresh job (re-run on new packages)"""
+    """refresh job (re-run on new packages) or change its priority"""
     auth.assert_jobs(owner_id=job.owner_id)
-    job.status = job_data.status  # type: ignore
+    if job_data.status is not None:
+        job.status = job_data.status  # type: ignore
+    if job_data.priority is not None:
+        job.priority = job_data.priority
 
     if job_data.force and job.status in [
         JobStatus.running,
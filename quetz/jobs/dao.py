@@ -16,6 +16,7 @@ class JobsDao:
         extra_args={},
         start_at: Optional[datetime] = None,
         repeat_every_seconds: Optional[int] = None,
+        priority: int = 0,
     ):
         extra_args_json: Optional[str]
         if extra_args:
@@ -29,6 +30,7 @@ class JobsDao:
             status=JobStatus.pending,
             start_at=start_at,
             repeat_every_seconds=repeat_every_seconds,
+            priority=priority,
         )
         self.db.add(job)
         self.db.commit()
@@ -4,12 +4,19 @@ from quetz.tasks import cleanup, indexing, mirror, reindexing
 JOB_HANDLERS = {
     "synchronize": mirror.synchronize_packages,
     "synchronize_repodata": mirror.synchronize_packages,
+    "prefetch_packages": mirror.prefetch_packages,
     "validate_packages": indexing.validate_packages,
     "generate_indexes": indexing.update_indexes,
     "reindex": reindexing.reindex_packages_from_store,
     "synchronize_metrics": metrics_tasks.synchronize_metrics_from_mirrors,
+    "compact_metrics": metrics_tasks.compact_metrics,
     "pkgstore_cleanup": cleanup.cleanup_channel_db,
     "db_cleanup": cleanup.cleanup_temp_files,
     "pkgstore_cleanup_dry_run": cleanup.cleanup_channel_db,
     "db_cleanup_dry_run": cleanup.cleanup_temp_files,
+    "reconcile_size": cleanup.reconcile_channel_size,
 }
+
+# actions which checkpoint their progress, their tasks interrupted by a
+# restart of the supervisor are run again and resume where they left off
+RESUMABLE_ACTIONS = {"synchronize", "synchronize_repodata"}
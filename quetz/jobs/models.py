@@ -7,6 +7,10 @@ from enum import Enum
 import sqlalchemy as sa
 
 from quetz.db_models import UUID, Base
+from quetz.jobs.notifications import watch_job_changes
+
+MIN_JOB_PRIORITY = -10
+MAX_JOB_PRIORITY = 10
 
 
 class JobStatus(str, Enum):
@@ -69,6 +73,9 @@ class Job(Base):
     start_at = sa.Column(sa.DateTime, nullable=True)
     repeat_every_seconds = sa.Column(sa.Integer, nullable=True)
 
+    # tasks of jobs with higher priority get a larger share of the workers
+    priority = sa.Column(sa.Integer, nullable=False, default=0, server_default="0")
+
 
 class Task(Base):
     __tablename__ = "tasks"
@@ -94,6 +101,16 @@ class Task(Base):
         backref=sa.orm.backref("tasks", cascade="all,delete-orphan"),
     )
 
+    # execution progress, reported by job functions with TaskProgress
+    started = sa.Column(sa.DateTime, nullable=True)
+    progress_done = sa.Column(sa.Integer, nullable=True)
+    progress_total = sa.Column(sa.Integer, nullable=True)
+    progress_bytes = sa.Column(sa.BigInteger, nullable=True)
+    progress_phase = sa.Column(sa.String, nullable=True)
+    progress_updated = sa.Column(sa.DateTime, nullable=True)
+    # summary of the outcome of the task (JSON), set with TaskProgress.set_result
+    result = sa.Column(sa.Text, nullable=True)
+
     def __repr__(self):
         if self.package_version:
             filename = self.package_version.filename
@@ -103,3 +120,6 @@ class Task(Base):
             f"Task(id={self.id}, package_version='{filename},"
             f" job_id={self.job_id}')"
         )
+
+
+watch_job_changes(Job, Task)
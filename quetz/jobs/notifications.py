@@ -0,0 +1,161 @@
+# Copyright 2020 QuantStack
+# Distributed under the terms of the Modified BSD License.
+"""Wake up the job supervisor when jobs or tasks change.
+
+Sessions changing jobs or tasks send a NOTIFY on PostgreSQL (delivered
+when the transaction commits) and set an event shared by all threads of
+the process. The supervisor waits for either of them with a JobWaiter
+instead of polling the job tables.
+"""
+
+import select
+import threading
+import time
+from itertools import chain
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+JOBS_CHANNEL = "quetz_jobs"
+
+_SESSION_FLAG = "quetz_jobs_changed"
+
+# notifications between threads of the same process
+_local_event = threading.Event()
+
+
+def notify_jobs_changed(db: Session):
+    """Wake up supervisors after the current transaction of db commits.
+
+    Needed after changes bypassing the ORM unit of work, such as bulk
+    inserts or updates.
+    """
+
+    db.info[_SESSION_FLAG] = True
+    if db.get_bind().dialect.name == "postgresql":
+        db.connection().exec_driver_sql(f"NOTIFY {JOBS_CHANNEL}")
+
+
+def watch_job_changes(*models):
+    """Notify supervisors on commits of sessions changing instances of models."""
+
+    def after_flush(session, flush_context):
+        changed = chain(session.new, session.dirty, session.deleted)
+        if not session.info.get(_SESSION_FLAG) and any(
+            isinstance(instance, models) for instance in changed
+        ):
+            notify_jobs_changed(session)
+
+    def after_commit(session):
+        if session.info.pop(_SESSION_FLAG, False):
+            _local_event.set()
+
+    def after_rollback(session):
+        session.info.pop(_SESSION_FLAG, None)
+
+    event.listen(Session, "after_flush", after_flush)
+    event.listen(Session, "after_commit", after_commit)
+    event.listen(Session, "after_rollback", after_rollback)
+
+
+class JobWaiter:
+    """Wait for notifications of changed jobs, or at most timeout seconds.
+
+    Only changes committed in the same process are noticed.
+    """
+
+    def wait(self, timeout: float) -> bool:
+        """Returns True if woken up by a notification."""
+
+        notified = _local_event.wait(timeout)
+        _local_event.clear()
+        return notified
+
+    def close(self):
+        pass
+
+
+class PostgresJobWaiter(JobWaiter):
+    """Wait for NOTIFY on a dedicated connection listening to the jobs channel."""
+
+    def __init__(self, engine: Engine):
+        self._connection = engine.raw_connection()
+        self._dbapi_connection = self._connection.driver_connection
+        # the connection is left in autocommit and LISTEN state, it must not
+        # go back to the pool: closing it closes the database connection
+        self._connection.detach()
+        self._dbapi_connection.autocommit = True
+        cursor = self._dbapi_connection.cursor()
+        cursor.execute(f"LISTEN {JOBS_CHANNEL}")
+        cursor.close()
+
+    def wait(self, timeout: float) -> bool:
+        conn = self._dbapi_connection
+        conn.poll()
+        if not conn.notifies:
+            ready, _, _ = select.select([conn], [], [], timeout)
+            if ready:
+                conn.poll()
+        notified = bool(conn.notifies)
+        conn.notifies.clear()
+        _local_event.clear()
+        return notified
+
+    def close(self):
+        self._connection.close()
+
+
+class SQLiteJobWaiter(JobWaiter):
+    """Detect commits of other processes with PRAGMA data_version.
+
+    The pragma is cheap and changes whenever another connection commits to
+    the database file, so it is checked every probe_interval seconds.
+    """
+
+    def __init__(self, engine: Engine, probe_interval: float = 0.05):
+        self.probe_interval = probe_interval
+        self._connection = engine.raw_connection()
+        self._data_version = self._get_data_version()
+
+    def _get_data_version(self):
+        cursor = self._connection.cursor()
+        try:
+            cursor.execute("PRAGMA data_version")
+            return cursor.fetchone()[0]
+        finally:
+            cursor.close()
+
+    def wait(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            if _local_event.wait(min(self.probe_interval, remaining)):
+                _local_event.clear()
+                return True
+            data_version = self._get_data_version()
+            if data_version != self._data_version:
+                self._data_version = data_version
+                return True
+
+    def close(self):
+        self._connection.close()
+
+
+def get_job_waiter(engine: Optional[Engine]) -> JobWaiter:
+    if engine is None or not isinstance(engine, Engine):
+        return JobWaiter()
+
+    if engine.dialect.name == "postgresql":
+        return PostgresJobWaiter(engine)
+    elif engine.dialect.name == "sqlite" and engine.url.database not in (
+        None,
+        "",
+        ":memory:",
+    ):
+        return SQLiteJobWaiter(engine)
+    else:
+        return JobWaiter()
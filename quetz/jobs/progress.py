@@ -0,0 +1,127 @@
+# Copyright 2020 QuantStack
+# Distributed under the terms of the Modified BSD License.
+"""Progress reporting for job tasks.
+
+Job functions declaring a ``progress`` argument get a TaskProgress
+instance for the task they are executing::
+
+    def my_job(channel_name: str, progress: TaskProgress):
+        files = list_files(channel_name)
+        progress.add_total(len(files))
+        for f in files:
+            process(f)
+            progress.advance(nbytes=f.size)
+
+A summary of the outcome of the task can be saved with
+``progress.set_result({"processed": n})``, it is returned with the task
+by the jobs API.
+
+Progress is saved on the task at most every ``min_interval`` seconds and
+counted in the ``quetz_task_items_processed`` and
+``quetz_task_bytes_processed`` Prometheus counters.
+"""
+
+import json
+import logging
+import time
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+import sqlalchemy as sa
+from sqlalchemy.engine import Engine
+
+from quetz.jobs.models import Task
+from quetz.metrics.middleware import TASK_BYTES_PROCESSED, TASK_ITEMS_PROCESSED
+
+logger = logging.getLogger("quetz.tasks")
+
+
+class TaskProgress:
+    """Progress of a task: items done/total, bytes processed and phase.
+
+    Without a database session or task_id the progress is only counted in
+    memory, so job functions can be called directly.
+    """
+
+    def __init__(
+        self,
+        db=None,
+        task_id: Optional[int] = None,
+        action: Optional[str] = None,
+        min_interval: float = 1.0,
+    ):
+        self.db = db
+        self.task_id = task_id
+        self.action = action or "unknown"
+        self.min_interval = min_interval
+
+        self.done = 0
+        self.total: Optional[int] = None
+        self.nbytes = 0
+        self.phase: Optional[str] = None
+        self.result: Optional[Dict[str, Any]] = None
+        self._last_write: Optional[float] = None
+
+    def add_total(self, n_items: int):
+        """Add n_items to the expected number of items."""
+
+        self.total = (self.total or 0) + n_items
+        self._maybe_write()
+
+    def set_phase(self, phase: str):
+        self.phase = phase
+        self.flush()
+
+    def set_result(self, result: Dict[str, Any]):
+        """Save a JSON-serializable summary of the outcome of the task."""
+
+        self.result = result
+        self.flush()
+
+    def advance(self, n_items: int = 1, nbytes: int = 0):
+        """Mark n_items more items as done, nbytes more bytes as processed."""
+
+        self.done += n_items
+        self.nbytes += nbytes
+        if n_items:
+            TASK_ITEMS_PROCESSED.labels(self.action).inc(n_items)
+        if nbytes:
+            TASK_BYTES_PROCESSED.labels(self.action).inc(nbytes)
+        self._maybe_write()
+
+    def _maybe_write(self):
+        now = time.monotonic()
+        if self._last_write is None or now - self._last_write >= self.min_interval:
+            self.flush()
+
+    def flush(self):
+        """Save the progress on the task."""
+
+        self._last_write = time.monotonic()
+        if self.db is None or self.task_id is None:
+            return
+
+        stmt = (
+            sa.update(Task)
+            .where(Task.id == self.task_id)
+            .values(
+                progress_done=self.done,
+                progress_total=self.total,
+                progress_bytes=self.nbytes,
+                progress_phase=self.phase,
+                progress_updated=datetime.utcnow(),
+                result=None if self.result is None else json.dumps(self.result),
+            )
+        )
+        bind = self.db.get_bind()
+        try:
+            if isinstance(bind, Engine) and bind.dialect.name == "postgresql":
+                # visible right away, independently of the job transaction
+                with bind.begin() as connection:
+                    connection.execute(stmt)
+            else:
+                # SQLite allows one writer at a time, the progress is saved
+                # with the next commit of the job
+                self.db.execute(stmt)
+        except Exception:
+            logger.exception(f"could not save progress of task {self.task_id}")
@@ -1,3 +1,4 @@
+import json
 import logging
 import pickle
 import uuid
@@ -5,10 +6,10 @@ from datetime import datetime
 from typing import Optional
 
 from importlib_metadata import entry_points as get_entry_points
-from pydantic import BaseModel, ConfigDict, Field, field_validator
+from pydantic import BaseModel, ConfigDict, Field, computed_field, field_validator
 
 from . import handlers
-from .models import JobStatus, TaskStatus
+from .models import MAX_JOB_PRIORITY, MIN_JOB_PRIORITY, JobStatus, TaskStatus
 
 logger = logging.getLogger("quetz")
 
@@ -95,6 +96,15 @@ class JobBase(BaseModel):
             "if None it is a one-off job"
         ),
     )
+    priority: int = Field(
+        0,
+        ge=MIN_JOB_PRIORITY,
+        le=MAX_JOB_PRIORITY,
+        title=(
+            "priority of the job, each level doubles the share of workers "
+            "given to its tasks"
+        ),
+    )
 
     @field_validator("manifest", mode="before")
     @classmethod
@@ -118,6 +128,9 @@ class JobUpdateModel(BaseModel):
 
     items_spec: str = Field(None, title="Item selector spec")
     status: JobStatus = Field(None, title="Change status")
+    priority: Optional[int] = Field(
+        None, ge=MIN_JOB_PRIORITY, le=MAX_JOB_PRIORITY, title="Change priority"
+    )
     force: bool = Field(False, title="force re-running job on all matching packages")
 
 
@@ -139,6 +152,25 @@ class Task(BaseModel):
     package_version: dict = Field(None, title="Package version")
     created: datetime = Field(None, title="Created at")
     status: TaskStatus = Field(None, title="Status of the task (running, paused, ...)")
+    started: Optional[datetime] = Field(None, title="Started at")
+    progress_done: Optional[int] = Field(None, title="Number of processed items")
+    progress_total: Optional[int] = Field(None, title="Total number of items")
+    progress_bytes: Optional[int] = Field(None, title="Number of processed bytes")
+    progress_phase: Optional[str] = Field(None, title="Current phase of the task")
+    progress_updated: Optional[datetime] = Field(None, title="Last progress report at")
+    result: Optional[dict] = Field(None, title="Summary of the outcome of the task")
+
+    @computed_field(  # type: ignore[misc]
+        title="Processed items per second between start and last progress report"
+    )
+    @property
+    def items_per_second(self) -> Optional[float]:
+        if not (self.started and self.progress_updated and self.progress_done):
+            return None
+        elapsed = (self.progress_updated - self.started).total_seconds()
+        if elapsed <= 0:
+            return None
+        return self.progress_done / elapsed
 
     @field_validator("package_version", mode="before")
     @classmethod
@@ -148,4 +180,11 @@ class Task(BaseModel):
         else:
             return {}
 
+    @field_validator("result", mode="before")
+    @classmethod
+    def parse_result(cls, v):
+        if isinstance(v, str):
+            return json.loads(v)
+        return v
+
     model_config = ConfigDict(from_attributes=True)
@@ -1,25 +1,45 @@
 # Copyright 2020 QuantStack
 # Distributed under the terms of the Modified BSD License.
 
+import fnmatch
 import logging
 import pickle
 import re
-import time
 from datetime import datetime, timedelta
-from typing import Dict, List
+from itertools import groupby
+from operator import attrgetter
+from typing import Callable, Dict, List, Optional
 
 import sqlalchemy as sa
 from sqlalchemy import Boolean
 from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import contains_eager, joinedload
 from sqlalchemy.sql import func
 from sqlalchemy.sql.expression import FunctionElement
 
+from quetz.database_extensions import version_match
 from quetz.db_models import PackageVersion
+from quetz.jobs.handlers import RESUMABLE_ACTIONS
 from quetz.jobs.models import ItemsSelection, Job, JobStatus, Task, TaskStatus
+from quetz.jobs.notifications import get_job_waiter, notify_jobs_changed
 from quetz.jobs.rest_models import parse_job_manifest
+from quetz.jobs.scheduling import (
+    ConcurrencyLimits,
+    RunningTasks,
+    job_action,
+    job_channel_name,
+    schedule_tasks,
+)
+from quetz.versionorder import InvalidVersionSpec, VersionOrder
 
 logger = logging.getLogger("quetz.tasks")
 
+# number of tasks inserted per statement when creating tasks of a job
+TASK_INSERT_CHUNK_SIZE = 1000
+
+# default number of tasks of a job executed by a single worker call
+TASK_BATCH_SIZE = 100
+
 
 class any_true(FunctionElement):
     inherit_cache = True
@@ -57,47 +77,200 @@ def build_queue(job):
     job.status = JobStatus.queued
 
 
+_name_pattern = re.compile(r"([a-zA-Z\*_][^\s=<>!~,|]*)\s*(.*)")
+_operator_pattern = re.compile(r"(==|!=|>=|<=|~=|>|<|=)?\s*([^\s=<>!~,|()]+)")
+
+_operators = {
+    "==": "eq",
+    "!=": "ne",
+    ">=": "gte",
+    "<=": "lte",
+    ">": "gt",
+    "<": "lt",
+    "~=": "compatible",
+    "=": "startswith",
+}
+
+_operator_symbols = {op: symbol for symbol, op in _operators.items()}
+
+
+def _parse_version_constraint(spec_str: str):
+    match = _operator_pattern.fullmatch(spec_str.strip())
+    if not match:
+        raise ValueError(f"invalid version constraint '{spec_str}'")
+    operator, version = match.groups()
+    op = _operators[operator] if operator else "eq"
+    if version.endswith("*"):
+        if op not in ("eq", "startswith"):
+            raise NotImplementedError(
+                f"version operator '{operator}' not implemented with wildcards"
+            )
+        version = version.rstrip("*").rstrip(".")
+        op = "startswith"
+    if not version:
+        raise ValueError(f"invalid version constraint '{spec_str}'")
+    return (op, version)
+
+
+def _parse_version_spec(version_str: str):
+    """Parse conda version spec where ',' (and) binds tighter than '|' (or)."""
+
+    version_spec = None
+    for any_str in version_str.split("|"):
+        all_spec = None
+        for spec_str in any_str.split(","):
+            condition = _parse_version_constraint(spec_str)
+            if all_spec:
+                all_spec = ("and", all_spec, condition)
+            else:
+                all_spec = condition
+        if version_spec:
+            version_spec = ("or", version_spec, all_spec)
+        else:
+            version_spec = all_spec
+    return version_spec
+
+
 def parse_conda_spec(conda_spec: str):
-    pattern = r"([a-zA-Z\*][^ =<>!~]*)([><!=~,\.0-9]+[0-9])?"
-    exprs_list = re.findall(pattern, conda_spec)
+    """Parse comma-separated list of conda match specs.
+
+    Every spec is a package name (``*`` acts as a wildcard) optionally
+    followed (directly or after a space) by a conda version spec, for example
+    ``numpy>=1.20,<2|>=2.1``, ``numpy=1.2`` or ``numpy 1.2.*``. Constraints
+    that follow a comma and start with an operator or a digit belong to
+    the preceding package.
+    """
 
     package_specs = []
-    for name, versions in exprs_list:
-        version_spec = None
-        for spec_str in versions.split(","):
-            if spec_str.startswith("=="):
-                condition = ("eq", spec_str[2:])
-            elif spec_str.startswith(">="):
-                condition = ("gte", spec_str[2:])
-            elif spec_str.startswith("<="):
-                condition = ("lte", spec_str[2:])
-            elif spec_str.startswith(">"):
-                condition = ("gt", spec_str[1:])
-            elif spec_str.startswith("<"):
-                condition = ("lt", spec_str[1:])
-            elif not spec_str:
-                continue
-            else:
-                raise NotImplementedError("version operator not implemented")
-            if version_spec:
-                version_spec = ("and", version_spec, condition)
+    version_strs = []
+
+    for spec_str in conda_spec.split(","):
+        spec_str = spec_str.strip()
+        if not spec_str:
+            continue
+        name_match = _name_pattern.fullmatch(spec_str)
+        if name_match:
+            name, version_str = name_match.groups()
+            if "*" in name:
+                dict_spec = {"package_name": ("like", name)}
             else:
-                version_spec = condition
-        if "*" in name:
-            dict_spec = {"package_name": ("like", name)}
+                dict_spec = {"package_name": ("eq", name)}
+            package_specs.append(dict_spec)
+            version_strs.append([version_str] if version_str else [])
+        elif package_specs:
+            version_strs[-1].append(spec_str)
         else:
-            dict_spec = {"package_name": ("eq", name)}
-        if version_spec:
-            dict_spec["version"] = version_spec
-        package_specs.append(dict_spec)
+            raise ValueError(f"version constraint '{spec_str}' without package name")
+
+    for dict_spec, versions in zip(package_specs, version_strs):
+        if versions:
+            dict_spec["version"] = _parse_version_spec(",".join(versions))
+
     return package_specs
 
 
+def format_version_spec(expr) -> str:
+    """Format parsed version spec back to a conda version spec string."""
+
+    op = expr[0]
+    if op == "and":
+        return ",".join(
+            f"({format_version_spec(v)})" if v[0] == "or" else format_version_spec(v)
+            for v in expr[1:]
+        )
+    elif op == "or":
+        return "|".join(format_version_spec(v) for v in expr[1:])
+    elif op == "startswith":
+        return f"{expr[1]}.*"
+    elif op in _operator_symbols:
+        return f"{_operator_symbols[op]}{expr[1]}"
+    else:
+        raise NotImplementedError(f"operator '{op}' not known")
+
+
+def match_version(expr, version: str) -> bool:
+    """Check a version string against a parsed version spec in Python.
+
+    Fallback for the ``version_match`` function of the database extension,
+    comparing versions with :class:`quetz.versionorder.VersionOrder`.
+    """
+
+    op = expr[0]
+    if op == "and":
+        return all(match_version(v, version) for v in expr[1:])
+    elif op == "or":
+        return any(match_version(v, version) for v in expr[1:])
+
+    try:
+        lhs = VersionOrder(version)
+        rhs = VersionOrder(expr[1])
+    except InvalidVersionSpec:
+        return False
+
+    if op == "eq":
+        return lhs == rhs
+    elif op == "ne":
+        return lhs != rhs
+    elif op == "lt":
+        return lhs < rhs
+    elif op == "gt":
+        return lhs > rhs
+    elif op == "gte":
+        return lhs >= rhs
+    elif op == "lte":
+        return lhs <= rhs
+    elif op == "startswith":
+        return lhs.startswith(rhs)
+    elif op == "compatible":
+        prefix = expr[1].rsplit(".", 1)[0]
+        return lhs >= rhs and lhs.startswith(VersionOrder(prefix))
+    else:
+        raise NotImplementedError(f"operator '{op}' not known")
+
+
+def _match_name(expr, package_name: str) -> bool:
+    op = expr[0]
+    v = expr[1:]
+    if op == "eq":
+        return package_name == v[0]
+    elif op == "in":
+        return package_name in v[0]
+    elif op == "like":
+        return fnmatch.fnmatchcase(package_name.lower(), v[0].lower())
+    else:
+        raise NotImplementedError(f"operator '{op}' not known")
+
+
+def mk_version_filter(dict_spec: List[Dict]) -> Optional[Callable[[str, str], bool]]:
+    """Make a Python predicate on (package_name, version) for the parsed spec.
+
+    Returns None if the spec does not constrain versions.
+    """
+
+    if not any("version" in el for el in dict_spec):
+        return None
+
+    def version_filter(package_name: str, version: str) -> bool:
+        for el in dict_spec:
+            if "package_name" in el and not _match_name(
+                el["package_name"], package_name
+            ):
+                continue
+            if "version" not in el or match_version(el["version"], version):
+                return True
+        return False
+
+    return version_filter
+
+
 def mk_sql_expr(dict_spec: List[Dict]):
     def _make_op(column, expr):
         op = expr[0]
         v = expr[1:]
-        if op == "eq":
+        if column is PackageVersion.version and version_match is not None:
+            # use conda version ordering of the database extension
+            return version_match(column, format_version_spec(expr))
+        elif op == "eq":
             return column == v[0]
         elif op == "in":
             return column.in_(v[0])
@@ -147,12 +320,32 @@ def build_sql_from_package_spec(selector: str):
 class Supervisor:
     """Watches for new jobs and dispatches tasks."""
 
-    def __init__(self, db, manager):
+    def __init__(
+        self,
+        db,
+        manager,
+        min_poll_interval: float = 0.05,
+        max_poll_interval: float = 60,
+        task_batch_size: int = TASK_BATCH_SIZE,
+        limits: ConcurrencyLimits = ConcurrencyLimits(),
+    ):
         self.db = db
         self.manager = manager
+        self.min_poll_interval = min_poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.task_batch_size = task_batch_size
+        num_workers = getattr(manager, "num_workers", None)
+        if limits.max_running_tasks is None and num_workers:
+            # keep tasks exceeding the worker capacity in the database, where
+            # they are ordered by job priority, instead of the executor queue
+            limits = limits._replace(max_running_tasks=num_workers * task_batch_size)
+        self.limits = limits
         self._process_cache = {}
+        # virtual times of the jobs for fair scheduling (see schedule_tasks)
+        self._virtual_times: Dict[int, float] = {}
+        # earliest time a pending job becomes due (start_at or repeat)
+        self._next_due: Optional[datetime] = None
         self._reset_tasks_after_restart()
-        pass
 
     def _select_package_versions(self, job, force=False):
         db = self.db
@@ -178,45 +371,132 @@ class Supervisor:
         else:
             raise NotImplementedError(f"selection {job.items} is not implemented")
 
-        filter_expr = build_sql_from_package_spec(job.items_spec)
-        q = q.filter(filter_expr)
+        dict_spec = parse_conda_spec(job.items_spec)
+
+        if version_match is not None:
+            return q.filter(mk_sql_expr(dict_spec)), None
+
+        # without the database extension only package names are matched in SQL,
+        # version constraints are checked with VersionOrder on the results
+        name_spec = [
+            {k: v for k, v in el.items() if k != "version"} for el in dict_spec
+        ]
+        q = q.filter(mk_sql_expr(name_spec))
+
+        return q, mk_version_filter(dict_spec)
+
+    def _create_tasks(self, job, q, version_filter, now) -> int:
+        """Create tasks of job for the package versions selected by q.
+
+        Tasks are inserted with INSERT ... SELECT when the versions are
+        selected in SQL only, otherwise the matching versions are fetched and
+        inserted in chunks of TASK_INSERT_CHUNK_SIZE, so that no ORM objects
+        are created. Returns the number of created tasks.
+        """
+
+        db = self.db
+        task_columns = [
+            Task.job_id,
+            Task.package_version_id,
+            Task.status,
+            Task.created,
+            Task.updated,
+        ]
+
+        if version_filter is None:
+            select = q.with_entities(
+                sa.literal(job.id, Task.job_id.type),
+                PackageVersion.id,
+                sa.literal(TaskStatus.created, Task.status.type),
+                sa.literal(now, Task.created.type),
+                sa.literal(now, Task.updated.type),
+            )
+            result = db.execute(
+                sa.insert(Task).from_select(task_columns, select.statement)
+            )
+            n_tasks = result.rowcount
+            logger.info(f"job {job.id}: created {n_tasks} tasks")
+        else:
+            n_tasks = 0
+            q = q.with_entities(
+                PackageVersion.id, PackageVersion.package_name, PackageVersion.version
+            ).order_by(PackageVersion.id)
+            last_id = None
+            while True:
+                chunk_q = q
+                if last_id is not None:
+                    chunk_q = chunk_q.filter(PackageVersion.id > last_id)
+                chunk = chunk_q.limit(TASK_INSERT_CHUNK_SIZE).all()
+                if not chunk:
+                    break
+                last_id = chunk[-1].id
+                rows = [
+                    {
+                        "job_id": job.id,
+                        "package_version_id": version.id,
+                        "status": TaskStatus.created,
+                        "created": now,
+                        "updated": now,
+                    }
+                    for version in chunk
+                    if version_filter(version.package_name, version.version)
+                ]
+                if rows:
+                    db.execute(sa.insert(Task), rows)
+                    n_tasks += len(rows)
+                logger.info(
+                    f"job {job.id}: created {n_tasks} tasks "
+                    f"(last package version {last_id})"
+                )
+
+        if n_tasks:
+            notify_jobs_changed(db)
+        return n_tasks
 
-        return q
+    def _set_due(self, due: datetime):
+        if self._next_due is None or due < self._next_due:
+            self._next_due = due
 
     def run_jobs(self, job_id=None, force=False):
+        """Create tasks of pending jobs, returns the number of processed jobs."""
+
         now = datetime.utcnow()
         db = self.db
         jobs = db.query(Job).filter(Job.status == JobStatus.pending)
-        if jobs.count():
-            logger.info(f"Got pending jobs: {jobs.count()}")
         if job_id:
             jobs = jobs.filter(Job.id == job_id)
+        jobs = jobs.all()
+        if jobs:
+            logger.info(f"Got pending jobs: {len(jobs)}")
+        self._next_due = None
+        n_processed = 0
         for job in jobs:
             if job.start_at and job.start_at > now:
+                self._set_due(job.start_at)
                 continue
 
             should_repeat = (
                 job.repeat_every_seconds
                 and (job.updated + timedelta(seconds=job.repeat_every_seconds)) < now
             )
+            if job.repeat_every_seconds and not should_repeat:
+                self._set_due(job.updated + timedelta(seconds=job.repeat_every_seconds))
 
             if job.items_spec is not None:
                 # it's a "package-version job"
+                n_processed += 1
 
                 try:
                     force = force or should_repeat
-                    q = self._select_package_versions(job, force=force)
+                    q, version_filter = self._select_package_versions(job, force=force)
                 except Exception as e:
                     job.status = JobStatus.failed
                     logger.error(f"got error when parsing package spec: {e}")
                     continue
 
-                task = None
-                for version in q:
-                    task = Task(job=job, package_version=version)
-                    db.add(task)
+                n_tasks = self._create_tasks(job, q, version_filter, now)
 
-                if not task and not job.repeat_every_seconds:
+                if not n_tasks and not job.repeat_every_seconds:
                     logger.info(
                         f"No new versions matching the package spec {job.items_spec}. "
                         f"Skipping job {job.id}."
@@ -229,6 +509,7 @@ class Supervisor:
             else:
                 # it's a "channel action job"
                 if not job.tasks or should_repeat:
+                    n_processed += 1
                     task = Task(job=job)
                     db.add(task)
                     job.updated = now
@@ -236,85 +517,190 @@ class Supervisor:
 
             db.commit()
 
-    def add_task_to_queue(self, db, task, *args, **kwargs):
-        """add task to the queue"""
-
-        db = self.db
-        manager = self.manager
-        _process_cache = self._process_cache
+        return n_processed
 
+    def _get_action_func(self, job):
         action_name = ""
         try:
-            action_name = task.job.manifest.decode("ascii")
-            action_func = parse_job_manifest(action_name)
+            action_name = job.manifest.decode("ascii")
+            return parse_job_manifest(action_name)
         except UnicodeDecodeError:
             try:
-                action_func = pickle.loads(task.job.manifest)
+                return pickle.loads(job.manifest)
             except pickle.UnpicklingError:
-                logger.error(
-                    f"job {task.job_id} manifest contains non-ascii characters"
-                )
+                logger.error(f"job {job.id} manifest contains non-ascii characters")
                 raise
         except ValueError:
             logger.error(f"job action {action_name} not known")
             raise
 
-        task.status = TaskStatus.pending
-        task.job.status = JobStatus.running
-        db.add(task)
+    def add_task_to_queue(self, db, task, *args, **kwargs):
+        """add task to the queue"""
+
+        return self.add_tasks_to_queue(db, [(task, kwargs)], *args)
+
+    def add_tasks_to_queue(self, db, tasks, *args):
+        """add a batch of tasks of the same job to the queue
+
+        tasks is a list of (task, kwargs) pairs, they are executed by a single
+        worker call.
+        """
+
+        db = self.db
+        manager = self.manager
+        _process_cache = self._process_cache
+
+        job = tasks[0][0].job
+        action_func = self._get_action_func(job)
+
+        for task, _ in tasks:
+            task.status = TaskStatus.pending
+        job.status = JobStatus.running
         db.commit()
-        job = manager.execute(action_func, *args, task_id=task.id, **kwargs)
-        _process_cache[task.id] = job
-        return job
+
+        if len(tasks) == 1:
+            task, kwargs = tasks[0]
+            worker_job = manager.execute(action_func, *args, task_id=task.id, **kwargs)
+        else:
+            batch = [(task.id, kwargs) for task, kwargs in tasks]
+            worker_job = manager.execute(action_func, *args, batch=batch)
+        for task, _ in tasks:
+            _process_cache[task.id] = worker_job
+        return worker_job
+
+    @staticmethod
+    def _task_kwargs(task: Task) -> dict:
+        if not task.package_version:
+            return {}
+        return {
+            "package_version": {
+                "filename": task.package_version.filename,
+                "channel_name": task.package_version.channel_name,
+                "package_format": task.package_version.package_format,
+                "platform": task.package_version.platform,
+                "version": task.package_version.version,
+                "build_string": task.package_version.build_string,
+                "build_number": task.package_version.build_number,
+                "size": task.package_version.size,
+                "package_name": task.package_version.package_name,
+                "info": task.package_version.info,
+                "uploader_id": task.package_version.uploader_id,
+            }
+        }
+
+    def _get_running_tasks(self) -> RunningTasks:
+        db = self.db
+        running = RunningTasks()
+        counts = (
+            db.query(Task.job_id, PackageVersion.channel_name, func.count(Task.id))
+            .outerjoin(PackageVersion, Task.package_version_id == PackageVersion.id)
+            .filter(Task.status.in_([TaskStatus.pending, TaskStatus.running]))
+            .group_by(Task.job_id, PackageVersion.channel_name)
+            .all()
+        )
+        job_ids = {job_id for job_id, _, _ in counts}
+        jobs = {job.id: job for job in db.query(Job).filter(Job.id.in_(job_ids))}
+        for job_id, channel_name, n_tasks in counts:
+            job = jobs[job_id]
+            running.add(channel_name or job_channel_name(job), job_action(job), n_tasks)
+        return running
 
     def run_tasks(self):
-        """dispatch tasks"""
+        """dispatch tasks
+
+        Tasks are dispatched in batches of at most task_batch_size tasks of
+        the same job per worker call. Batches of different jobs are
+        interleaved according to the job priorities, and tasks exceeding the
+        concurrency limits are left for later. With a limit on the number of
+        running tasks, only as many created tasks per job are loaded as can
+        be dispatched.
+        """
 
         db = self.db
+        running = self._get_running_tasks()
+
+        query = (
+            db.query(Task)
+            .join(Job)
+            .options(joinedload(Task.package_version), contains_eager(Task.job))
+            .filter(Task.status == TaskStatus.created)
+            .order_by(Task.job_id, Task.id)
+        )
+        if self.limits.max_running_tasks is not None:
+            # only the first tasks of each job that can be dispatched now
+            capacity = self.limits.max_running_tasks - running.total
+            if capacity <= 0:
+                return []
+            position = (
+                func.row_number()
+                .over(partition_by=Task.job_id, order_by=Task.id)
+                .label("position")
+            )
+            created = (
+                sa.select(Task.id, position)
+                .where(Task.status == TaskStatus.created)
+                .subquery()
+            )
+            query = query.filter(
+                Task.id.in_(
+                    sa.select(created.c.id).where(created.c.position <= capacity)
+                )
+            )
+        tasks = query.all()
+        if tasks:
+            logger.info(f"Got pending tasks: {len(tasks)}")
+        jobs_tasks = [
+            (job_tasks[0].job, job_tasks)
+            for job_tasks in (
+                list(job_tasks)
+                for _, job_tasks in groupby(tasks, key=attrgetter("job_id"))
+            )
+        ]
+        batches = schedule_tasks(
+            jobs_tasks,
+            self.task_batch_size,
+            running,
+            self.limits,
+            self._virtual_times,
+        )
 
-        tasks = db.query(Task).filter(Task.status == TaskStatus.created)
-        task: Task
-        if tasks.count():
-            logger.info(f"Got pending tasks: {tasks.count()}")
         jobs = []
-        for task in tasks:
-            if not task.package_version:
-                kwargs = {}
-            else:
-                kwargs = {
-                    "package_version": {
-                        "filename": task.package_version.filename,
-                        "channel_name": task.package_version.channel_name,
-                        "package_format": task.package_version.package_format,
-                        "platform": task.package_version.platform,
-                        "version": task.package_version.version,
-                        "build_string": task.package_version.build_string,
-                        "build_number": task.package_version.build_number,
-                        "size": task.package_version.size,
-                        "package_name": task.package_version.package_name,
-                        "info": task.package_version.info,
-                        "uploader_id": task.package_version.uploader_id,
-                    }
-                }
+        for batch_tasks in batches:
+            batch = [(task, self._task_kwargs(task)) for task in batch_tasks]
             try:
-                job = self.add_task_to_queue(db, task, **kwargs)
+                job = self.add_tasks_to_queue(db, batch)
                 jobs.append(job)
             except Exception:
-                logger.exception(f"task {task.id} failed due to error")
-                task.status = TaskStatus.failed
+                task_ids = ", ".join(str(task.id) for task, _ in batch)
+                logger.exception(f"tasks {task_ids} failed due to error")
+                for task, _ in batch:
+                    task.status = TaskStatus.failed
 
         db.commit()
         return jobs
 
     def _reset_tasks_after_restart(self):
         # tasks lost after restart
+        lost = Task.status.in_([TaskStatus.running, TaskStatus.pending])
+        resumable_jobs = sa.select(Job.id).where(
+            Job.manifest.in_([action.encode("ascii") for action in RESUMABLE_ACTIONS])
+        )
+
+        n_resumed = (
+            self.db.query(Task)
+            .filter(lost)
+            .filter(Task.job_id.in_(resumable_jobs))
+            .update({Task.status: TaskStatus.created}, synchronize_session=False)
+        )
         n_updated = (
             self.db.query(Task)
-            .filter(Task.status.in_([TaskStatus.running, TaskStatus.pending]))
+            .filter(lost)
             .update({Task.status: TaskStatus.failed}, synchronize_session=False)
         )
         self.db.commit()
 
+        if n_resumed > 0:
+            logger.warning(f"{n_resumed} tasks resumed after supervisor restart")
         if n_updated > 0:
             logger.warning(f"{n_updated} tasks set to failed due to supervisor restart")
 
@@ -350,17 +736,42 @@ class Supervisor:
             self.db.query(Job).filter(Job.id == job_id).update({Job.status: status})
         self.db.commit()
 
+        return len(results)
+
     def check_status(self):
-        self._update_running_jobs()
+        return self._update_running_jobs()
 
     def run_once(self):
-        self.run_jobs()
-        self.run_tasks()
-        self.check_status()
+        """Run one iteration, returns True if there was anything to do."""
+
+        n_jobs = self.run_jobs()
+        dispatched = self.run_tasks()
+        n_finished = self.check_status()
+        return bool(n_jobs or dispatched or n_finished)
+
+    def _poll_interval(self, interval: float) -> float:
+        if self._next_due is not None:
+            until_due = (self._next_due - datetime.utcnow()).total_seconds()
+            interval = min(interval, max(until_due, self.min_poll_interval))
+        return interval
 
     def run(self):
-        """main loop"""
+        """main loop
+
+        Waits for notifications of new or updated jobs and tasks between
+        iterations. Without notifications the waiting time is doubled up to
+        max_poll_interval, or until the next scheduled job is due.
+        """
 
-        while True:
-            self.run_once()
-            time.sleep(5)
+        waiter = get_job_waiter(self.db.get_bind())
+        interval = self.min_poll_interval
+        try:
+            while True:
+                if self.run_once():
+                    interval = self.min_poll_interval
+                else:
+                    interval = min(interval * 2, self.max_poll_interval)
+                if waiter.wait(self._poll_interval(interval)):
+                    interval = self.min_poll_interval
+        finally:
+            waiter.close()
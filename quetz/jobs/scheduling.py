@@ -0,0 +1,174 @@
+# Copyright 2020 QuantStack
+# Distributed under the terms of the Modified BSD License.
+"""Fair scheduling of job tasks.
+
+Tasks are dispatched in batches with weighted fair queueing: each job has a
+weight of ``2 ** priority`` and a virtual time, advanced by the number of
+dispatched tasks divided by the weight. The next batch goes to the job
+which would have the lowest virtual time after it. Higher priority jobs
+thus get a larger share of the workers, while lower priority jobs are never
+starved. The virtual times are kept across calls, so that the shares hold
+when the workers are full and only a few tasks are dispatched at a time.
+Batches are limited by the number of tasks allowed to run concurrently in
+total, per channel and per job action.
+"""
+
+import json
+from collections import Counter, deque
+from typing import Deque, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from quetz.config import Config
+from quetz.jobs.models import Job, Task
+
+
+class ConcurrencyLimits(NamedTuple):
+    """Maximum number of pending or running tasks, None for no limit."""
+
+    max_running_tasks: Optional[int] = None
+    max_running_per_channel: Optional[int] = None
+    max_running_per_action: Dict[str, int] = {}
+
+    @classmethod
+    def from_config(cls, config: Config) -> "ConcurrencyLimits":
+        if not config.configured_section("jobs"):
+            return cls()
+        return cls(
+            config.jobs_max_running_tasks,
+            config.jobs_max_running_per_channel,
+            config.jobs_max_running_per_action,
+        )
+
+
+def manifest_action(manifest: bytes) -> Optional[str]:
+    """Name of the action of a job manifest, None for pickled functions."""
+
+    try:
+        return manifest.decode("ascii")
+    except UnicodeDecodeError:
+        return None
+
+
+def job_action(job: Job) -> Optional[str]:
+    return manifest_action(job.manifest)
+
+
+def job_channel_name(job: Job) -> Optional[str]:
+    """Name of the channel of a channel action job."""
+
+    if not job.extra_args:
+        return None
+    return json.loads(job.extra_args).get("channel_name")
+
+
+def task_channel_name(task: Task) -> Optional[str]:
+    if task.package_version:
+        return task.package_version.channel_name
+    return job_channel_name(task.job)
+
+
+class RunningTasks:
+    """Counts of pending and running tasks, in total and per channel/action."""
+
+    def __init__(self):
+        self.total = 0
+        self.per_channel: Counter = Counter()
+        self.per_action: Counter = Counter()
+
+    def add(self, channel_name: Optional[str], action: Optional[str], n: int = 1):
+        self.total += n
+        if channel_name:
+            self.per_channel[channel_name] += n
+        if action:
+            self.per_action[action] += n
+
+    def can_run(
+        self,
+        channel_name: Optional[str],
+        action: Optional[str],
+        limits: ConcurrencyLimits,
+    ) -> bool:
+        if limits.max_running_tasks is not None:
+            if self.total >= limits.max_running_tasks:
+                return False
+        if channel_name and limits.max_running_per_channel is not None:
+            if self.per_channel[channel_name] >= limits.max_running_per_channel:
+                return False
+        if action and action in limits.max_running_per_action:
+            if self.per_action[action] >= limits.max_running_per_action[action]:
+                return False
+        return True
+
+
+class _JobQueue:
+    def __init__(self, job: Job, tasks: Iterable[Task]):
+        self.job = job
+        self.action = job_action(job)
+        self.weight = 2.0 ** (job.priority or 0)
+        self.tasks: Deque[Tuple[Task, Optional[str]]] = deque(
+            (task, task_channel_name(task)) for task in tasks
+        )
+
+    def take_batch(
+        self, batch_size: int, running: RunningTasks, limits: ConcurrencyLimits
+    ) -> List[Task]:
+        batch: List[Task] = []
+        deferred = []
+        while self.tasks and len(batch) < batch_size:
+            task, channel_name = self.tasks.popleft()
+            if running.can_run(channel_name, self.action, limits):
+                running.add(channel_name, self.action)
+                batch.append(task)
+            else:
+                deferred.append((task, channel_name))
+                if not running.can_run(None, self.action, limits):
+                    # global or action limit reached, no other task can run
+                    break
+        self.tasks.extendleft(reversed(deferred))
+        return batch
+
+
+def schedule_tasks(
+    jobs_tasks: Iterable[Tuple[Job, List[Task]]],
+    batch_size: int,
+    running: RunningTasks,
+    limits: ConcurrencyLimits = ConcurrencyLimits(),
+    virtual_times: Optional[Dict[int, float]] = None,
+) -> List[List[Task]]:
+    """Order tasks into batches to dispatch with weighted fair queueing.
+
+    jobs_tasks are the created tasks of each job, running the counts of
+    tasks already dispatched (updated with the scheduled tasks). Tasks which
+    can not run because of the concurrency limits are not scheduled.
+
+    virtual_times are the virtual times of the jobs by id, kept between
+    calls. They are updated in place: jobs without tasks are removed and
+    new jobs start at the lowest virtual time of the other jobs.
+    """
+
+    queues = [_JobQueue(job, tasks) for job, tasks in jobs_tasks if tasks]
+
+    if virtual_times is None:
+        virtual_times = {}
+    job_ids = {queue.job.id for queue in queues}
+    for job_id in list(virtual_times):
+        if job_id not in job_ids:
+            del virtual_times[job_id]
+    start = min(virtual_times.values(), default=0.0)
+    for job_id in job_ids:
+        virtual_times.setdefault(job_id, start)
+
+    def finish_time(queue: _JobQueue):
+        # ties go to higher priorities, then to the oldest jobs
+        finish = virtual_times[queue.job.id] + batch_size / queue.weight
+        return (finish, -queue.weight, queue.job.id)
+
+    batches = []
+    while queues:
+        queue = min(queues, key=finish_time)
+        batch = queue.take_batch(batch_size, running, limits)
+        if batch:
+            batches.append(batch)
+            virtual_times[queue.job.id] += len(batch) / queue.weight
+        if not batch or not queue.tasks:
+            queues.remove(queue)
+    return batches
@@ -13,8 +13,9 @@ from collections import Counter
 from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 from email.utils import formatdate
+from operator import itemgetter
 from tempfile import SpooledTemporaryFile, TemporaryFile
-from typing import Awaitable, Callable, List, Optional, Tuple, Type
+from typing import Awaitable, Callable, List, Optional, Type
 
 import pydantic
 import requests
@@ -65,10 +66,16 @@ from quetz.authentication.azuread import AzureADAuthenticator
 from quetz.authentication.jupyterhub import JupyterhubAuthenticator
 from quetz.authentication.pam import PAMAuthenticator
 from quetz.config import PAGINATION_LIMIT, Config, configure_logger, get_plugin_manager
-from quetz.dao import Dao
+from quetz.dao import AsyncDao, Dao
 from quetz.deps import (
+    AsyncRules,
     ChannelChecker,
+    ChannelInfo,
+    get_async_dao,
+    get_async_package_or_fail,
+    get_async_rules,
     get_channel_allow_proxy,
+    get_channel_info_allow_proxy,
     get_channel_or_fail,
     get_config,
     get_dao,
@@ -82,11 +89,16 @@ from quetz.deps import (
 from quetz.jobs import api as jobs_api
 from quetz.jobs import rest_models as jobs_rest
 from quetz.metrics import api as metrics_api
+from quetz.metrics.download_counter import DownloadCounter
 from quetz.metrics.middleware import DOWNLOAD_COUNT, UPLOAD_COUNT
 from quetz.rest_models import ChannelActionEnum, CPRole
 from quetz.tasks import indexing
 from quetz.tasks.common import Task
-from quetz.tasks.mirror import RemoteRepository, download_remote_file
+from quetz.tasks.mirror import (
+    RemoteRepository,
+    RemoteServerError,
+    download_remote_file,
+)
 from quetz.utils import (
     TicToc,
     background_task_wrapper,
@@ -126,10 +138,24 @@ if config.configured_section("cors"):
 
 # global variables for batching download counts
 
-download_counts: Counter = Counter()
-
 DOWNLOAD_INCREMENT_DELAY_SECONDS = 10
 DOWNLOAD_INCREMENT_MAX_DOWNLOADS = 50
+DOWNLOAD_COUNTS_MAX_BUFFER_SIZE = 10000
+
+
+def commit_download_counts(counts: Counter):
+    with TicToc("sync download counts"):
+        with contextmanager(get_db)(config) as db:
+            dao = get_dao(db)
+            dao.incr_download_counts(counts)
+
+
+download_counter = DownloadCounter(
+    commit_download_counts,
+    max_downloads=DOWNLOAD_INCREMENT_MAX_DOWNLOADS,
+    delay_seconds=DOWNLOAD_INCREMENT_DELAY_SECONDS,
+    max_buffer_size=DOWNLOAD_COUNTS_MAX_BUFFER_SIZE,
+)
 
 
 class CondaTokenMiddleware(BaseHTTPMiddleware):
@@ -240,7 +266,7 @@ async def check_token_revocation(session):
         valid = False
     elif identity_provider != "dummy":
         auth_obj = auth_registry.enabled_authenticators[identity_provider]
-        valid = await auth_obj.validate_token(session.get("token"))
+        valid = await auth_obj.check_token(session.get("token"))
     if not valid:
         logout(session)
         raise HTTPException(
@@ -255,6 +281,26 @@ def logout(session):
     session.pop("token", None)
 
 
+def validate_all(model, key=None, paginated=False):
+    """Convert the query results of an AsyncDao method to REST models.
+
+    key selects the object to validate from each result row.
+    """
+
+    def validate(results):
+        return [model.model_validate(key(r) if key else r) for r in results]
+
+    def convert(results):
+        if paginated:
+            return {
+                "pagination": results["pagination"],
+                "result": validate(results["result"]),
+            }
+        return validate(results)
+
+    return convert
+
+
 # custom exception handlers
 @app.exception_handler(errors.ValidationError)
 async def unicorn_exception_handler(request: Request, exc: errors.ValidationError):
@@ -308,10 +354,10 @@ async def me(
     return profile
 
 
-def get_users_handler(dao, q, auth, skip, limit):
+def get_users_handler(dao, q, auth, skip, limit, cursor=None, count=None):
     user_id = auth.assert_user()
 
-    results = dao.get_users(skip, limit, q)
+    results = dao.get_users(skip, limit, q, cursor=cursor, count=count)
 
     user_list = results["result"] if "result" in results else results
 
@@ -346,9 +392,16 @@ def get_paginated_users(
     skip: int = 0,
     limit: int = PAGINATION_LIMIT,
     q: str = None,
+    cursor: Optional[str] = None,
+    count: Optional[rest_models.CountMode] = None,
     auth: authorization.Rules = Depends(get_rules),
 ):
-    return get_users_handler(dao, q, auth, skip, limit)
+    """List users, as a paginated response
+
+    Pages are selected with skip, or with the next_cursor of the previous
+    page (an empty cursor for the first page) which is faster for deep pages.
+    """
+    return get_users_handler(dao, q, auth, skip, limit, cursor, count)
 
 
 @api_router.get("/users/{username}", response_model=rest_models.User, tags=["users"])
@@ -522,16 +575,23 @@ def set_user_role(
 @api_router.get(
     "/channels", response_model=List[rest_models.ChannelExtra], tags=["channels"]
 )
-def get_channels(
+async def get_channels(
     public: bool = True,
-    dao: Dao = Depends(get_dao),
+    dao: AsyncDao = Depends(get_async_dao),
     q: str = None,
-    auth: authorization.Rules = Depends(get_rules),
+    auth: AsyncRules = Depends(get_async_rules),
 ):
     """List all channels"""
 
-    user_id = auth.get_user()
-    return dao.get_channels(0, -1, q, user_id, include_public=public)
+    user_id = await auth.get_user()
+    return await dao.get_channels(
+        0,
+        -1,
+        q,
+        user_id,
+        include_public=public,
+        convert=validate_all(rest_models.ChannelExtra),
+    )
 
 
 @api_router.get(
@@ -539,17 +599,32 @@ def get_channels(
     response_model=rest_models.PaginatedResponse[rest_models.ChannelExtra],
     tags=["channels"],
 )
-def get_paginated_channels(
-    dao: Dao = Depends(get_dao),
+async def get_paginated_channels(
+    dao: AsyncDao = Depends(get_async_dao),
     skip: int = 0,
     limit: int = PAGINATION_LIMIT,
     public: bool = True,
     q: str = None,
-    auth: authorization.Rules = Depends(get_rules),
+    cursor: Optional[str] = None,
+    count: Optional[rest_models.CountMode] = None,
+    auth: AsyncRules = Depends(get_async_rules),
 ):
-    """List all channels, as a paginated response"""
-    user_id = auth.get_user()
-    return dao.get_channels(skip, limit, q, user_id, include_public=public)
+    """List all channels, as a paginated response
+
+    Pages are selected with skip, or with the next_cursor of the previous
+    page (an empty cursor for the first page) which is faster for deep pages.
+    """
+    user_id = await auth.get_user()
+    return await dao.get_channels(
+        skip,
+        limit,
+        q,
+        user_id,
+        include_public=public,
+        cursor=cursor,
+        count=count,
+        convert=validate_all(rest_models.ChannelExtra, paginated=True),
+    )
 
 
 @api_router.get(
@@ -680,6 +755,7 @@ def put_mirror_channel_actions(
         channel,
         start_at=action.start_at,
         repeat_every_seconds=action.repeat_every_seconds,
+        priority=action.priority,
     )
     return new_job
 
@@ -849,14 +925,17 @@ def get_paginated_packages(
     limit: int = PAGINATION_LIMIT,
     q: Optional[str] = None,
     order_by: Optional[str] = None,
+    cursor: Optional[str] = None,
+    count: Optional[rest_models.CountMode] = None,
 ):
     """
     Retrieve all packages in a channel.
     A limit of -1 returns an unpaginated result with all packages. Otherwise, pagination
-    is applied.
+    is applied: pages are selected with skip, or with the next_cursor of the previous
+    page (an empty cursor for the first page) which is faster for deep pages.
     """
 
-    return dao.get_packages(channel.name, skip, limit, q, order_by)
+    return dao.get_packages(channel.name, skip, limit, q, order_by, cursor, count)
 
 
 @api_router.get(
@@ -900,8 +979,6 @@ def delete_package(
         if not config.storage_soft_delete_package:
             pkgstore.delete_file(channel_name, filename)
 
-    dao.update_channel_size(channel_name)
-
     wrapped_bg_task = background_task_wrapper(indexing.update_indexes, logger)
     # Background task to update indexes
     background_tasks.add_task(wrapped_bg_task, dao, pkgstore, channel_name, platforms)
@@ -1147,22 +1224,18 @@ def post_package_member(
     response_model=List[rest_models.PackageVersion],
     tags=["packages"],
 )
-def get_package_versions(
-    package: db_models.Package = Depends(get_package_or_fail),
-    dao: Dao = Depends(get_dao),
+async def get_package_versions(
+    package: db_models.Package = Depends(get_async_package_or_fail),
+    dao: AsyncDao = Depends(get_async_dao),
     time_created__ge: datetime.datetime = None,
     version_match_str: str = None,
 ):
-    version_profile_list = dao.get_package_versions(
-        package, time_created__ge, version_match_str
+    return await dao.get_package_versions(
+        package,
+        time_created__ge,
+        version_match_str,
+        convert=validate_all(rest_models.PackageVersion, key=itemgetter(0)),
     )
-    version_list = []
-
-    for version, profile, api_key_profile in version_profile_list:
-        version_data = rest_models.PackageVersion.model_validate(version)
-        version_list.append(version_data)
-
-    return version_list
 
 
 @api_router.get(
@@ -1170,27 +1243,28 @@ def get_package_versions(
     response_model=rest_models.PaginatedResponse[rest_models.PackageVersion],
     tags=["packages"],
 )
-def get_paginated_package_versions(
-    package: db_models.Package = Depends(get_package_or_fail),
-    dao: Dao = Depends(get_dao),
+async def get_paginated_package_versions(
+    package: db_models.Package = Depends(get_async_package_or_fail),
+    dao: AsyncDao = Depends(get_async_dao),
     skip: int = 0,
     limit: int = PAGINATION_LIMIT,
     time_created__ge: datetime.datetime = None,
     version_match_str: str = None,
+    cursor: Optional[str] = None,
+    count: Optional[rest_models.CountMode] = None,
 ):
-    version_profile_list = dao.get_package_versions(
-        package, time_created__ge, version_match_str, skip, limit
+    return await dao.get_package_versions(
+        package,
+        time_created__ge,
+        version_match_str,
+        skip,
+        limit,
+        cursor=cursor,
+        count=count,
+        convert=validate_all(
+            rest_models.PackageVersion, key=itemgetter(0), paginated=True
+        ),
     )
-    version_list = []
-
-    for version, profile, api_key_profile in version_profile_list["result"]:
-        version_data = rest_models.PackageVersion.model_validate(version)
-        version_list.append(version_data)
-
-    return {
-        "pagination": version_profile_list["pagination"],
-        "result": version_list,
-    }
 
 
 @api_router.get(
@@ -1258,7 +1332,6 @@ def delete_package_version(
         pkgstore.delete_file(channel_name, path)
 
     dao.cleanup_channel_db(channel_name, package_name)
-    dao.update_channel_size(channel_name)
 
     wrapped_bg_task = background_task_wrapper(indexing.update_indexes, logger)
     # Background task to update indexes
@@ -1268,14 +1341,16 @@ def delete_package_version(
 @api_router.get(
     "/packages/search/", response_model=List[rest_models.PackageSearch], tags=["search"]
 )
-def search(
+async def search(
     q: str,
-    dao: Dao = Depends(get_dao),
-    auth: authorization.Rules = Depends(get_rules),
+    dao: AsyncDao = Depends(get_async_dao),
+    auth: AsyncRules = Depends(get_async_rules),
 ):
-    user_id = auth.get_user()
+    user_id = await auth.get_user()
     keywords, filters = parse_query("package", q)
-    return dao.search_packages(keywords, filters, user_id)
+    return await dao.search_packages(
+        keywords, filters, user_id, convert=validate_all(rest_models.PackageSearch)
+    )
 
 
 @api_router.get(
@@ -1446,7 +1521,6 @@ def post_file_to_package(
     ),
 ):
     handle_package_files(package.channel, files, dao, auth, force, package=package)
-    dao.update_channel_size(package.channel_name)
 
     wrapped_bg_task = background_task_wrapper(indexing.update_indexes, logger)
     # Background task to update indexes
@@ -1551,8 +1625,6 @@ def post_file_to_channel(
 ):
     handle_package_files(channel, files, dao, auth, force)
 
-    dao.update_channel_size(channel.name)
-
     wrapped_bg_task = background_task_wrapper(indexing.update_indexes, logger)
     # Background task to update indexes
     background_tasks.add_task(wrapped_bg_task, dao, pkgstore, channel.name)
@@ -1624,6 +1696,26 @@ def handle_package_files(
     # to the owner of that API Key and not the anonymous API Key itself.
     user_id = auth.assert_owner()
 
+    channel_proxylist = check_package_files(
+        channel, files, dao, auth, force, is_mirror_op
+    )
+    conda_infos = extract_and_upload_package_files(
+        channel.name, files, channel_proxylist, force
+    )
+    register_package_files(
+        channel, files, conda_infos, dao, user_id, channel_proxylist, force, package
+    )
+
+
+def check_package_files(
+    channel, files, dao, auth, force, is_mirror_op=False, reserved_size=0
+):
+    """Check that files may be uploaded to channel, returns the proxylist.
+
+    reserved_size bytes of files which were checked but are not added yet
+    are counted in the size of the channel.
+    """
+
     # quick fail if not allowed to upload
     # note: we're checking later that `parts[0] == conda_info.package_name`
     total_size = 0
@@ -1649,7 +1741,7 @@ def handle_package_files(
         total_size += size
         file.file.seek(0)
 
-    dao.assert_size_limits(channel.name, total_size)
+    dao.assert_size_limits(channel.name, reserved_size + total_size)
 
     channel_proxylist = []
     if channel.mirror_mode:
@@ -1663,33 +1755,53 @@ def handle_package_files(
                 "proxylist", []
             )
 
-    pkgstore.create_channel(channel.name)
-    nthreads = config.general_package_unpack_threads
+    return channel_proxylist
+
+
+def extract_and_upload_package(file, channel_name, channel_proxylist, force: bool):
+    """Extract the metadata of a package file and add it to the package store.
+
+    Does not access the database, so it can run in any thread.
+    """
+
+    try:
+        return _extract_and_upload_package(file, channel_name, channel_proxylist, force)
+    except FileExistsError as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Duplicate {str(e)}",
+        )
+    except exceptions.PackageError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=e.detail)
+
+
+def extract_and_upload_package_files(
+    channel_name, files, channel_proxylist, force, nthreads=None
+):
+    pkgstore.create_channel(channel_name)
+    if nthreads is None:
+        nthreads = config.general_package_unpack_threads
     with ThreadPoolExecutor(max_workers=nthreads) as executor:
-        try:
-            conda_infos = [
-                ci
-                for ci in executor.map(
-                    _extract_and_upload_package,
-                    files,
-                    (channel.name,) * len(files),
-                    (channel_proxylist,) * len(files),
-                    (force,) * len(files),
-                )
-            ]
-        except FileExistsError as e:
-            raise HTTPException(
-                status_code=status.HTTP_409_CONFLICT,
-                detail=f"Duplicate {str(e)}",
-            )
-        except exceptions.PackageError as e:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST, detail=e.detail
+        return list(
+            executor.map(
+                extract_and_upload_package,
+                files,
+                (channel_name,) * len(files),
+                (channel_proxylist,) * len(files),
+                (force,) * len(files),
             )
+        )
+
 
-    conda_infos = [ci for ci in conda_infos if ci is not None]
+def register_package_files(
+    channel, files, conda_infos, dao, user_id, channel_proxylist, force, package=None
+):
+    """Add the package files extracted by extract_and_upload_package_files
+    to the database."""
 
-    for file, condainfo in zip(files, conda_infos):
+    extracted = [(f, ci) for f, ci in zip(files, conda_infos) if ci is not None]
+
+    for file, condainfo in extracted:
         logger.debug(f"Handling {condainfo.info['name']} -> {file.filename}")
 
         def _delete_file(condainfo, filename):
@@ -1820,47 +1932,20 @@ def invalid_api():
 
 @app.on_event("startup")
 def start_sync_download_counts():
-    global download_counts
     wait_time = 1  # seconds
 
-    db_manager = contextmanager(get_db)
-
-    def commit_to_db(counts):
-        count: int
-        package = Tuple[str, str, str]
-
-        with TicToc("sync download counts"):
-            with db_manager(config) as db:
-                dao = get_dao(db)
-                for package, count in counts.items():
-                    dao.incr_download_count(*package, incr=count)
-
     async def task():
-        last_download_sync = None
-        increment_delay = datetime.timedelta(seconds=DOWNLOAD_INCREMENT_DELAY_SECONDS)
         try:
             while True:
-                n_total_downloads = sum(download_counts.values())
-                now = datetime.datetime.utcnow()
-                if n_total_downloads < DOWNLOAD_INCREMENT_MAX_DOWNLOADS:
-                    if not n_total_downloads or (
-                        last_download_sync
-                        and (last_download_sync + increment_delay) > now
-                    ):
-                        await asyncio.sleep(wait_time)
-                        continue
-                logger.debug(
-                    "Download counts: time since last sync %s, n/o downloads: %s",
-                    now - (last_download_sync or now),
-                    n_total_downloads,
-                )
-                new_items = download_counts.copy()
-                download_counts.clear()
-                await run_in_threadpool(commit_to_db, new_items)
-                last_download_sync = now
+                if download_counter.should_flush():
+                    logger.debug(
+                        "Download counts: n/o downloads: %s", len(download_counter)
+                    )
+                    await run_in_threadpool(download_counter.flush)
+                await asyncio.sleep(wait_time)
         except asyncio.CancelledError:
-            commit_to_db(download_counts)
-            download_counts.clear()
+            # save remaining counts before shutting down
+            download_counter.flush()
             raise
 
     app.sync_download_task = asyncio.create_task(task())
@@ -1879,7 +1964,7 @@ async def stop_sync_download_counts():
 @app.get("/get/{channel_name}/{path:path}")
 def serve_path(
     path,
-    channel: db_models.Channel = Depends(get_channel_allow_proxy),
+    channel: ChannelInfo = Depends(get_channel_info_allow_proxy),
     accept_encoding: Optional[str] = Header(None),
     session=Depends(get_remote_session),
     dao: Dao = Depends(get_dao),
@@ -1901,16 +1986,43 @@ def serve_path(
                 version=version,
                 package_type=package_type,
             ).inc()
-            download_counts[(channel.name, filename, platform)] += 1
+            download_counter.add(channel.name, filename, platform)
         except ValueError:
             pass
 
     if is_package_request and channel.mirror_channel_url:
         # if we exclude the package from syncing, redirect to original URL
-        channel_proxylist = json.loads(channel.channel_metadata).get("proxylist", [])
-        if channel_proxylist and package_name and package_name in channel_proxylist:
+        if package_name and package_name in channel.proxylist:
             return RedirectResponse(f"{channel.mirror_channel_url}/{path}")
 
+        # lazy mirrors fetch the files of registered packages on first request
+        if (
+            channel.mirror_mode == "mirror"
+            and channel.lazy
+            and package_name
+            and not pkgstore.file_exists(channel.name, path)
+        ):
+            version = dao.get_package_version_by_filename(
+                channel.name, package_name, filename, platform
+            )
+            if version:
+                # the file is only stored if it matches the registered checksum
+                repository = RemoteRepository(channel.mirror_channel_url, session)
+                try:
+                    download_remote_file(
+                        repository,
+                        pkgstore,
+                        channel.name,
+                        path,
+                        json.loads(version.info),
+                    )
+                except RemoteServerError as exc:
+                    logger.error(f"could not fetch {path} of {channel.name}: {exc}")
+                    raise HTTPException(
+                        status_code=status.HTTP_502_BAD_GATEWAY,
+                        detail=f"{path} could not be fetched from the upstream channel",
+                    )
+
     if channel.mirror_channel_url and channel.mirror_mode == "proxy":
         repository = RemoteRepository(channel.mirror_channel_url, session)
         if not pkgstore.file_exists(channel.name, path):
@@ -1977,7 +2089,7 @@ def serve_path(
 
 @app.get("/get/{channel_name}")
 def serve_channel_index(
-    channel: db_models.Channel = Depends(get_channel_allow_proxy),
+    channel: ChannelInfo = Depends(get_channel_info_allow_proxy),
     accept_encoding: Optional[str] = Header(None),
     session=Depends(get_remote_session),
     dao: Dao = Depends(get_dao),
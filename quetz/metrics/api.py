@@ -1,7 +1,10 @@
+import json
 from datetime import datetime
+from itertools import islice
 from typing import Optional
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
 
 from quetz import db_models
 from quetz.dao import Dao
@@ -81,5 +84,155 @@ def get_channel_metrics(
     }
 
 
+@api_router.get(
+    "/channels/{channel_name}/summary",
+    response_model=rest_models.MetricSummaryResponse,
+    tags=["metrics"],
+)
+def get_channel_metric_summary(
+    channel_name: str,
+    period: IntervalType = IntervalType.day,
+    metric_name: str = "download",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    dao: Dao = Depends(get_dao),
+):
+    series = dao.get_metric_summary(
+        channel_name, period, metric_name, start=start, end=end
+    )
+
+    return {
+        "server_timestamp": datetime.utcnow(),
+        "period": period,
+        "metric_name": metric_name,
+        "total": sum(s.count for s in series),
+        "series": series,
+    }
+
+
+@api_router.get(
+    "/channels/{channel_name}/packages/{package_name}",
+    response_model=rest_models.MetricSummaryResponse,
+    tags=["metrics"],
+)
+def get_package_metric_summary(
+    channel_name: str,
+    package_name: str,
+    period: IntervalType = IntervalType.day,
+    metric_name: str = "download",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    package: db_models.Package = Depends(get_package_or_fail),
+    dao: Dao = Depends(get_dao),
+):
+    series = dao.get_metric_summary(
+        channel_name,
+        period,
+        metric_name,
+        package_name=package_name,
+        start=start,
+        end=end,
+    )
+
+    return {
+        "server_timestamp": datetime.utcnow(),
+        "period": period,
+        "metric_name": metric_name,
+        "total": sum(s.count for s in series),
+        "series": series,
+    }
+
+
+EXPORT_BATCH_SIZE = 1000
+
+
+def _export_batches(rows, batch_size=EXPORT_BATCH_SIZE):
+    rows = iter(rows)
+    while batch := list(islice(rows, batch_size)):
+        yield batch
+
+
+def _ndjson_lines(rows):
+    for batch in _export_batches(rows):
+        yield "".join(
+            json.dumps(
+                {
+                    "timestamp": timestamp.isoformat(),
+                    "platform": platform,
+                    "filename": filename,
+                    "count": count,
+                }
+            )
+            + "\n"
+            for timestamp, platform, filename, count in batch
+        )
+
+
+def _columnar_lines(rows):
+    for batch in _export_batches(rows):
+        timestamps, platforms, filenames, counts = zip(*batch)
+        yield (
+            json.dumps(
+                {
+                    "timestamp": [t.isoformat() for t in timestamps],
+                    "platform": platforms,
+                    "filename": filenames,
+                    "count": counts,
+                }
+            )
+            + "\n"
+        )
+
+
+@api_router.get(
+    "/channels/{channel_name}/export",
+    response_class=StreamingResponse,
+    tags=["metrics"],
+)
+def export_channel_metrics(
+    channel_name: str,
+    period: IntervalType = IntervalType.day,
+    metric_name: str = "download",
+    platform: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    format: rest_models.MetricsExportFormat = rest_models.MetricsExportFormat.ndjson,
+    cursor: Optional[datetime] = Query(
+        None, description="export intervals after this timestamp"
+    ),
+    limit: int = Query(100000, gt=0, description="approximate number of rows"),
+    dao: Dao = Depends(get_dao),
+):
+    """Stream the metrics of all files of a channel in timestamp order.
+
+    Rows are written as newline-delimited JSON. If more rows are available,
+    the X-Next-Cursor header holds the cursor of the next page.
+    """
+
+    filters = dict(platform=platform, start=start, end=end, after=cursor)
+    page_end = dao.get_channel_metrics_page_end(
+        channel_name, period, metric_name, limit, **filters
+    )
+    rows = dao.iter_channel_metrics(
+        channel_name,
+        period,
+        metric_name,
+        until=page_end,
+        batch_size=EXPORT_BATCH_SIZE,
+        **filters,
+    )
+
+    headers = {}
+    if page_end is not None:
+        headers["X-Next-Cursor"] = page_end.isoformat()
+
+    if format == rest_models.MetricsExportFormat.columnar:
+        lines = _columnar_lines(rows)
+    else:
+        lines = _ndjson_lines(rows)
+
+    return StreamingResponse(lines, media_type="application/x-ndjson", headers=headers)
+
+
 def get_router():
     return api_router
@@ -82,6 +82,13 @@ class PackageVersionMetric(Base):
             timestamp,
             name="package_version_metric_constraint",
         ),
+        sa.Index(
+            "package_version_metric_timestamp_index",
+            channel_name,
+            metric_name,
+            period,
+            timestamp,
+        ),
     )
 
     def __repr__(self):
@@ -90,3 +97,28 @@ class PackageVersionMetric(Base):
             f"period={self.period.value}, "
             f"timestamp={self.timestamp},count={self.count})"
         )
+
+
+class ChannelMetricSummary(Base):
+    """Metrics summed over all files of a channel."""
+
+    __tablename__ = "channel_metric_summaries"
+
+    channel_name = sa.Column(sa.String, primary_key=True)
+    metric_name = sa.Column(sa.String(255), primary_key=True)
+    period = sa.Column(sa.Enum(IntervalType), primary_key=True)
+    timestamp = sa.Column(sa.DateTime(), primary_key=True)
+    count = sa.Column(sa.Integer, server_default=sa.text("0"), nullable=False)
+
+
+class PackageMetricSummary(Base):
+    """Metrics summed over all files of a package."""
+
+    __tablename__ = "package_metric_summaries"
+
+    channel_name = sa.Column(sa.String, primary_key=True)
+    package_name = sa.Column(sa.String, primary_key=True)
+    metric_name = sa.Column(sa.String(255), primary_key=True)
+    period = sa.Column(sa.Enum(IntervalType), primary_key=True)
+    timestamp = sa.Column(sa.DateTime(), primary_key=True)
+    count = sa.Column(sa.Integer, server_default=sa.text("0"), nullable=False)
@@ -0,0 +1,131 @@
+import logging
+import threading
+import time
+from collections import Counter
+from typing import Callable, Optional, Tuple
+
+from quetz.metrics.middleware import (
+    DOWNLOAD_COUNTS_BACKPRESSURE,
+    DOWNLOAD_COUNTS_BUFFERED,
+    DOWNLOAD_COUNTS_FLUSH_ERRORS,
+    DOWNLOAD_COUNTS_FLUSH_TIME,
+    DOWNLOAD_COUNTS_FLUSHED,
+)
+
+logger = logging.getLogger("quetz")
+
+PackageFile = Tuple[str, str, str]
+
+
+class DownloadCounter:
+    """Write-behind buffer for package download counts.
+
+    Downloads are aggregated in memory per (channel_name, filename, platform)
+    and written to the database in batches by ``flush``. The buffer is
+    bounded: when it holds ``max_buffer_size`` distinct files, requests
+    adding new files wait (at most ``max_wait_seconds``) for the buffer to
+    be taken over by a flush. Counts are never dropped: after the wait the
+    download is counted anyway and counts of a failed flush are put back
+    into the buffer.
+
+    Arguments
+    ---------
+
+    commit: function writing a ``{(channel_name, filename, platform): count}``
+        mapping to the database
+
+    max_downloads: number of buffered downloads triggering a flush
+
+    delay_seconds: maximum time between flushes of pending downloads
+
+    max_buffer_size: number of distinct files above which adding new files
+        blocks
+    """
+
+    def __init__(
+        self,
+        commit: Callable[[Counter], None],
+        max_downloads: int = 50,
+        delay_seconds: float = 10,
+        max_buffer_size: int = 10000,
+        max_wait_seconds: float = 5,
+    ):
+        self.commit = commit
+        self.max_downloads = max_downloads
+        self.delay_seconds = delay_seconds
+        self.max_buffer_size = max_buffer_size
+        self.max_wait_seconds = max_wait_seconds
+
+        self._counts: Counter = Counter()
+        self._n_downloads = 0
+        self._last_flush = time.monotonic()
+        self._condition = threading.Condition()
+        # serializes flushes so that retried counts keep their order
+        self._flush_lock = threading.Lock()
+
+    def __len__(self):
+        return self._n_downloads
+
+    def add(self, channel_name: str, filename: str, platform: str, incr: int = 1):
+        key = (channel_name, filename, platform)
+        with self._condition:
+            if key not in self._counts and len(self._counts) >= self.max_buffer_size:
+                DOWNLOAD_COUNTS_BACKPRESSURE.inc()
+                self._condition.wait_for(
+                    lambda: len(self._counts) < self.max_buffer_size,
+                    timeout=self.max_wait_seconds,
+                )
+            self._counts[key] += incr
+            self._n_downloads += incr
+            DOWNLOAD_COUNTS_BUFFERED.set(len(self._counts))
+
+    def should_flush(self, now: Optional[float] = None) -> bool:
+        if not self._n_downloads:
+            return False
+        if now is None:
+            now = time.monotonic()
+        return (
+            self._n_downloads >= self.max_downloads
+            or len(self._counts) >= self.max_buffer_size
+            or now - self._last_flush >= self.delay_seconds
+        )
+
+    def _take(self) -> Counter:
+        with self._condition:
+            counts = self._counts
+            self._counts = Counter()
+            self._n_downloads = 0
+            DOWNLOAD_COUNTS_BUFFERED.set(0)
+            self._condition.notify_all()
+        return counts
+
+    def _put_back(self, counts: Counter):
+        with self._condition:
+            self._counts.update(counts)
+            self._n_downloads += sum(counts.values())
+            DOWNLOAD_COUNTS_BUFFERED.set(len(self._counts))
+
+    def flush(self) -> int:
+        """Write all buffered counts, returns the number of written downloads."""
+
+        with self._flush_lock:
+            counts = self._take()
+            self._last_flush = time.monotonic()
+            if not counts:
+                return 0
+
+            n_downloads = sum(counts.values())
+            try:
+                with DOWNLOAD_COUNTS_FLUSH_TIME.time():
+                    self.commit(counts)
+            except Exception:
+                DOWNLOAD_COUNTS_FLUSH_ERRORS.inc()
+                logger.exception(
+                    f"could not save {n_downloads} download counts, "
+                    "retrying on next flush"
+                )
+                self._put_back(counts)
+                return 0
+
+            DOWNLOAD_COUNTS_FLUSHED.inc(n_downloads)
+            return n_downloads
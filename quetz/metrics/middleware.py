@@ -44,6 +44,57 @@ UPLOAD_COUNT = Counter(
     ["channel", "platform", "package_name", "version", "package_type"],
 )
 
+DOWNLOAD_COUNTS_BUFFERED = Gauge(
+    "quetz_download_counts_buffered",
+    "Number of package files with download counts waiting to be saved",
+)
+DOWNLOAD_COUNTS_FLUSHED = Counter(
+    "quetz_download_counts_flushed",
+    "Total count of package downloads saved to the database",
+)
+DOWNLOAD_COUNTS_FLUSH_ERRORS = Counter(
+    "quetz_download_counts_flush_errors",
+    "Total count of failed attempts to save download counts",
+)
+DOWNLOAD_COUNTS_FLUSH_TIME = Histogram(
+    "quetz_download_counts_flush_seconds",
+    "Histogram of time spent saving batches of download counts (in seconds)",
+)
+DOWNLOAD_COUNTS_BACKPRESSURE = Counter(
+    "quetz_download_counts_backpressure",
+    "Total count of downloads waiting for a full download counts buffer",
+)
+
+TASK_ITEMS_PROCESSED = Counter(
+    "quetz_task_items_processed",
+    "Total count of items (packages, files) processed by job tasks",
+    ["action"],
+)
+TASK_BYTES_PROCESSED = Counter(
+    "quetz_task_bytes_processed",
+    "Total count of bytes processed by job tasks",
+    ["action"],
+)
+TASK_DURATION = Histogram(
+    "quetz_task_duration_seconds",
+    "Histogram of job task execution time by action and status (in seconds)",
+    ["action", "status"],
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 1800, 3600, 7200, float("inf")),
+)
+
+AUTH_PROVIDER_REQUEST_TIME = Histogram(
+    "quetz_auth_provider_request_seconds",
+    "Histogram of identity provider request time by provider and operation "
+    "(in seconds)",
+    ["provider", "operation"],
+)
+TOKEN_VALIDATIONS = Counter(
+    "quetz_token_validations",
+    "Total count of token validations by provider and result "
+    "(cached, valid or invalid)",
+    ["provider", "result"],
+)
+
 DATABASE_POOL_SIZE = Gauge(
     "database_pool_size", "number of opened database connections"
 )
@@ -1,4 +1,5 @@
 from datetime import datetime
+from enum import Enum
 from typing import Dict, List
 
 from pydantic import BaseModel, ConfigDict, Field
@@ -26,6 +27,10 @@ class PackageVersionMetricResponse(PackageVersionMetricSeries):
     total: int
 
 
+class MetricSummaryResponse(PackageVersionMetricResponse):
+    """Metrics summed over all files of a channel or package."""
+
+
 class ChannelMetricResponse(BaseModel):
     server_timestamp: datetime = Field(
         default_factory=datetime.utcnow,
@@ -34,3 +39,14 @@ class ChannelMetricResponse(BaseModel):
     period: IntervalType
     metric_name: str
     packages: Dict[str, PackageVersionMetricSeries]
+
+
+class MetricsExportFormat(str, Enum):
+    """Output formats of the metrics export:
+
+    * `ndjson` -- one JSON object per row
+    * `columnar` -- one JSON object of column arrays per batch of rows
+    """
+
+    ndjson = "ndjson"
+    columnar = "columnar"
@@ -1,10 +1,12 @@
 import logging
-from datetime import datetime
-from typing import Optional
+from datetime import datetime, timedelta
+from typing import Dict, Optional
 
 import requests
 
+from quetz.config import Config
 from quetz.dao import Dao
+from quetz.metrics.db_models import IntervalType
 
 
 def synchronize_metrics_from_mirrors(
@@ -73,3 +75,45 @@ def synchronize_metrics_from_mirrors(
         logger.debug(f"synchronized metrics from {metrics_url}")
         m.last_synchronised = end_time
         dao.db.commit()
+
+
+def get_metrics_retention(config: Config) -> Dict[IntervalType, Optional[timedelta]]:
+    """Retention times of the metrics per period from the metrics config section."""
+
+    retention: Dict[IntervalType, Optional[timedelta]] = {
+        interval: None for interval in IntervalType
+    }
+    if not config.configured_section("metrics"):
+        return retention
+
+    days = {
+        IntervalType.hour: config.metrics_hourly_retention_days,
+        IntervalType.day: config.metrics_daily_retention_days,
+        IntervalType.month: config.metrics_monthly_retention_days,
+        IntervalType.year: config.metrics_yearly_retention_days,
+    }
+    for interval, n_days in days.items():
+        if n_days is not None:
+            retention[interval] = timedelta(days=n_days)
+    return retention
+
+
+def compact_metrics(
+    channel_name: str,
+    dao: Dao,
+    config: Config,
+    now: Optional[datetime] = None,
+):
+    logger = logging.getLogger("quetz")
+
+    retention = get_metrics_retention(config)
+    if not any(retention.values()):
+        logger.info("no metrics retention configured, skipping compaction")
+        return
+
+    removed = dao.compact_metrics(channel_name, retention, now=now)
+
+    for interval, n_rows in removed.items():
+        logger.info(
+            f"removed {n_rows} {interval.name} metrics rows of channel {channel_name}"
+        )
@@ -1,3 +1,4 @@
+import logging
 import os
 
 from prometheus_client import (
@@ -6,13 +7,106 @@ from prometheus_client import (
     CollectorRegistry,
     generate_latest,
 )
+from prometheus_client.core import GaugeMetricFamily
 from prometheus_client.multiprocess import MultiProcessCollector
+from sqlalchemy import func
 from starlette.requests import Request
 from starlette.responses import Response
 from starlette.types import ASGIApp
 
 from .middleware import PrometheusMiddleware
 
+logger = logging.getLogger("quetz")
+
+
+class JobProgressCollector:
+    """Progress of running jobs, read from the tasks table on collection.
+
+    Progress is reported by workers in other processes (or on other hosts),
+    so it is exported from the database rather than from process metrics.
+    """
+
+    def __init__(self, get_db=None):
+        self.get_db = get_db
+
+    def _get_db(self):
+        if self.get_db is None:
+            # imported on collection: quetz.database imports this module
+            from quetz.database import get_db_manager
+
+            return get_db_manager()
+        return self.get_db()
+
+    def _query(self, db):
+        from quetz.jobs.models import Job, JobStatus, Task
+
+        return (
+            db.query(
+                Job.id,
+                Job.manifest,
+                func.sum(Task.progress_done),
+                func.sum(Task.progress_total),
+                func.sum(Task.progress_bytes),
+                func.min(Task.started),
+                func.max(Task.progress_updated),
+            )
+            .join(Task, Task.job_id == Job.id)
+            .filter(Job.status == JobStatus.running)
+            .group_by(Job.id, Job.manifest)
+            .all()
+        )
+
+    def collect(self):
+        from quetz.jobs.scheduling import manifest_action
+
+        labels = ["job_id", "action"]
+        done_gauge = GaugeMetricFamily(
+            "quetz_job_items_done",
+            "Number of items processed by running jobs",
+            labels=labels,
+        )
+        total_gauge = GaugeMetricFamily(
+            "quetz_job_items_total",
+            "Number of items to process by running jobs",
+            labels=labels,
+        )
+        ratio_gauge = GaugeMetricFamily(
+            "quetz_job_progress_ratio",
+            "Fraction of items processed by jobs",
+            labels=labels,
+        )
+        bytes_gauge = GaugeMetricFamily(
+            "quetz_job_bytes_processed",
+            "Number of bytes processed by jobs",
+            labels=labels,
+        )
+        rate_gauge = GaugeMetricFamily(
+            "quetz_job_items_per_second",
+            "Items processed per second by running jobs",
+            labels=labels,
+        )
+
+        try:
+            with self._get_db() as db:
+                rows = self._query(db)
+        except Exception:
+            logger.exception("could not collect job progress metrics")
+            rows = []
+
+        for job_id, manifest, done, total, nbytes, started, updated in rows:
+            job_labels = [str(job_id), manifest_action(manifest) or "pickled"]
+            done = done or 0
+            done_gauge.add_metric(job_labels, done)
+            bytes_gauge.add_metric(job_labels, nbytes or 0)
+            if total:
+                total_gauge.add_metric(job_labels, total)
+                ratio_gauge.add_metric(job_labels, min(done / total, 1.0))
+            if started and updated and updated > started:
+                elapsed = (updated - started).total_seconds()
+                rate_gauge.add_metric(job_labels, done / elapsed)
+
+        yield from (done_gauge, total_gauge, ratio_gauge, bytes_gauge, rate_gauge)
+
 
 def metrics(request: Request) -> Response:
     if "prometheus_multiproc_dir" in os.environ:
@@ -21,7 +115,12 @@ def metrics(request: Request) -> Response:
     else:
         registry = REGISTRY
 
-    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+    output = generate_latest(registry) + generate_latest(JOBS_REGISTRY)
+    return Response(output, media_type=CONTENT_TYPE_LATEST)
+
+
+JOBS_REGISTRY = CollectorRegistry(auto_describe=False)
+JOBS_REGISTRY.register(JobProgressCollector())
 
 
 def init(app: ASGIApp):
@@ -5,7 +5,7 @@ from alembic.config import Config as AlembicConfig
 from sqlalchemy import engine_from_config, pool
 
 from quetz.config import Config
-from quetz.db_models import Base
+from quetz.db_models import Base, restore_sqlite_package_search_index
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -31,7 +31,7 @@ target_metadata = Base.metadata
 def get_url():
     db_path = config.get_main_option("sqlalchemy.url")
     if not db_path:
-        config_path = context.get_x_argument(as_dictionary=True).get('quetzConfig')
+        config_path = context.get_x_argument(as_dictionary=True).get("quetzConfig")
         deployment_path = os.path.split(config_path)[0]
         quetz_config = Config(config_path)
         db_path = quetz_config.sqlalchemy_database_url
@@ -41,6 +41,19 @@ def get_url():
     return db_path
 
 
+def include_object(object, name, type_, reflected, compare_to):
+    """Exclude the package search index, which is created with raw DDL."""
+    if reflected and compare_to is None:
+        if type_ == "table" and name.startswith("packages_fts"):
+            return False
+        if type_ == "index" and name in (
+            "package_name_trgm_index",
+            "package_search_document_index",
+        ):
+            return False
+    return True
+
+
 def run_migrations_offline():
     """Run migrations in 'offline' mode.
 
@@ -58,6 +71,7 @@ def run_migrations_offline():
     context.configure(
         url=url,
         target_metadata=target_metadata,
+        include_object=include_object,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
     )
@@ -75,7 +89,7 @@ def run_migrations_online():
     """
     configuration = config.get_section(config.config_ini_section, {})
     configuration["sqlalchemy.url"] = get_url()
-    connection = config.attributes.get('connection', None)
+    connection = config.attributes.get("connection", None)
 
     if connection is None:
         engine = engine_from_config(
@@ -88,12 +102,16 @@ def run_migrations_online():
     context.configure(
         connection=connection,
         target_metadata=target_metadata,
+        include_object=include_object,
         compare_type=True,
         render_as_batch=True,
     )
 
     with context.begin_transaction():
         context.run_migrations()
+        # batch migrations of packages drop the triggers of the search index
+        if connection.dialect.name == "sqlite":
+            restore_sqlite_package_search_index(connection)
 
 
 if context.is_offline_mode():
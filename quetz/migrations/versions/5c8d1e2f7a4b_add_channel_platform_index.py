@@ -0,0 +1,31 @@
+"""add channel platform index to package versions
+
+Revision ID: 5c8d1e2f7a4b
+Revises: 3ba25f23fb7d
+Create Date: 2026-10-18 10:12:43.512305
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '5c8d1e2f7a4b'
+down_revision = '3ba25f23fb7d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # serves the lookups by channel and subdir (repodata indexing,
+    # active platform checks, validation and mirror checksums) in
+    # filename order
+    with op.batch_alter_table('package_versions', schema=None) as batch_op:
+        batch_op.create_index(
+            'package_version_platform_index',
+            ['channel_name', 'platform', 'filename'],
+            unique=False,
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('package_versions', schema=None) as batch_op:
+        batch_op.drop_index('package_version_platform_index')
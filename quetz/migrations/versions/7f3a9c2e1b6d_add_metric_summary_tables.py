@@ -0,0 +1,79 @@
+"""add metric summary tables
+
+Revision ID: 7f3a9c2e1b6d
+Revises: 5c8d1e2f7a4b
+Create Date: 2026-10-18 11:02:17.204113
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '7f3a9c2e1b6d'
+down_revision = '5c8d1e2f7a4b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    enum_values = ('hour', 'day', 'month', 'year')
+    if op.get_context().dialect.name == 'postgresql':
+        intervaltype = sa.dialects.postgresql.ENUM(
+            *enum_values, name='intervaltype', create_type=False
+        )
+    else:
+        intervaltype = sa.Enum(*enum_values, name='intervaltype')
+
+    op.create_table(
+        'channel_metric_summaries',
+        sa.Column('channel_name', sa.String(), nullable=False),
+        sa.Column('metric_name', sa.String(length=255), nullable=False),
+        sa.Column('period', intervaltype, nullable=False),
+        sa.Column('timestamp', sa.DateTime(), nullable=False),
+        sa.Column('count', sa.Integer(), server_default=sa.text('0'), nullable=False),
+        sa.PrimaryKeyConstraint('channel_name', 'metric_name', 'period', 'timestamp'),
+    )
+    op.create_table(
+        'package_metric_summaries',
+        sa.Column('channel_name', sa.String(), nullable=False),
+        sa.Column('package_name', sa.String(), nullable=False),
+        sa.Column('metric_name', sa.String(length=255), nullable=False),
+        sa.Column('period', intervaltype, nullable=False),
+        sa.Column('timestamp', sa.DateTime(), nullable=False),
+        sa.Column('count', sa.Integer(), server_default=sa.text('0'), nullable=False),
+        sa.PrimaryKeyConstraint(
+            'channel_name', 'package_name', 'metric_name', 'period', 'timestamp'
+        ),
+    )
+
+    # fill the summaries from the existing metrics, metrics of files
+    # without package version can not be attributed to a package
+    op.execute(
+        """
+        INSERT INTO channel_metric_summaries
+            (channel_name, metric_name, period, timestamp, count)
+        SELECT channel_name, metric_name, period, timestamp, SUM(count)
+        FROM aggregated_metrics
+        GROUP BY channel_name, metric_name, period, timestamp
+        """
+    )
+    op.execute(
+        """
+        INSERT INTO package_metric_summaries
+            (channel_name, package_name, metric_name, period, timestamp, count)
+        SELECT m.channel_name, v.package_name, m.metric_name, m.period,
+            m.timestamp, SUM(m.count)
+        FROM aggregated_metrics AS m
+        JOIN package_versions AS v
+            ON v.channel_name = m.channel_name
+            AND v.platform = m.platform
+            AND v.filename = m.filename
+        GROUP BY m.channel_name, v.package_name, m.metric_name, m.period,
+            m.timestamp
+        """
+    )
+
+
+def downgrade():
+    op.drop_table('package_metric_summaries')
+    op.drop_table('channel_metric_summaries')
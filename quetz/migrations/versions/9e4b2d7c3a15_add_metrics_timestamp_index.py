@@ -0,0 +1,29 @@
+"""add metrics timestamp index
+
+Revision ID: 9e4b2d7c3a15
+Revises: 7f3a9c2e1b6d
+Create Date: 2026-10-18 12:20:51.871462
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '9e4b2d7c3a15'
+down_revision = '7f3a9c2e1b6d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # serves the channel metrics export paginated by timestamp
+    with op.batch_alter_table('aggregated_metrics', schema=None) as batch_op:
+        batch_op.create_index(
+            'package_version_metric_timestamp_index',
+            ['channel_name', 'metric_name', 'period', 'timestamp'],
+            unique=False,
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('aggregated_metrics', schema=None) as batch_op:
+        batch_op.drop_index('package_version_metric_timestamp_index')
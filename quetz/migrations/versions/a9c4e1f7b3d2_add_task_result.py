@@ -0,0 +1,25 @@
+"""add task result
+
+Revision ID: a9c4e1f7b3d2
+Revises: e4b7c1d9a2f5
+Create Date: 2026-10-19 10:12:54.730218
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'a9c4e1f7b3d2'
+down_revision = 'e4b7c1d9a2f5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('tasks', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('result', sa.Text(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('tasks', schema=None) as batch_op:
+        batch_op.drop_column('result')
@@ -0,0 +1,27 @@
+"""add job priority
+
+Revision ID: b3e7f1a9c2d4
+Revises: 9e4b2d7c3a15
+Create Date: 2026-10-18 14:05:12.310927
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'b3e7f1a9c2d4'
+down_revision = '9e4b2d7c3a15'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('jobs', schema=None) as batch_op:
+        batch_op.add_column(
+            sa.Column('priority', sa.Integer(), nullable=False, server_default='0')
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('jobs', schema=None) as batch_op:
+        batch_op.drop_column('priority')
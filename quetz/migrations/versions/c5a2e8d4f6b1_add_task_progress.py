@@ -0,0 +1,39 @@
+"""add task progress
+
+Revision ID: c5a2e8d4f6b1
+Revises: b3e7f1a9c2d4
+Create Date: 2026-10-18 15:42:37.118204
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'c5a2e8d4f6b1'
+down_revision = 'b3e7f1a9c2d4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('tasks', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('started', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('progress_done', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('progress_total', sa.Integer(), nullable=True))
+        batch_op.add_column(
+            sa.Column('progress_bytes', sa.BigInteger(), nullable=True)
+        )
+        batch_op.add_column(sa.Column('progress_phase', sa.String(), nullable=True))
+        batch_op.add_column(
+            sa.Column('progress_updated', sa.DateTime(), nullable=True)
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('tasks', schema=None) as batch_op:
+        batch_op.drop_column('progress_updated')
+        batch_op.drop_column('progress_phase')
+        batch_op.drop_column('progress_bytes')
+        batch_op.drop_column('progress_total')
+        batch_op.drop_column('progress_done')
+        batch_op.drop_column('started')
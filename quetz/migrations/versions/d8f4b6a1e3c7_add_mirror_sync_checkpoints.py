@@ -0,0 +1,36 @@
+"""add mirror sync checkpoints
+
+Revision ID: d8f4b6a1e3c7
+Revises: c5a2e8d4f6b1
+Create Date: 2026-10-18 17:05:12.418833
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'd8f4b6a1e3c7'
+down_revision = 'c5a2e8d4f6b1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'mirror_sync_checkpoints',
+        sa.Column('channel_name', sa.String(), nullable=False),
+        sa.Column('subdir', sa.String(), nullable=False),
+        sa.Column('repodata_sha256', sa.String(), nullable=False),
+        sa.Column('last_filename', sa.String(), nullable=True),
+        sa.Column('completed', sa.Boolean(), nullable=False),
+        sa.Column('time_modified', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(
+            ['channel_name'],
+            ['channels.name'],
+        ),
+        sa.PrimaryKeyConstraint('channel_name', 'subdir'),
+    )
+
+
+def downgrade():
+    op.drop_table('mirror_sync_checkpoints')
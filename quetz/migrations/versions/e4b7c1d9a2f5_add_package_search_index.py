@@ -0,0 +1,116 @@
+"""add package search index
+
+Revision ID: e4b7c1d9a2f5
+Revises: d8f4b6a1e3c7
+Create Date: 2026-10-18 18:42:37.104512
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'e4b7c1d9a2f5'
+down_revision = 'd8f4b6a1e3c7'
+branch_labels = None
+depends_on = None
+
+document = (
+    "to_tsvector('english', "
+    "coalesce(packages.summary, '') || ' ' || coalesce(packages.description, ''))"
+)
+
+
+def sqlite_fts_available(bind):
+    version = bind.exec_driver_sql("SELECT sqlite_version()").scalar()
+    if tuple(int(v) for v in version.split(".")) < (3, 34, 0):
+        return False
+    options = bind.exec_driver_sql("PRAGMA compile_options").scalars().all()
+    return "ENABLE_FTS5" in options
+
+
+def fts_key(row):
+    return (
+        "(SELECT id FROM packages_fts_keys "
+        f"WHERE channel_name = {row}.channel_name AND name = {row}.name)"
+    )
+
+
+def delete_fts_row(row):
+    return (
+        f"DELETE FROM packages_fts WHERE rowid = {fts_key(row)}; "
+        "DELETE FROM packages_fts_keys "
+        f"WHERE channel_name = {row}.channel_name AND name = {row}.name; "
+    )
+
+
+def insert_fts_row(row):
+    return (
+        "INSERT INTO packages_fts_keys (channel_name, name) "
+        f"VALUES ({row}.channel_name, {row}.name); "
+        "INSERT INTO packages_fts (rowid, channel_name, name, summary, description) "
+        f"VALUES ({fts_key(row)}, {row}.channel_name, {row}.name, "
+        f"{row}.summary, {row}.description); "
+    )
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        op.execute(
+            "CREATE INDEX IF NOT EXISTS package_name_trgm_index "
+            "ON packages USING gin (name gin_trgm_ops)"
+        )
+        op.execute(
+            "CREATE INDEX IF NOT EXISTS package_search_document_index "
+            f"ON packages USING gin (({document}))"
+        )
+    elif bind.dialect.name == 'sqlite' and sqlite_fts_available(bind):
+        op.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS packages_fts USING fts5("
+            "channel_name UNINDEXED, name, summary, description, "
+            "tokenize = 'trigram')"
+        )
+        op.execute(
+            "CREATE TABLE IF NOT EXISTS packages_fts_keys ("
+            "id INTEGER PRIMARY KEY, channel_name VARCHAR NOT NULL, "
+            "name VARCHAR NOT NULL, UNIQUE (channel_name, name))"
+        )
+        op.execute(
+            "INSERT INTO packages_fts_keys (channel_name, name) "
+            "SELECT channel_name, name FROM packages"
+        )
+        op.execute(
+            "INSERT INTO packages_fts "
+            "(rowid, channel_name, name, summary, description) "
+            "SELECT packages_fts_keys.id, packages.channel_name, packages.name, "
+            "packages.summary, packages.description FROM packages "
+            "JOIN packages_fts_keys ON packages_fts_keys.channel_name = "
+            "packages.channel_name AND packages_fts_keys.name = packages.name"
+        )
+        op.execute(
+            "CREATE TRIGGER IF NOT EXISTS packages_fts_insert AFTER INSERT ON packages "
+            f"BEGIN {delete_fts_row('new')}{insert_fts_row('new')}END"
+        )
+        op.execute(
+            "CREATE TRIGGER IF NOT EXISTS packages_fts_delete AFTER DELETE ON packages "
+            f"BEGIN {delete_fts_row('old')}END"
+        )
+        op.execute(
+            "CREATE TRIGGER IF NOT EXISTS packages_fts_update "
+            "AFTER UPDATE OF channel_name, name, summary, description ON packages "
+            f"BEGIN {delete_fts_row('old')}{delete_fts_row('new')}"
+            f"{insert_fts_row('new')}END"
+        )
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        op.execute("DROP INDEX IF EXISTS package_search_document_index")
+        op.execute("DROP INDEX IF EXISTS package_name_trgm_index")
+    elif bind.dialect.name == 'sqlite':
+        op.execute("DROP TRIGGER IF EXISTS packages_fts_update")
+        op.execute("DROP TRIGGER IF EXISTS packages_fts_delete")
+        op.execute("DROP TRIGGER IF EXISTS packages_fts_insert")
+        op.execute("DROP TABLE IF EXISTS packages_fts_keys")
+        op.execute("DROP TABLE IF EXISTS packages_fts")
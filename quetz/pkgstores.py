@@ -16,7 +16,7 @@ import warnings
 from contextlib import contextmanager
 from os import PathLike
 from threading import Lock
-from typing import IO, List, Tuple, Union
+from typing import IO, Iterable, Iterator, List, Tuple, Union
 
 import aiofiles
 import aioshutil
@@ -78,6 +78,22 @@ class PackageStore(abc.ABC):
     def list_files(self, channel: str) -> List[str]:
         pass
 
+    def iter_files(self, channel: str, prefix: str = "") -> Iterator[Tuple[str, int]]:
+        """iterate over the (path, size) of the files of a channel below prefix
+
+        Raises FileNotFoundError if the channel is missing from the store.
+        Stores should override this to get the sizes from the listing itself.
+        """
+        for f in self.list_files(channel):
+            if f.startswith(prefix):
+                yield f, self.get_filemetadata(channel, f)[0]
+
+    def list_files_paged(
+        self, channel: str, prefix: str = "", page_size: int = 1000
+    ) -> Iterator[List[Tuple[str, int]]]:
+        """list the (path, size) of the files of a channel in pages of page_size"""
+        return _pages(self.iter_files(channel, prefix), page_size)
+
     @abc.abstractmethod
     def url(self, channel: str, src: str, expires: int = 0) -> str:
         pass
@@ -128,6 +144,26 @@ class PackageStore(abc.ABC):
         pass
 
 
+def _pages(items: Iterable, page_size: int) -> Iterator[list]:
+    page = []
+    for item in items:
+        page.append(item)
+        if len(page) >= page_size:
+            yield page
+            page = []
+    if page:
+        yield page
+
+
+def _iter_fs_files(fs, root: str, prefix: str) -> Iterator[Tuple[str, int]]:
+    if not fs.exists(root):
+        raise FileNotFoundError(f"{root} not found in the package store")
+    # fsspec lists the directories one at a time
+    for _, _, files in fs.walk(path.join(root, prefix), detail=True):
+        for info in files.values():
+            yield info["name"][len(root) :].lstrip("/"), info["size"]  # noqa: E203
+
+
 # generate a secret token for use with nginx secure link
 # similar to https://stackoverflow.com/a/52764346 (thanks @flix on stackoverflow)
 def nginx_secure_link(url: str, secret: str, expires=3600):
@@ -232,6 +268,26 @@ class LocalStore(PackageStore):
         channel_dir = os.path.join(self.channels_dir, channel)
         return [os.path.relpath(f, channel_dir) for f in self.fs.find(channel_dir)]
 
+    def iter_files(self, channel: str, prefix: str = ""):
+        channel_dir = os.path.join(self.channels_dir, channel)
+        if not os.path.isdir(channel_dir):
+            raise FileNotFoundError(f"{channel_dir} not found in the package store")
+        dirs = [os.path.join(channel_dir, prefix)]
+        while dirs:
+            try:
+                entries = os.scandir(dirs.pop())
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            with entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.append(entry.path)
+                    elif entry.is_file():
+                        yield (
+                            os.path.relpath(entry.path, channel_dir),
+                            entry.stat().st_size,
+                        )
+
     def url(self, channel: str, src: str, expires=0):
         if self.redirect_enabled:
             # generate url + secret if necessary
@@ -448,6 +504,10 @@ class S3Store(PackageStore):
         with self._get_fs() as fs:
             return [remove_prefix(f, channel_bucket) for f in fs.find(channel_bucket)]
 
+    def iter_files(self, channel: str, prefix: str = ""):
+        with self._get_fs() as fs:
+            yield from _iter_fs_files(fs, self._bucket_map(channel), prefix)
+
     def url(self, channel: str, src: str, expires=3600):
         # expires is in seconds, so the default is 60 minutes!
         with self._get_fs() as fs:
@@ -615,6 +675,10 @@ class AzureBlobStore(PackageStore):
                 remove_prefix(f, channel_container) for f in fs.find(channel_container)
             ]
 
+    def iter_files(self, channel: str, prefix: str = ""):
+        with self._get_fs() as fs:
+            yield from _iter_fs_files(fs, self._container_map(channel), prefix)
+
     def url(self, channel: str, src: str, expires=3600):
         # expires is in seconds, so the default is 60 minutes!
         with self._get_fs() as fs:
@@ -796,6 +860,10 @@ class GoogleCloudStorageStore(PackageStore):
                 remove_prefix(f, channel_container) for f in fs.find(channel_container)
             ]
 
+    def iter_files(self, channel: str, prefix: str = ""):
+        with self._get_fs() as fs:
+            yield from _iter_fs_files(fs, self._bucket_map(channel), prefix)
+
     def url(self, channel: str, src: str, expires=3600):
         # expires is in seconds, so the default is 60 minutes!
         with self._get_fs() as fs:
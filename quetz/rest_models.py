@@ -11,6 +11,8 @@ from typing import Generic, List, Optional, TypeVar
 
 from pydantic import BaseModel, ConfigDict, Field, field_validator, model_validator
 
+from quetz.jobs.models import MAX_JOB_PRIORITY, MIN_JOB_PRIORITY
+
 T = TypeVar("T")
 
 
@@ -49,7 +51,20 @@ class Member(BaseModel):
 class Pagination(BaseModel):
     skip: int = Field(0, title="The number of skipped records")
     limit: int = Field(0, title="The maximum number of returned records")
-    all_records_count: int = Field(0, title="The number of available records")
+    all_records_count: Optional[int] = Field(
+        0, title="The number of available records, None if not counted"
+    )
+    next_cursor: Optional[str] = Field(
+        None, title="The cursor of the next page, None on the last page"
+    )
+
+
+class CountMode(str, Enum):
+    """How the records of a paginated listing are counted."""
+
+    exact = "exact"
+    estimate = "estimate"
+    none = "none"
 
 
 class MirrorMode(str, Enum):
@@ -102,6 +117,12 @@ class ChannelActionEnum(str, Enum):
     * `synchronize_metrics` -- _non-mirror_, pull download metrics from known mirrors
     * `cleanup` -- fix inconsistencies in database and pkgstore
     * `cleanup_dry_run` -- display what changes `cleanup` would do
+    * `compact_metrics` -- roll up and remove download metrics older than the
+      retention times configured in the `metrics` section
+    * `prefetch_packages` -- _mirror only_, download the most downloaded package
+      files not yet fetched by a lazy mirror channel
+    * `reconcile_size` -- recompute the channel size from its package versions,
+      to correct drift of the incrementally updated size
     """
 
     synchronize = "synchronize"
@@ -112,6 +133,9 @@ class ChannelActionEnum(str, Enum):
     synchronize_metrics = "synchronize_metrics"
     cleanup = "cleanup"
     cleanup_dry_run = "cleanup_dry_run"
+    compact_metrics = "compact_metrics"
+    prefetch_packages = "prefetch_packages"
+    reconcile_size = "reconcile_size"
 
     # handlers for new actions should be registered in quetz.job.handlers
 
@@ -130,6 +154,11 @@ class ChannelMetadata(BaseModel):
         title="list of packages that should only be proxied (not copied, "
         "stored and redistributed)",
     )
+    lazy: Optional[bool] = Field(
+        None,
+        title="mirror only the package index, package files are downloaded "
+        "on first request",
+    )
 
 
 class Channel(ChannelBase):
@@ -283,3 +312,4 @@ class ChannelAction(BaseModel):
     action: ChannelActionEnum
     start_at: Optional[datetime] = Field(None)
     repeat_every_seconds: Optional[int] = Field(None)
+    priority: int = Field(0, ge=MIN_JOB_PRIORITY, le=MAX_JOB_PRIORITY)
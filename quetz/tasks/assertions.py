@@ -20,3 +20,11 @@ def can_channel_reindex(channel):
 
 def can_cleanup(channel):
     return True
+
+
+def can_compact_metrics(channel):
+    return True
+
+
+def can_reconcile_size(channel):
+    return True
@@ -1,6 +1,10 @@
+import logging
+
 from quetz.dao import Dao
 from quetz.pkgstores import PackageStore
 
+logger = logging.getLogger("quetz")
+
 
 def cleanup_channel_db(dao: Dao, channel_name: str, dry_run: bool):
     dao.cleanup_channel_db(channel_name, None, dry_run)
@@ -8,3 +12,9 @@ def cleanup_channel_db(dao: Dao, channel_name: str, dry_run: bool):
 
 def cleanup_temp_files(pkgstore: PackageStore, channel_name: str, dry_run: bool):
     pkgstore.cleanup_temp_files(channel_name, dry_run)
+
+
+def reconcile_channel_size(dao: Dao, channel_name: str):
+    drift = dao.update_channel_size(channel_name)
+    if drift:
+        logger.warning(f"corrected size of channel {channel_name} by {drift} bytes")
@@ -30,6 +30,12 @@ def assert_channel_action(action, channel):
         action_allowed = assertions.can_cleanup(channel)
     elif action == ChannelActionEnum.cleanup_dry_run:
         action_allowed = assertions.can_cleanup(channel)
+    elif action == ChannelActionEnum.compact_metrics:
+        action_allowed = assertions.can_compact_metrics(channel)
+    elif action == ChannelActionEnum.prefetch_packages:
+        action_allowed = assertions.can_channel_synchronize(channel)
+    elif action == ChannelActionEnum.reconcile_size:
+        action_allowed = assertions.can_reconcile_size(channel)
     else:
         action_allowed = False
 
@@ -60,6 +66,7 @@ class Task:
         channel: db_models.Channel,
         start_at: Optional[datetime] = None,
         repeat_every_seconds: Optional[int] = None,
+        priority: int = 0,
     ):
         auth = self.auth
 
@@ -82,6 +89,7 @@ class Task:
                 extra_args=extra_args,
                 start_at=start_at,
                 repeat_every_seconds=repeat_every_seconds,
+                priority=priority,
             )
         elif action == ChannelActionEnum.synchronize_repodata:
             auth.assert_synchronize_mirror(channel_name)
@@ -97,6 +105,7 @@ class Task:
                 extra_args=extra_args,
                 start_at=start_at,
                 repeat_every_seconds=repeat_every_seconds,
+                priority=priority,
             )
         elif action == ChannelActionEnum.validate_packages:
             auth.assert_validate_package_cache(channel_name)
@@ -107,6 +116,7 @@ class Task:
                 extra_args=extra_args,
                 start_at=start_at,
                 repeat_every_seconds=repeat_every_seconds,
+                priority=priority,
             )
         elif action == ChannelActionEnum.generate_indexes:
             auth.assert_reindex_channel(channel_name)
@@ -117,6 +127,7 @@ class Task:
                 extra_args=extra_args,
                 start_at=start_at,
                 repeat_every_seconds=repeat_every_seconds,
+                priority=priority,
             )
         elif action == ChannelActionEnum.reindex:
             auth.assert_reindex_channel(channel_name)
@@ -129,6 +140,7 @@ class Task:
                 extra_args=extra_args,
                 start_at=start_at,
                 repeat_every_seconds=repeat_every_seconds,
+                priority=priority,
             )
         elif action == ChannelActionEnum.synchronize_metrics:
             auth.assert_reindex_channel(channel_name)
@@ -139,6 +151,7 @@ class Task:
                 extra_args=extra_args,
                 start_at=start_at,
                 repeat_every_seconds=repeat_every_seconds,
+                priority=priority,
             )
         elif action in [ChannelActionEnum.cleanup, ChannelActionEnum.cleanup_dry_run]:
             auth.assert_channel_db_cleanup(channel_name)
@@ -153,6 +166,7 @@ class Task:
                 extra_args=extra_args,
                 start_at=start_at,
                 repeat_every_seconds=repeat_every_seconds,
+                priority=priority,
             )
             task = self.jobs_dao.create_job(
                 f"pkgstore_{action}".encode("ascii"),
@@ -160,6 +174,40 @@ class Task:
                 extra_args=extra_args,
                 start_at=start_at,
                 repeat_every_seconds=repeat_every_seconds,
+                priority=priority,
+            )
+        elif action == ChannelActionEnum.prefetch_packages:
+            auth.assert_synchronize_mirror(channel_name)
+            extra_args = dict(channel_name=channel.name)
+            task = self.jobs_dao.create_job(
+                action.encode("ascii"),
+                user_id,
+                extra_args=extra_args,
+                start_at=start_at,
+                repeat_every_seconds=repeat_every_seconds,
+                priority=priority,
+            )
+        elif action == ChannelActionEnum.compact_metrics:
+            auth.assert_channel_db_cleanup(channel_name)
+            extra_args = dict(channel_name=channel.name)
+            task = self.jobs_dao.create_job(
+                action.encode("ascii"),
+                user_id,
+                extra_args=extra_args,
+                start_at=start_at,
+                repeat_every_seconds=repeat_every_seconds,
+                priority=priority,
+            )
+        elif action == ChannelActionEnum.reconcile_size:
+            auth.assert_channel_db_cleanup(channel_name)
+            extra_args = dict(channel_name=channel.name)
+            task = self.jobs_dao.create_job(
+                action.encode("ascii"),
+                user_id,
+                extra_args=extra_args,
+                start_at=start_at,
+                repeat_every_seconds=repeat_every_seconds,
+                priority=priority,
             )
         else:
             raise HTTPException(
@@ -1,22 +1,30 @@
 # Copyright 2020 Codethink Ltd
 # Distributed under the terms of the Modified BSD License.
 
+import hashlib
 import json
 import logging
 import numbers
 import os
+import random
 import tempfile
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
+from functools import partial
 from pathlib import Path
+from typing import List, Optional, Tuple
 
 from jinja2 import Environment, PackageLoader, select_autoescape
 from jinja2.exceptions import UndefinedError
+from sqlalchemy import case, select
 
 import quetz.config
 from quetz import channel_data, repo_data
 from quetz.condainfo import MAX_CONDA_TIMESTAMP
+from quetz.database import use_replica
 from quetz.db_models import PackageVersion
+from quetz.jobs.progress import TaskProgress
 from quetz.utils import add_static_file, add_temp_static_file
 
 _iec_prefixes = (
@@ -88,99 +96,170 @@ def _subdir_key(dir):
     return _subdir_order.get(dir, dir)
 
 
-def validate_packages(dao, pkgstore, channel_name):
-    # for now we're just validating the size of the uploaded file
-    logger.info("Starting package validation")
-
-    if type(pkgstore).__name__ == "S3Store":
-        fs_chan = pkgstore._bucket_map(channel_name)
-    elif type(pkgstore).__name__ == "LocalStore":
-        fs_chan = os.path.abspath(os.path.join(pkgstore.channels_dir, channel_name))
-    else:
-        raise KeyError(type(pkgstore).__name__)
-
-    logger.info(f"Checking {fs_chan}")
-    ls_dirs = pkgstore.fs.ls(f"{fs_chan}", detail=True)
-    dirs = [d["name"].rsplit("/", 1)[1] for d in ls_dirs if d["type"] == "directory"]
-
-    for subdir in dirs:
-        ls_result = pkgstore.fs.ls(f"{fs_chan}/{subdir}", detail=True)
-
-        ls_result_set = set([(res["name"].rsplit("/", 1)[1]) for res in ls_result])
-        db_result = [
-            (res.filename, json.loads(res.info)["size"])
-            for res in dao.db.query(PackageVersion).filter(
-                PackageVersion.channel_name == channel_name,
-                PackageVersion.platform == subdir,
-            )
-        ]
-        db_result_set = set((res[0] for res in db_result))
-
-        difference = ls_result_set ^ db_result_set
-
-        logger.info(f"Differing files: {difference}")
-
-        in_ls_not_db = ls_result_set - db_result_set
-        in_db_not_ls = db_result_set - ls_result_set
-
-        valid, inexistent, wrong_size = 0, 0, 0
-
-        # remove all files that are in database and not uploaded
-        for f in in_db_not_ls:
-            logger.warning(f"Removing non-existent file from database {f}")
-            db_pkg_to_delete = (
-                dao.db.query(PackageVersion)
-                .filter(
-                    PackageVersion.channel_name == channel_name,
-                    PackageVersion.platform == subdir,
-                    PackageVersion.filename == f,
-                )
-                .one()
-            )
-            dao.db.delete(db_pkg_to_delete)
-            inexistent += 1
-
-        db_dict = dict(db_result)
-        for f in ls_result:
-            filename = f["name"].rsplit("/", 1)[1]
-            if filename in db_dict:
-                if db_dict[filename] != f["size"]:
-                    # size of file in db and on filesystem does not match!
-                    logger.error(
-                        f"File size differs for {filename}: "
-                        f"{f['size']} vs {db_dict[filename]}"
+def _file_sha256(pkgstore, channel_name: str, path: str) -> str:
+    sha256 = hashlib.sha256()
+    with pkgstore.serve_path(channel_name, path) as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def validate_packages(
+    dao,
+    pkgstore,
+    channel_name,
+    sha256_sample_rate: Optional[float] = None,
+    progress: Optional[TaskProgress] = None,
+    remove_missing_subdirs: Optional[bool] = None,
+):
+    """Check the package files of a channel against the database.
+
+    The files are listed from the package store page by page and compared
+    with the sizes of the package versions. A sample of the files
+    (sha256_sample_rate, by default the validation sha256_sample_rate
+    setting) is also checked against the sha256 of the package versions,
+    in parallel. Package versions whose file differs are removed together
+    with the file, package versions whose file is missing are removed
+    except for lazy mirror channels. Package versions of a subdir without
+    any file in the store are only removed with remove_missing_subdirs (by
+    default the validation remove_missing_subdirs setting), and
+    FileNotFoundError is raised if the channel is missing from the store.
+
+    Returns the number of valid, missing, wrong size and wrong sha256
+    files, which is also saved as the result of the task."""
+
+    logger.info(f"Starting package validation of channel {channel_name}")
+    if progress is None:
+        progress = TaskProgress()
+
+    config = quetz.config.Config()
+    if sha256_sample_rate is None:
+        sha256_sample_rate = config.validation_sha256_sample_rate
+    page_size = config.validation_page_size
+    if remove_missing_subdirs is None:
+        remove_missing_subdirs = config.validation_remove_missing_subdirs
+
+    # files of lazy mirrors are downloaded on first request, they are not
+    # removed from the database when missing
+    channel = dao.get_channel(channel_name)
+    lazy = bool(channel and channel.load_channel_metadata().get("lazy"))
+
+    counts = {"valid": 0, "missing": 0, "wrong_size": 0, "wrong_sha256": 0}
+
+    def remove(versions: List[Tuple[bytes, str]]):
+        for _, path in versions:
+            pkgstore.delete_file(channel_name, path)
+        dao.delete_package_versions(channel_name, [id for id, _ in versions])
+
+    subdirs = [
+        platform
+        for (platform,) in dao.db.query(PackageVersion.platform)
+        .filter(PackageVersion.channel_name == channel_name)
+        .distinct()
+        .order_by(PackageVersion.platform)
+    ]
+
+    with ThreadPoolExecutor(max_workers=config.validation_num_parallel_checks) as pool:
+        for subdir in subdirs:
+            progress.set_phase(subdir)
+
+            # sizes of package versions from before they were stored in
+            # their own column are only in the info
+            legacy_info = case((PackageVersion.size.is_(None), PackageVersion.info))
+            expected = {
+                filename: (id, json.loads(info)["size"] if info else size)
+                for id, filename, size, info in dao.db.execute(
+                    select(
+                        PackageVersion.id,
+                        PackageVersion.filename,
+                        PackageVersion.size,
+                        legacy_info,
+                    ).where(
+                        PackageVersion.channel_name == channel_name,
+                        PackageVersion.platform == subdir,
                     )
-                    pkgstore.delete_file(channel_name, f"{subdir}/{filename}")
-                    db_pkg_to_delete = (
-                        dao.db.query(PackageVersion)
-                        .filter(
-                            PackageVersion.channel_name == channel_name,
-                            PackageVersion.platform == subdir,
-                            PackageVersion.filename == filename,
+                )
+            }
+
+            n_package_files = 0
+            for page in pkgstore.list_files_paged(channel_name, subdir, page_size):
+                progress.add_total(len(page))
+                invalid, sampled = [], []
+                for path, size in page:
+                    progress.advance(nbytes=size)
+                    subdir_path, filename = os.path.split(path)
+                    if filename.endswith((".tar.bz2", ".conda")):
+                        n_package_files += 1
+                    if subdir_path != subdir or filename not in expected:
+                        continue
+                    id, expected_size = expected.pop(filename)
+                    if size != expected_size:
+                        logger.error(
+                            f"File size differs for {path}: {size} vs {expected_size}"
+                        )
+                        invalid.append((id, path))
+                        counts["wrong_size"] += 1
+                    elif sha256_sample_rate and random.random() < sha256_sample_rate:
+                        sampled.append((id, path))
+                    else:
+                        counts["valid"] += 1
+
+                if sampled:
+                    sha256s = dict(
+                        dao.db.query(PackageVersion.id, PackageVersion.info).filter(
+                            PackageVersion.id.in_([id for id, _ in sampled])
                         )
-                        .one()
                     )
-                    dao.db.delete(db_pkg_to_delete)
-                    wrong_size += 1
-                else:
-                    valid += 1
-
-        dao.db.commit()
-
-        logger.info(f"\n\nSUBDIR: {subdir}")
-        logger.info(f"On filesystem: {in_ls_not_db}")
-        logger.info(f"In database, not uploaded: {in_db_not_ls}")
+                    file_sha256s = pool.map(
+                        partial(_file_sha256, pkgstore, channel_name),
+                        [path for _, path in sampled],
+                    )
+                    for (id, path), file_sha256 in zip(sampled, file_sha256s):
+                        sha256 = json.loads(sha256s[id]).get("sha256")
+                        if sha256 and sha256 != file_sha256:
+                            logger.error(
+                                f"File sha256 differs for {path}: "
+                                f"{file_sha256} vs {sha256}"
+                            )
+                            invalid.append((id, path))
+                            counts["wrong_sha256"] += 1
+                        else:
+                            counts["valid"] += 1
+
+                remove(invalid)
+                dao.db.commit()
+
+            # package versions left were not found in the package store
+            if not (lazy or n_package_files or remove_missing_subdirs) and expected:
+                # rather a wrong store configuration than all files deleted
+                logger.error(
+                    f"No package files of {subdir} found in the package store, "
+                    f"not removing its {len(expected)} package versions"
+                )
+            elif not lazy and expected:
+                logger.warning(
+                    f"Removing {len(expected)} package versions of {subdir} "
+                    "missing from the package store"
+                )
+                missing = [(id, filename) for filename, (id, _) in expected.items()]
+                for i in range(0, len(missing), page_size):
+                    page = missing[i : i + page_size]  # noqa: E203
+                    dao.delete_package_versions(channel_name, [id for id, _ in page])
+                    dao.db.commit()
+                counts["missing"] += len(missing)
 
-        logger.info(f"Valid files: {valid}")
-        logger.info(f"Wrong size: {wrong_size}")
-        logger.info(f"Not uploaded: {inexistent}")
+    logger.info(f"Package validation of channel {channel_name}: {counts}")
+    progress.set_result(counts)
 
     update_indexes(dao, pkgstore, channel_name)
 
+    return counts
+
 
 def update_indexes(dao, pkgstore, channel_name, subdirs=None):
     jinjaenv = _jinjaenv()
-    channeldata = channel_data.export(dao, channel_name)
+    with use_replica(dao.db):
+        channeldata = channel_data.export(dao, channel_name)
 
     if subdirs is None:
         subdirs = sorted(channeldata["subdirs"], key=_subdir_key)
@@ -211,7 +290,8 @@ def update_indexes(dao, pkgstore, channel_name, subdirs=None):
 
     for sdir in subdirs:
         logger.debug(f"creating indexes for subdir {sdir} of channel {channel_name}")
-        raw_repodata = repo_data.export(dao, channel_name, sdir)
+        with use_replica(dao.db):
+            raw_repodata = repo_data.export(dao, channel_name, sdir)
         try:
             logger.debug(f"Starting post_index_creation for {sdir} of {channel_name}")
             pm.hook.post_index_creation(
@@ -1,12 +1,14 @@
 import contextlib
+import hashlib
 import json
 import logging
 import os
 import shutil
-from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from http.client import IncompleteRead
 from tempfile import SpooledTemporaryFile
-from typing import List
+from typing import Callable, Deque, Dict, List, Optional
 
 import requests
 from fastapi import HTTPException, status
@@ -21,10 +23,14 @@ from quetz.config import Config
 from quetz.dao import Dao
 from quetz.db_models import PackageVersion
 from quetz.errors import DBError
+from quetz.jobs.progress import TaskProgress
 from quetz.pkgstores import PackageStore
 from quetz.tasks import indexing
 from quetz.utils import TicToc, add_static_file, check_package_membership
 
+# number of packages registered in one transaction by lazy mirrors
+LAZY_BATCH_LENGTH = 1000
+
 # copy common subdirs from conda:
 # https://github.com/conda/conda/blob/a78a2387f26a188991d771967fc33aa1fb5bb810/conda/base/constants.py#L63
 
@@ -68,6 +74,10 @@ class RemoteFileNotFound(RemoteServerError):
     pass
 
 
+class RemoteFileChecksumError(RemoteServerError):
+    pass
+
+
 class RemoteFile:
     def __init__(self, host: str, path: str, session=None):
         if session is None:
@@ -106,10 +116,84 @@ class RemoteFile:
         return json.load(self.file)
 
 
+class StoredFile:
+    """Package file already in the package store, for example downloaded by
+    an interrupted synchronization but not registered in the database."""
+
+    def __init__(self, file, path: str):
+        self.file = file
+        _, self.filename = os.path.split(path)
+        self.content_type = None
+
+
+def open_stored_package(
+    pkgstore: PackageStore, channel: str, path: str, metadata: dict
+) -> Optional[StoredFile]:
+    """Open a package file of the store if it matches the checksum of metadata.
+
+    Returns None if the file is missing, could not be read or the checksums
+    differ.
+    """
+
+    for keyname in ["sha256", "md5"]:
+        if keyname in metadata:
+            break
+    else:
+        return None
+
+    try:
+        if not pkgstore.file_exists(channel, path):
+            return None
+        checksum = hashlib.new(keyname)
+        file = SpooledTemporaryFile()
+        with pkgstore.serve_path(channel, path) as fid:
+            for chunk in iter(lambda: fid.read(1024 * 1024), b""):
+                checksum.update(chunk)
+                file.write(chunk)
+    except Exception as exc:
+        logger.warning(f"could not read {path} from channel {channel}: {exc}")
+        return None
+
+    if checksum.hexdigest() != metadata[keyname]:
+        file.close()
+        return None
+
+    file.seek(0)
+    logger.debug(f"reusing {path} from the package store of channel {channel}")
+    return StoredFile(file, path)
+
+
+def file_matches_metadata(file, metadata: dict) -> bool:
+    """Compare the content of a file with the sha256 of metadata, or its md5
+    or size when the sha256 is missing. The file is rewound afterwards."""
+
+    keyname = next((k for k in ["sha256", "md5"] if metadata.get(k)), None)
+    checksum = hashlib.new(keyname) if keyname else None
+    size = 0
+    file.seek(0)
+    for chunk in iter(lambda: file.read(1024 * 1024), b""):
+        size += len(chunk)
+        if checksum is not None:
+            checksum.update(chunk)
+    file.seek(0)
+
+    if checksum is not None:
+        return checksum.hexdigest() == metadata[keyname]
+    return metadata.get("size") is None or size == metadata["size"]
+
+
 def download_remote_file(
-    repository: RemoteRepository, pkgstore: PackageStore, channel: str, path: str
+    repository: RemoteRepository,
+    pkgstore: PackageStore,
+    channel: str,
+    path: str,
+    metadata: Optional[dict] = None,
 ):
-    """Download a file from a remote repository to a package store"""
+    """Download a file from a remote repository to a package store
+
+    If metadata of the package is given, the file is only stored if it
+    matches its checksum, otherwise RemoteFileChecksumError is raised.
+    """
 
     # Check if a download is already underway for this file
     lock = pkgstore.get_download_lock(channel, path)
@@ -120,17 +204,25 @@ def download_remote_file(
         lock.release()
         return
     # Acquire a lock to prevent multiple concurrent downloads of the same file
-    with pkgstore.create_download_lock(channel, path):
-        logger.debug(f"Downloading {path} from {channel} to pkgstore")
-        remote_file = repository.open(path)
-        data_stream = remote_file.file
-
-        if path.endswith(".json"):
-            add_static_file(data_stream.read(), channel, None, path, pkgstore)
-        else:
-            pkgstore.add_package(data_stream, channel, path)
+    try:
+        with pkgstore.create_download_lock(channel, path):
+            logger.debug(f"Downloading {path} from {channel} to pkgstore")
+            remote_file = repository.open(path)
+            data_stream = remote_file.file
+
+            if metadata is not None and not file_matches_metadata(
+                data_stream, metadata
+            ):
+                raise RemoteFileChecksumError(
+                    f"{path} of channel {channel} does not match its checksum"
+                )
 
-    pkgstore.delete_download_lock(channel, path)
+            if path.endswith(".json"):
+                add_static_file(data_stream.read(), channel, None, path, pkgstore)
+            else:
+                pkgstore.add_package(data_stream, channel, path)
+    finally:
+        pkgstore.delete_download_lock(channel, path)
 
 
 @contextlib.contextmanager
@@ -145,7 +237,7 @@ def _check_checksum(dao: Dao, channel_name: str, platform: str, keyname="sha256"
 
         if package_fingerprints is None:
             package_versions = (
-                dao.db.query(PackageVersion)
+                dao.db.query(PackageVersion.filename, PackageVersion.info)
                 .filter(PackageVersion.channel_name == channel_name)
                 .filter(PackageVersion.platform == platform)
                 .all()
@@ -278,6 +370,179 @@ def handle_repodata_package(
             file.file.close()
 
 
+class MirrorBatch:
+    """Batch of packages going through a MirrorPipeline.
+
+    items are (path, package_name, metadata) tuples of the packages and
+    last_filename the last package of the repodata handled with the batch.
+    """
+
+    def __init__(self, items: list, last_filename: Optional[str] = None):
+        self.items = items
+        self.last_filename = last_filename
+        self.downloads: List[Future] = []
+        self.downloaded: list = []
+        self.extractions: Optional[List[Future]] = None
+        self.extracted: list = []
+        self.context = None
+        self.error: Optional[Exception] = None
+
+
+class MirrorPipeline:
+    """Bounded pipeline of mirror batches: download, then extract and store.
+
+    Files are downloaded and extracted in separate thread pools, so that the
+    next batches are processed while the caller registers a finished batch
+    in the database. prepare is called in the calling thread with the
+    downloaded files of a batch before their extraction, its result is
+    passed to extract. At most max_pending_batches batches are processed
+    ahead of the batches returned to the caller, in submission order.
+    """
+
+    def __init__(
+        self,
+        download: Callable,
+        extract: Optional[Callable] = None,
+        prepare: Optional[Callable] = None,
+        num_parallel_downloads: int = 10,
+        num_parallel_extractions: int = 1,
+        max_pending_batches: int = 1,
+    ):
+        self.download = download
+        self.extract = extract
+        self.prepare = prepare
+        self.max_pending_batches = max_pending_batches
+        self._download_pool = ThreadPoolExecutor(max_workers=num_parallel_downloads)
+        self._extract_pool = (
+            ThreadPoolExecutor(max_workers=num_parallel_extractions)
+            if extract
+            else None
+        )
+        self._pending: Deque[MirrorBatch] = deque()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(cancel=exc_type is not None)
+
+    def close(self, cancel: bool = False):
+        self._download_pool.shutdown(cancel_futures=cancel)
+        if self._extract_pool:
+            self._extract_pool.shutdown(cancel_futures=cancel)
+
+    def submit(self, items: list, last_filename: Optional[str] = None):
+        """Add a batch to the pipeline, returns the finished batches which
+        are over the max_pending_batches limit."""
+
+        batch = MirrorBatch(list(items), last_filename)
+        batch.downloads = [
+            self._download_pool.submit(self.download, item) for item in batch.items
+        ]
+        self._pending.append(batch)
+        self._start_ready()
+
+        finished = []
+        while len(self._pending) > self.max_pending_batches:
+            finished.append(self._finish(self._pending.popleft()))
+        return finished
+
+    def drain(self):
+        """Wait for all batches of the pipeline to finish."""
+
+        finished = []
+        while self._pending:
+            finished.append(self._finish(self._pending.popleft()))
+        return finished
+
+    def _start_ready(self):
+        # extract batches with completed downloads without waiting
+        for batch in self._pending:
+            if batch.extractions is None and all(f.done() for f in batch.downloads):
+                self._start_extraction(batch)
+
+    def _start_extraction(self, batch: MirrorBatch):
+        batch.extractions = []
+        try:
+            batch.downloaded = [
+                f for f in (d.result() for d in batch.downloads) if f is not None
+            ]
+            if self.prepare:
+                batch.context = self.prepare(batch.downloaded)
+            if self._extract_pool:
+                batch.extractions = [
+                    self._extract_pool.submit(self.extract, f, batch.context)
+                    for f in batch.downloaded
+                ]
+        except Exception as exc:
+            batch.error = exc
+
+    def _finish(self, batch: MirrorBatch) -> MirrorBatch:
+        if batch.extractions is None:
+            self._start_extraction(batch)
+        try:
+            batch.extracted = [f.result() for f in batch.extractions]
+        except Exception as exc:
+            batch.error = batch.error or exc
+        return batch
+
+
+def register_repodata_packages(
+    channel,
+    packages_metadata,
+    dao: Dao,
+    auth: authorization.Rules,
+    force: bool,
+    pkgstore: PackageStore,
+):
+    """Create package versions of a lazy mirror channel from the repodata.
+
+    packages_metadata are (path, filename, metadata) tuples, the package files
+    are not downloaded.
+    """
+
+    channel_name = channel.name
+    user_id = auth.assert_user()
+
+    total_size = 0
+    for _, filename, metadata in packages_metadata:
+        parts = filename.rsplit("-", 2)
+        if len(parts) != 3:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"package file name has wrong format {filename}",
+            )
+        auth.assert_upload_file(channel_name, parts[0])
+        if force:
+            auth.assert_overwrite_package_version(channel_name, parts[0])
+        total_size += metadata.get("size", 0)
+
+    dao.assert_size_limits(channel_name, total_size)
+
+    # files fetched for previous builds of updated versions are out of date
+    existing = {
+        os.path.join(v.platform, v.filename)
+        for v in dao.db.query(PackageVersion.platform, PackageVersion.filename)
+        .filter(PackageVersion.channel_name == channel_name)
+        .filter(PackageVersion.filename.in_([fn for _, fn, _ in packages_metadata]))
+    }
+
+    with TicToc("add versions to the db"):
+        for path, filename, metadata in packages_metadata:
+            if path in existing and pkgstore.file_exists(channel_name, path):
+                pkgstore.delete_file(channel_name, path)
+            create_version_from_metadata(
+                channel_name,
+                user_id,
+                filename,
+                metadata,
+                dao,
+                upsert=force,
+                commit=False,
+            )
+        dao.db.commit()
+
+
 def initial_sync_mirror(
     channel_name: str,
     remote_repository: RemoteRepository,
@@ -289,17 +554,24 @@ def initial_sync_mirror(
     excludelist: List[str] = None,
     skip_errors: bool = True,
     use_repodata: bool = False,
+    progress: Optional[TaskProgress] = None,
+    lazy: bool = False,
 ):
     force = True  # needed for updating packages
+    if progress is None:
+        progress = TaskProgress()
     logger.info(
         f"Running channel mirroring {channel_name}/{arch} from {remote_repository.host}"
     )
 
     repodata = {}
+    repodata_sha256 = None
     for repodata_fn in ["repodata_from_packages.json", "repodata.json"]:
         try:
             repo_file = remote_repository.open(os.path.join(arch, repodata_fn))
-            repodata = json.load(repo_file.file)
+            repodata_bytes = repo_file.file.read()
+            repodata = json.loads(repodata_bytes)
+            repodata_sha256 = hashlib.sha256(repodata_bytes).hexdigest()
             break
         except RemoteServerError:
             logger.error(
@@ -325,9 +597,35 @@ def initial_sync_mirror(
         logger.error(f"channel {channel_name} not found")
         return
 
-    from quetz.main import handle_package_files
+    from quetz.main import (
+        check_package_files,
+        extract_and_upload_package,
+        register_package_files,
+    )
 
     packages = repodata.get("packages", {}) | repodata.get("packages.conda", {})
+    progress.set_phase(arch)
+    progress.add_total(len(packages))
+
+    # resume an interrupted synchronization of the same upstream repodata,
+    # packages are processed in the order of the repodata
+    resume_after = None
+    checkpoint = dao.get_mirror_checkpoint(channel_name, arch)
+    if checkpoint and checkpoint.repodata_sha256 == repodata_sha256:
+        if checkpoint.completed:
+            logger.info(f"{channel_name}/{arch} already synchronized, skipping")
+            progress.advance(len(packages))
+            return
+        resume_after = checkpoint.last_filename
+        if resume_after is not None:
+            logger.info(
+                f"resuming synchronization of {channel_name}/{arch} "
+                f"after {resume_after}"
+            )
+    else:
+        dao.save_mirror_checkpoint(channel_name, arch, repodata_sha256)
+    # packages may have been added before the interruption
+    any_updated = resume_after is not None
 
     version_methods = [
         _check_checksum(dao, channel_name, arch, "sha256"),
@@ -340,7 +638,6 @@ def initial_sync_mirror(
     # version_methods are context managers (for example, to update the db
     # after all packages have been checked), so we need to enter the context
     # for each
-    any_updated = False
     with contextlib.ExitStack() as version_stack:
         version_checks = [
             version_stack.enter_context(method) for method in version_methods
@@ -348,54 +645,78 @@ def initial_sync_mirror(
 
         update_batch = []
         update_size = 0
+        last_filename = None
+
+        def fetch_file(path_metadata):
+            path, package_name, metadata = path_metadata
+            stored = open_stored_package(pkgstore, channel_name, path, metadata)
+            if stored is not None:
+                return stored, package_name, metadata
+            return download_file(remote_repository, path_metadata)
+
+        # sizes of the batches in the pipeline which passed the size limit
+        # check but are not registered yet, by id of their downloaded files
+        reserved_sizes: Dict[int, int] = {}
+
+        def check_files(downloaded):
+            files = [f for f, _, _ in downloaded]
+            channel_proxylist = check_package_files(
+                channel,
+                files,
+                dao,
+                auth,
+                force,
+                is_mirror_op=True,
+                reserved_size=sum(reserved_sizes.values()),
+            )
+            size = 0
+            for f in files:
+                size += f.file.seek(0, os.SEEK_END)
+                f.file.seek(0)
+            reserved_sizes[id(downloaded)] = size
+            return channel_proxylist
+
+        def extract_file(downloaded, channel_proxylist):
+            file, _, _ = downloaded
+            return extract_and_upload_package(
+                file, channel_name, channel_proxylist, force
+            )
 
-        def handle_batch(update_batch):
-            # i_batch += 1
-            logger.info(f"Handling batch: {[p[1] for p in update_batch]}")
-            if not update_batch:
-                return False
-
-            remote_packages = []
-            remote_packages_with_metadata = []
-
-            with ThreadPoolExecutor(
-                max_workers=config.mirroring_num_parallel_downloads
-            ) as executor:
-                for f in executor.map(
-                    download_file,
-                    (remote_repository,) * len(update_batch),
-                    update_batch,
-                ):
-                    if f is not None:
-                        remote_packages.append(f[0])
-                        remote_packages_with_metadata.append(f)
+        def handle_batch(batch: MirrorBatch):
+            logger.info(f"Handling batch: {[p[1] for p in batch.items]}")
 
             try:
-                if use_repodata:
+                if batch.error is not None:
+                    raise batch.error
+                if lazy:
+                    register_repodata_packages(
+                        channel, batch.items, dao, auth, force, pkgstore
+                    )
+                elif use_repodata:
                     handle_repodata_package(
                         channel,
-                        remote_packages_with_metadata,
+                        batch.downloaded,
                         dao,
                         auth,
                         force,
                         pkgstore,
                         config,
                     )
-
                 else:
-                    handle_package_files(
+                    register_package_files(
                         channel,
-                        remote_packages,
+                        [f for f, _, _ in batch.downloaded],
+                        batch.extracted,
                         dao,
-                        auth,
+                        auth.assert_owner(),
+                        batch.context,
                         force,
-                        is_mirror_op=True,
                     )
                 return True
 
             except Exception as exc:
                 logger.error(
-                    f"could not process package {update_batch} from channel"
+                    f"could not process package {batch.items} from channel"
                     f"{channel_name} due to error {exc} of "
                     f"type {exc.__class__.__name__}"
                 )
@@ -404,7 +725,70 @@ def initial_sync_mirror(
 
             return False
 
-        for package_name, metadata in packages.items():
+        # the checkpoint is not advanced past a failed batch, so that its
+        # packages are retried when the synchronization is run again
+        any_failed = False
+
+        def run_batches(batches: List[MirrorBatch]):
+            nonlocal any_failed
+            updated = False
+            for batch in batches:
+                handled = handle_batch(batch)
+                updated |= handled
+                any_failed |= not handled
+                # registered batches are counted in the size of the channel
+                reserved_sizes.pop(id(batch.downloaded), None)
+                progress.advance(
+                    len(batch.items),
+                    nbytes=sum(
+                        metadata.get("size", 0) for _, _, metadata in batch.items
+                    ),
+                )
+                if not any_failed:
+                    dao.save_mirror_checkpoint(
+                        channel_name, arch, repodata_sha256, batch.last_filename
+                    )
+            return updated
+
+        if lazy:
+            # nothing to download, package files are fetched on first request
+            max_batch_length = max(max_batch_length, LAZY_BATCH_LENGTH)
+            max_batch_size = float("inf")
+
+            def submit(items, last_filename):
+                return [MirrorBatch(items, last_filename)]
+
+            def drain():
+                return []
+
+        else:
+            # downloads and extraction of the next batches run in the background
+            # while the current batch is registered in the database
+            pipeline = version_stack.enter_context(
+                MirrorPipeline(
+                    fetch_file,
+                    prepare=None if use_repodata else check_files,
+                    extract=None if use_repodata else extract_file,
+                    num_parallel_downloads=config.mirroring_num_parallel_downloads,
+                    num_parallel_extractions=config.mirroring_num_parallel_extractions,
+                    max_pending_batches=config.mirroring_max_pending_batches,
+                )
+            )
+            submit, drain = pipeline.submit, pipeline.drain
+            if not use_repodata:
+                pkgstore.create_channel(channel_name)
+
+        items = iter(packages.items())
+        if resume_after is not None:
+            n_skipped = 0
+            for package_name, _ in items:
+                n_skipped += 1
+                if package_name == resume_after:
+                    break
+            progress.advance(n_skipped)
+
+        for package_name, metadata in items:
+            last_filename = package_name
             if check_package_membership(package_name, includelist, excludelist):
                 path = os.path.join(arch, package_name)
 
@@ -418,25 +802,33 @@ def initial_sync_mirror(
 
                 # if package is up-to-date skip uploading file
                 if is_uptodate:
+                    progress.advance()
                     continue
                 else:
                     logger.debug(f"updating package {package_name} from {arch}")
 
                 update_batch.append((path, package_name, metadata))
                 update_size += metadata.get("size", 100_000)
+            else:
+                progress.advance()
 
             if len(update_batch) >= max_batch_length or update_size >= max_batch_size:
                 logger.debug(f"Executing batch with {update_size}")
-                any_updated |= handle_batch(update_batch)
-                update_batch.clear()
+                any_updated |= run_batches(submit(update_batch, last_filename))
+                update_batch = []
                 update_size = 0
 
         # handle final batch
-        any_updated |= handle_batch(update_batch)
+        if update_batch:
+            any_updated |= run_batches(submit(update_batch, last_filename))
+        any_updated |= run_batches(drain())
 
     if any_updated:
         indexing.update_indexes(dao, pkgstore, channel_name, subdirs=[arch])
 
+    if not any_failed:
+        dao.save_mirror_checkpoint(channel_name, arch, repodata_sha256, completed=True)
+
 
 def create_packages_from_channeldata(
     channel_name: str, user_id: bytes, channeldata: dict, dao: Dao
@@ -477,6 +869,8 @@ def create_version_from_metadata(
     package_file_name: str,
     package_data: dict,
     dao: Dao,
+    upsert: bool = False,
+    commit: bool = True,
 ):
     package_name = package_data["name"]
     package = dao.get_package(channel_name, package_name)
@@ -509,6 +903,8 @@ def create_version_from_metadata(
         json.dumps(package_data),
         user_id,
         package_data["size"],
+        upsert=upsert,
+        commit=commit,
     )
 
     return version
@@ -531,6 +927,7 @@ def synchronize_packages(
     includelist: List[str] = None,
     excludelist: List[str] = None,
     use_repodata: bool = False,
+    progress: Optional[TaskProgress] = None,
 ):
     logger.info(f"executing synchronize_packages task in a process {os.getpid()}")
 
@@ -546,6 +943,10 @@ def synchronize_packages(
 
     user_id = auth.assert_user()
 
+    # lazy mirrors only register the packages listed in the repodata
+    lazy = bool(new_channel.load_channel_metadata().get("lazy"))
+    use_repodata = use_repodata or lazy
+
     try:
         channel_data = remote_repo.open("channeldata.json").json()
         if use_repodata:
@@ -573,4 +974,70 @@ def synchronize_packages(
             includelist,
             excludelist,
             use_repodata=use_repodata,
+            progress=progress,
+            lazy=lazy,
         )
+
+    # all subdirs are synchronized, the next run starts from scratch
+    dao.delete_mirror_checkpoints(channel_name)
+
+
+def prefetch_packages(
+    channel_name: str,
+    dao: Dao,
+    pkgstore: PackageStore,
+    session: requests.Session,
+    limit: Optional[int] = None,
+    progress: Optional[TaskProgress] = None,
+):
+    """Download the most downloaded package files missing from a lazy mirror.
+
+    At most limit package versions (by default the mirroring prefetch_count
+    setting) are considered.
+    """
+
+    if progress is None:
+        progress = TaskProgress()
+
+    channel = dao.get_channel(channel_name)
+    if not channel or not channel.mirror_channel_url:
+        logger.error(f"mirror channel {channel_name} not found")
+        return
+
+    config = Config()
+    if limit is None:
+        limit = config.mirroring_prefetch_count
+
+    versions = (
+        dao.db.query(
+            PackageVersion.platform, PackageVersion.filename, PackageVersion.info
+        )
+        .filter(PackageVersion.channel_name == channel_name)
+        .filter(PackageVersion.download_count > 0)
+        .order_by(PackageVersion.download_count.desc(), PackageVersion.filename)
+        .limit(limit)
+        .all()
+    )
+    paths = {
+        path: json.loads(v.info)
+        for path, v in ((os.path.join(v.platform, v.filename), v) for v in versions)
+        if not pkgstore.file_exists(channel_name, path)
+    }
+    progress.set_phase("prefetch")
+    progress.add_total(len(paths))
+    logger.info(f"prefetching {len(paths)} package files of channel {channel_name}")
+
+    repository = RemoteRepository(channel.mirror_channel_url, session)
+
+    def prefetch(path):
+        try:
+            download_remote_file(repository, pkgstore, channel_name, path, paths[path])
+        except RemoteServerError:
+            logger.error(f"could not prefetch {path} of channel {channel_name}")
+
+    pkgstore.create_channel(channel_name)
+    with ThreadPoolExecutor(
+        max_workers=config.mirroring_num_parallel_downloads
+    ) as executor:
+        for _ in executor.map(prefetch, paths):
+            progress.advance()
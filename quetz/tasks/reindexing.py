@@ -4,6 +4,7 @@ import os
 import time
 import uuid
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional
 
 from sqlalchemy.exc import IntegrityError
 
@@ -12,6 +13,7 @@ from quetz.condainfo import CondaInfo
 from quetz.config import Config
 from quetz.dao import Dao
 from quetz.exceptions import PackageError
+from quetz.jobs.progress import TaskProgress
 
 from .indexing import update_indexes
 
@@ -108,10 +110,18 @@ def chunks(lst, n):
 
 
 def reindex_packages_from_store(
-    dao: Dao, config: Config, channel_name: str, user_id, sync: bool = True
+    dao: Dao,
+    config: Config,
+    channel_name: str,
+    user_id,
+    sync: bool = True,
+    progress: Optional[TaskProgress] = None,
 ):
     """Reindex packages from files in the package store"""
 
+    if progress is None:
+        progress = TaskProgress()
+
     logger.debug(f"Re-indexing channel {channel_name}")
 
     channel = dao.get_channel(channel_name)
@@ -150,6 +160,8 @@ def reindex_packages_from_store(
         f"Importing {len(pkg_files)} packages for channel {channel_name}"
         + " from pkgstore"
     )
+    progress.set_phase("import")
+    progress.add_total(len(pkg_files))
 
     for pkg_group in chunks(pkg_files, nthreads * 8):
         tic = time.perf_counter()
@@ -163,6 +175,7 @@ def reindex_packages_from_store(
                 condainfo = future.result()
                 if condainfo:
                     handle_file(channel_name, condainfo, dao, user_id)
+                progress.advance()
 
         toc = time.perf_counter()
         logger.debug(
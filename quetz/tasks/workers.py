@@ -3,15 +3,23 @@ import concurrent.futures
 import inspect
 import json
 import logging
+import os
 import pickle
+import sys
 import time
 import uuid
 from abc import abstractmethod
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
 from multiprocessing import get_context
-from typing import Callable, Dict, Optional, Union
+from typing import Callable, Dict, List, Optional, Tuple, Union
 
 from quetz.config import Config
 from quetz.jobs.models import JobStatus, Task, TaskStatus
+from quetz.jobs.notifications import notify_jobs_changed
+from quetz.jobs.progress import TaskProgress
+from quetz.jobs.scheduling import job_action
+from quetz.metrics.middleware import TASK_DURATION
 
 try:
     import redis  # type: ignore
@@ -23,6 +31,9 @@ except ImportError:
 
 logger = logging.getLogger("quetz.tasks")
 
+# set in processes of the SubprocessWorker pool after their initialization
+_worker_initialized = False
+
 
 def prepare_arguments(func: Callable, **resources):
     "select arguments for a function for resources based on its signature." ""
@@ -43,7 +54,11 @@ def get_worker(config, num_procs=None):
     if worker == "thread":
         worker = ThreadingWorker(config)
     elif worker == "subprocess":
-        worker = SubprocessWorker(config, executor_args={"max_workers": num_procs})
+        worker = SubprocessWorker(
+            config,
+            executor_args={"max_workers": num_procs},
+            max_tasks_per_child=config.worker_max_tasks_per_child,
+        )
     elif worker == "redis":
         if rq_available:
             worker = RQManager(
@@ -116,8 +131,16 @@ def job_wrapper(
     config,
     task_id=None,
     exc_passthrou=False,
+    batch: Optional[List[Tuple[int, dict]]] = None,
     **kwargs,
 ):
+    """Run func for a task (task_id) or a batch of tasks of the same job.
+
+    A batch is a list of (task_id, task_kwargs) pairs. The database session,
+    package store, authorization rules and remote session are created once
+    and reused for all tasks of the batch, and the statuses of the tasks are
+    updated in bulk.
+    """
     # database connections etc. are not serializable
     # so we need to recreate them in the process.
     # This allows us to manage database connectivity prior
@@ -132,7 +155,8 @@ def job_wrapper(
     from quetz.database import get_session
     from quetz.deps import get_remote_session
 
-    configure_logger(config)
+    if not _worker_initialized:
+        configure_logger(config)
 
     logger = logging.getLogger("quetz.worker")
 
@@ -148,14 +172,21 @@ def job_wrapper(
         db = dao.db
         close_session = False
     else:
-        db = get_session(config.sqlalchemy_database_url)
+        db = get_session(
+            config.sqlalchemy_database_url,
+            replica_urls=config.sqlalchemy_replica_urls,
+        )
         close_session = True
 
+    if batch is None:
+        batch = [(task_id, {})]
+    task_ids = [task_id for task_id, _ in batch if task_id]
+
     user_id: Optional[str]
-    if task_id:
-        task = db.query(Task).filter(Task.id == task_id).one_or_none()
+    if task_ids:
+        task = db.query(Task).filter(Task.id == task_ids[0]).one_or_none()
         if not task:
-            raise KeyError(f"Task '{task_id}' not found")
+            raise KeyError(f"Task '{task_ids[0]}' not found")
         # take extra arguments from job definition
         if task.job.extra_args:
             job_extra_args = json.loads(task.job.extra_args)
@@ -183,7 +214,7 @@ def job_wrapper(
         session = get_remote_session()
 
     if task:
-        task.status = TaskStatus.running
+        _set_tasks_status(db, task_ids, TaskStatus.running)
         task.job.status = JobStatus.running
         db.commit()
 
@@ -201,26 +232,76 @@ def job_wrapper(
 
     kwargs.update(extra_kwargs)
 
-    try:
-        callable_f(**kwargs)
-    except Exception as exc:
-        if task:
-            task.status = TaskStatus.failed
-        logger.error(
-            f"exception occurred when evaluating function {callable_f.__name__}:{exc}"
-        )
-        if exc_passthrou:
-            raise exc
+    if task:
+        action = job_action(task.job) or callable_f.__name__
     else:
-        if task:
-            task.status = TaskStatus.success
+        action = callable_f.__name__
+    report_progress = "progress" in inspect.signature(callable_f).parameters
+
+    succeeded = []
+    failed = []
+    first_exc = None
+    try:
+        for task_id, task_kwargs in batch:
+            if report_progress:
+                progress = TaskProgress(db, task_id, action)
+                task_kwargs = dict(task_kwargs, progress=progress)
+            tic = time.perf_counter()
+            try:
+                callable_f(**kwargs, **task_kwargs)
+                if report_progress:
+                    progress.flush()
+                db.commit()
+            except Exception as exc:
+                TASK_DURATION.labels(action, TaskStatus.failed.value).observe(
+                    time.perf_counter() - tic
+                )
+                failed.append(task_id)
+                first_exc = first_exc or exc
+                logger.error(
+                    "exception occurred when evaluating function "
+                    f"{callable_f.__name__}:{exc}"
+                )
+                try:
+                    if report_progress:
+                        progress.flush()
+                    db.commit()
+                except Exception:
+                    # the transaction failed, the session needs to be usable
+                    # by the next tasks of the batch
+                    db.rollback()
+            else:
+                TASK_DURATION.labels(action, TaskStatus.success.value).observe(
+                    time.perf_counter() - tic
+                )
+                succeeded.append(task_id)
+        if first_exc is not None and exc_passthrou:
+            raise first_exc
     finally:
+        if task:
+            _set_tasks_status(db, [i for i in succeeded if i], TaskStatus.success)
+            _set_tasks_status(db, [i for i in failed if i], TaskStatus.failed)
         db.commit()
         if close_session:
             db.close()
 
 
+def _set_tasks_status(db, task_ids: List[int], status: TaskStatus):
+    if task_ids:
+        values = {Task.status: status}
+        if status == TaskStatus.running:
+            values[Task.started] = datetime.utcnow()
+        db.query(Task).filter(Task.id.in_(task_ids)).update(
+            values, synchronize_session="fetch"
+        )
+        # finished tasks free up capacity for tasks waiting for dispatch
+        notify_jobs_changed(db)
+
+
 class AbstractWorker:
+    # number of jobs the worker executes in parallel, None if unknown
+    num_workers: Optional[int] = None
+
     @abstractmethod
     def execute(self, func, **kwargs):
         """execute function func on the worker."""
@@ -284,6 +365,10 @@ class PoolExecutorWorker(AbstractWorker):
         self.config = config
         self.future = None
 
+    @property
+    def num_workers(self) -> int:
+        return self._executor._max_workers
+
     def execute(self, func, *args, **kwargs):
         self.future = self._executor.submit(
             job_wrapper, func, self.config, *args, **kwargs
@@ -303,21 +388,161 @@ class ThreadingWorker(PoolExecutorWorker):
     executor_cls = concurrent.futures.ThreadPoolExecutor
 
 
+def _init_worker_process(config: Config):
+    """Initialize a process of the SubprocessWorker pool.
+
+    Setup shared by all jobs executed by the process is done once: logging
+    is configured, plugins are imported and the database engine is created.
+    """
+
+    from quetz.config import configure_logger, get_plugin_manager
+    from quetz.database import get_session
+
+    global _worker_initialized
+
+    configure_logger(config)
+    try:
+        get_plugin_manager(config)
+    except Exception:
+        # plugins are imported again by the jobs which need them
+        logger.exception("could not preload plugins in worker process")
+    get_session(config.sqlalchemy_database_url).close()
+
+    _worker_initialized = True
+
+
+def _ping():
+    return os.getpid()
+
+
 class SubprocessWorker(PoolExecutorWorker):
-    """subprocess worker runs each job in a subprocess and destroys it after
-    the job is finished to release resources
+    """subprocess worker runs jobs in a pool of long-lived processes
+
+    The processes are initialized once and replaced after executing
+    max_tasks_per_child jobs to release resources. The pool is restarted if
+    one of its processes died or, when it is idle, does not respond to
+    health checks, which are made when executing jobs at most every
+    health_check_interval seconds.
     """
 
     executor_cls = concurrent.futures.ProcessPoolExecutor
+    _pool_key: Optional[tuple] = None
+    health_check_interval: float = 60
+    health_check_timeout: float = 10
 
-    def __init__(self, config: Config, executor_args: dict = {}):
-        if "max_workers" not in executor_args:
+    def __init__(
+        self,
+        config: Config,
+        executor_args: dict = {},
+        max_tasks_per_child: Optional[int] = 100,
+    ):
+        executor_args = dict(executor_args)
+        if not executor_args.get("max_workers"):
             executor_args["max_workers"] = 2
+        executor_args.setdefault("mp_context", get_context("spawn"))
+        executor_args.setdefault("initializer", _init_worker_process)
+        executor_args.setdefault("initargs", (config,))
+        if max_tasks_per_child and sys.version_info >= (3, 11):
+            executor_args["max_tasks_per_child"] = max_tasks_per_child
+        self.executor_args = executor_args
+        self.max_tasks_per_child = max_tasks_per_child
+        self._n_submitted = 0
+        self._last_health_check = time.monotonic()
+
+        # processes are bound to a database, the pool can not be shared
+        # between workers with different configurations
+        pool_key = (
+            config.sqlalchemy_database_url,
+            executor_args["max_workers"],
+            max_tasks_per_child,
+        )
+        if self._executor is not None and type(self)._pool_key != pool_key:
+            self._executor.shutdown(wait=False)
+            type(self)._executor = None
+        type(self)._pool_key = pool_key
+
         super().__init__(config, executor_args)
 
+    def warm_up(self):
+        """Start all processes of the pool in the background."""
+
+        for _ in range(self.executor_args["max_workers"]):
+            self._executor.submit(_ping)
+
+    def restart(self):
+        """Replace the pool with new processes.
+
+        The processes of the old pool are terminated, jobs still running in
+        them fail.
+        """
+
+        logger.info("restarting subprocess worker pool")
+        old_executor = self._executor
+        type(self)._executor = self.executor_cls(**self.executor_args)
+        self._n_submitted = 0
+        self.warm_up()
+
+        processes = list((old_executor._processes or {}).values())
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join(self.health_check_timeout)
+        old_executor.shutdown(wait=False, cancel_futures=True)
+
+    def is_idle(self) -> bool:
+        """Whether no job is queued or running in the pool."""
+
+        return not self._executor._pending_work_items
+
+    def check_health(self, timeout: Optional[float] = None) -> bool:
+        """Check that the pool processes are alive, restart the pool otherwise.
+
+        Processes of an idle pool must also respond to a ping, a busy pool
+        would answer it only after finishing its jobs.
+        """
+
+        if timeout is None:
+            timeout = self.health_check_timeout
+        self._last_health_check = time.monotonic()
+        executor = self._executor
+        processes = list((executor._processes or {}).values())
+        healthy = not executor._broken and all(
+            process.exitcode in (None, 0) for process in processes
+        )
+        if healthy and self.is_idle():
+            try:
+                executor.submit(_ping).result(timeout=timeout)
+            except (BrokenProcessPool, concurrent.futures.TimeoutError):
+                healthy = False
+        if not healthy:
+            logger.warning("subprocess worker pool is not responding")
+            self.restart()
+        return healthy
+
+    def _submit(self, *args, **kwargs):
+        if time.monotonic() - self._last_health_check > self.health_check_interval:
+            self.check_health()
+        elif self.max_tasks_per_child and "max_tasks_per_child" not in (
+            self.executor_args
+        ):
+            # recycle the whole pool on Python < 3.11, once its jobs finished
+            max_jobs = self.max_tasks_per_child * self.executor_args["max_workers"]
+            if self._n_submitted >= max_jobs and self.is_idle():
+                self.restart()
+        try:
+            future = self._executor.submit(*args, **kwargs)
+        except BrokenProcessPool:
+            self.restart()
+            future = self._executor.submit(*args, **kwargs)
+        self._n_submitted += 1
+        return future
+
     def execute(self, func, *args, **kwargs):
-        process = WorkerProcess(func, self.config, *args, **kwargs)
-        self.future = self._executor.submit(process)
+        if callable(func):
+            func = pickle.dumps(func)
+        self.future = self._submit(
+            job_wrapper, func, self.config, *args, exc_passthrou=True, **kwargs
+        )
         return FutureJob(self.future)
 
 
@@ -8,9 +8,11 @@ from alembic.command import upgrade as alembic_upgrade
 from fastapi.testclient import TestClient
 
 import quetz
+from quetz.authorization import AuthorizationCache
 from quetz.cli import _alembic_config
 from quetz.config import Config
 from quetz.dao import Dao
+from quetz.deps import ChannelCache
 from quetz.database import get_engine, get_session_maker
 from quetz.db_models import Base
 
@@ -245,7 +247,8 @@ def app(config, db, mocker):
     # so we avoid adding it here
     mocker.patch("quetz.frontend.register")
 
-    from quetz.deps import get_db
+    from quetz.dao import AsyncDao
+    from quetz.deps import get_async_dao, get_db
     from quetz.main import app
 
     # mocking is required for some functions that do not use fastapi
@@ -258,6 +261,7 @@ def app(config, db, mocker):
     # overriding dependency works with all requests handlers that
     # depend on quetz.deps.get_db
     app.dependency_overrides[get_db] = lambda: db
+    app.dependency_overrides[get_async_dao] = lambda: AsyncDao(db)
 
     # root url was removed with fronted urls above but
     # redirects to root must work for some tests to pass
@@ -267,6 +271,11 @@ def app(config, db, mocker):
 
     yield app
     app.dependency_overrides.pop(get_db)
+    app.dependency_overrides.pop(get_async_dao)
+
+    # the changes of the test are rolled back without session events
+    AuthorizationCache.invalidate()
+    ChannelCache.invalidate()
 
 
 @pytest.fixture
@@ -10,6 +10,8 @@ from quetz.tasks.workers import job_wrapper
 class MockWorker:
     "synchronous worker for testing"
 
+    num_workers: Optional[int] = None
+
     def __init__(
         self,
         config: Config,
@@ -1,11 +1,13 @@
 import uuid
 from datetime import datetime, timedelta
 from pathlib import Path
+from unittest import mock
 from unittest.mock import ANY
 
 import pytest
+from fastapi.testclient import TestClient
 
-from quetz import db_models
+from quetz import db_models, rest_models
 from quetz.authorization import (
     MAINTAINER,
     MEMBER,
@@ -16,6 +18,8 @@ from quetz.authorization import (
 )
 from quetz.condainfo import CondaInfo
 from quetz.config import Config
+from quetz.dao import Dao
+from quetz.deps import get_channel_cache
 from quetz.jobs.models import Job
 from quetz.jobs.runner import Supervisor
 from quetz.testing.mockups import MockWorker
@@ -168,6 +172,7 @@ def test_channel_action_reindex(
             "status": "pending",
             "repeat_every_seconds": None,
             "start_at": None,
+            "priority": 0,
         }
         job_id = job_data["id"]
     else:
@@ -185,6 +190,7 @@ def test_channel_action_reindex(
         "status": "pending",
         "repeat_every_seconds": None,
         "start_at": None,
+        "priority": 0,
     }
 
     sync_supervisor.run_jobs()
@@ -204,6 +210,14 @@ def test_channel_action_reindex(
             "id": ANY,
             "package_version": {},
             "status": "created",
+            "started": None,
+            "progress_done": None,
+            "progress_total": None,
+            "progress_bytes": None,
+            "progress_phase": None,
+            "progress_updated": None,
+            "result": None,
+            "items_per_second": None,
         }
     ]
 
@@ -347,6 +361,42 @@ def test_channel_names_are_case_insensitive(
     assert response.status_code == 200
 
 
+def test_serve_path_channel_cache(app, auth_client, public_channel, pkgstore, config):
+    pkgstore.add_file(b"{}", public_channel.name, "noarch/repodata.json")
+    anonymous_client = TestClient(app)
+    channel_url = f"/get/{public_channel.name}/noarch/repodata.json"
+
+    with mock.patch(
+        "quetz.deps.Dao.get_channel", autospec=True, side_effect=Dao.get_channel
+    ) as get_channel:
+        for _ in range(3):
+            response = anonymous_client.get(channel_url)
+            assert response.status_code == 200
+        assert get_channel.call_count == 1
+
+        # the cached channel is dropped when the channel changes
+        response = auth_client.patch(
+            f"/api/channels/{public_channel.name}", json={"private": True}
+        )
+        assert response.status_code == 200
+        get_channel.reset_mock()
+        response = anonymous_client.get(channel_url)
+        assert response.status_code == 401
+        assert get_channel.call_count == 1
+
+        response = auth_client.delete(f"/api/channels/{public_channel.name}")
+        assert response.status_code == 200
+        response = auth_client.get(channel_url)
+        assert response.status_code == 404
+
+    # unknown channels are not cached
+    cache = get_channel_cache(config.general_channel_cache_ttl)
+    for i in range(3):
+        response = anonymous_client.get(f"/get/unknown-{i}/noarch/repodata.json")
+        assert response.status_code == 404
+    assert not any(key.startswith("unknown-") for key in cache._entries)
+
+
 def test_unique_channel_names_are_case_insensitive(auth_client, maintainer):
     channel_name = "MyChannel"
 
@@ -733,6 +783,35 @@ def test_list_channels(
     assert channel_names == expected_channels
 
 
+def test_list_channels_with_cursor(auth_client, dao, user):
+    names = [f"cursor-channel-{i}" for i in range(5)]
+    for name in reversed(names):
+        channel = rest_models.Channel(name=name, private=False)
+        dao.create_channel(channel, user.id, "owner")
+
+    pages = []
+    cursor = ""
+    while cursor is not None:
+        response = auth_client.get(
+            "/api/paginated/channels", params={"limit": 2, "cursor": cursor}
+        )
+        assert response.status_code == 200
+        pagination = response.json()["pagination"]
+        assert pagination["all_records_count"] is None
+        pages.append([c["name"] for c in response.json()["result"]])
+        cursor = pagination["next_cursor"]
+
+    assert pages == [names[:2], names[2:4], names[4:]]
+
+    response = auth_client.get(
+        "/api/paginated/channels", params={"limit": 2, "cursor": "", "count": "exact"}
+    )
+    assert response.json()["pagination"]["all_records_count"] == 5
+
+    response = auth_client.get("/api/paginated/channels", params={"cursor": "wrong"})
+    assert response.status_code == 422
+
+
 @pytest.mark.parametrize("endpoint", ["/api/channels/{channel_name}", "/api/channels"])
 def test_channel_package_members_count(
     auth_client, public_channel, db, private_channel, other_user, endpoint
@@ -1,3 +1,4 @@
+import asyncio
 import hashlib
 import json
 import os
@@ -9,7 +10,7 @@ from typing import BinaryIO, Callable, Tuple, Union
 import pytest
 
 from quetz import hookimpl
-from quetz.authorization import MAINTAINER, MEMBER, OWNER, SERVER_OWNER
+from quetz.authorization import MAINTAINER, MEMBER, OWNER, SERVER_OWNER, Rules
 from quetz.condainfo import CondaInfo
 from quetz.config import Config
 from quetz.dao import Dao
@@ -142,6 +143,17 @@ def test_get_paginated_package_versions(
     assert isinstance(response.json().get("result"), list)
     assert len(response.json().get("result")) == 1
 
+    response = auth_client.get(
+        f"/api/paginated/channels/{public_channel.name}/"
+        f"packages/{package_version.package_name}/versions",
+        params={"cursor": "", "count": "estimate"},
+    )
+
+    assert response.status_code == 200
+    assert response.json()["pagination"]["all_records_count"] == 1
+    assert response.json()["pagination"]["next_cursor"] is None
+    assert len(response.json()["result"]) == 1
+
 
 def test_get_package_version(auth_client, public_channel, package_version, dao):
     filename = "test-package-0.1-0.tar.bz2"
@@ -930,6 +942,38 @@ def test_upload_package_with_api_key(client, dao: Dao, owner, private_channel, a
     assert member
 
 
+def test_async_endpoints_check_api_key_off_event_loop(
+    client, private_channel, private_package, api_key, mocker
+):
+    # the API key lookups of async endpoints must not block the event loop
+    on_event_loop = []
+    get_valid_api_key = Rules.get_valid_api_key
+
+    def check_event_loop(self):
+        try:
+            asyncio.get_running_loop()
+            on_event_loop.append(True)
+        except RuntimeError:
+            on_event_loop.append(False)
+        return get_valid_api_key(self)
+
+    mocker.patch.object(Rules, "get_valid_api_key", check_event_loop)
+
+    client.headers["X-API-Key"] = api_key.key
+    for url in [
+        "/api/channels",
+        "/api/paginated/channels",
+        "/api/packages/search/?q=test",
+        f"/api/channels/{private_channel.name}/packages/"
+        f"{private_package.name}/versions",
+    ]:
+        response = client.get(url)
+        assert response.status_code == 200
+
+    assert on_event_loop
+    assert not any(on_event_loop)
+
+
 def test_upload_file_to_package_with_api_key(
     dao: Dao, client, owner, private_channel, private_package, api_key
 ):
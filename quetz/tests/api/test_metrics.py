@@ -1,11 +1,18 @@
+import json
 from datetime import datetime, timedelta
 from unittest.mock import ANY, Mock
 
 import pytest
 
 from quetz.dao import Dao
-from quetz.metrics.db_models import IntervalType, next_timestamp, round_timestamp
-from quetz.metrics.tasks import synchronize_metrics_from_mirrors
+from quetz.metrics import rest_models
+from quetz.metrics.db_models import (
+    IntervalType,
+    PackageVersionMetric,
+    next_timestamp,
+    round_timestamp,
+)
+from quetz.metrics.tasks import compact_metrics, synchronize_metrics_from_mirrors
 
 
 def test_round_timestamp():
@@ -206,6 +213,218 @@ def test_get_channel_download_count(
     assert response.json() == expected
 
 
+def test_get_channel_metrics_series(public_channel, package_version_factory, dao: Dao):
+    versions = [package_version_factory(str(i)) for i in range(2)]
+    days = [datetime(2020, 1, day, 10) for day in (3, 1, 2)]
+    for i, day in enumerate(days):
+        dao.incr_download_counts(
+            {(public_channel.name, v.filename, v.platform): i + 1 for v in versions},
+            timestamp=day,
+        )
+
+    metrics = dao.get_channel_metrics(
+        public_channel.name, IntervalType.day, "download", end=datetime(2020, 1, 3)
+    )
+
+    series = [
+        {"timestamp": datetime(2020, 1, 1), "count": 2},
+        {"timestamp": datetime(2020, 1, 2), "count": 3},
+    ]
+    assert list(metrics) == [f"{v.platform}/{v.filename}" for v in versions]
+    for v in versions:
+        items = metrics[f"{v.platform}/{v.filename}"]["series"]
+        parsed = rest_models.PackageVersionMetricSeries(series=items)
+        assert [item.model_dump() for item in parsed.series] == series
+
+
+def test_get_metric_summary(
+    auth_client, public_channel, public_package, package_version_factory, dao: Dao
+):
+    versions = [package_version_factory(str(i)) for i in range(3)]
+
+    timestamp = datetime(2020, 1, 5, 21, 1)
+
+    dao.incr_download_counts(
+        {
+            (public_channel.name, v.filename, v.platform): i + 1
+            for i, v in enumerate(versions)
+        },
+        timestamp=timestamp,
+    )
+    dao.incr_download_count(
+        public_channel.name, "other-package-0.1-0.tar.bz2", "noarch", timestamp
+    )
+
+    expected_series = [{"timestamp": "2020-01-05T00:00:00", "count": 7}]
+
+    response = auth_client.get(f"/metrics/channels/{public_channel.name}/summary")
+    assert response.status_code == 200
+    assert response.json() == {
+        "server_timestamp": ANY,
+        "metric_name": "download",
+        "period": "D",
+        "total": 7,
+        "series": expected_series,
+    }
+
+    response = auth_client.get(
+        f"/metrics/channels/{public_channel.name}/packages/{public_package.name}",
+        params={"period": "M"},
+    )
+    assert response.status_code == 200
+    assert response.json()["total"] == 6
+    assert response.json()["series"] == [
+        {"timestamp": "2020-01-01T00:00:00", "count": 6}
+    ]
+
+    response = auth_client.get(
+        f"/metrics/channels/{public_channel.name}/packages/other-package"
+    )
+    assert response.status_code == 404
+
+
+@pytest.fixture
+def exported_metrics(public_channel, package_version_factory, dao: Dao):
+    versions = [package_version_factory(str(i)) for i in range(2)]
+    days = [datetime(2020, 1, day, 10) for day in (1, 2, 3)]
+    for i, day in enumerate(days):
+        dao.incr_download_counts(
+            {(public_channel.name, v.filename, v.platform): i + 1 for v in versions},
+            timestamp=day,
+        )
+    return versions, days
+
+
+def test_export_channel_metrics_ndjson(
+    auth_client, public_channel, exported_metrics, mocker
+):
+    versions, days = exported_metrics
+    mocker.patch("quetz.metrics.api.EXPORT_BATCH_SIZE", 4)
+
+    response = auth_client.get(f"/metrics/channels/{public_channel.name}/export")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert "x-next-cursor" not in response.headers
+
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert rows == [
+        {
+            "timestamp": day.replace(hour=0).isoformat(),
+            "platform": v.platform,
+            "filename": v.filename,
+            "count": i + 1,
+        }
+        for i, day in enumerate(days)
+        for v in sorted(versions, key=lambda v: v.filename)
+    ]
+
+
+def test_export_channel_metrics_columnar(auth_client, public_channel, exported_metrics):
+    versions, days = exported_metrics
+
+    response = auth_client.get(
+        f"/metrics/channels/{public_channel.name}/export",
+        params={"format": "columnar", "period": "M"},
+    )
+    assert response.status_code == 200
+
+    (batch,) = [json.loads(line) for line in response.text.splitlines()]
+    assert batch["timestamp"] == ["2020-01-01T00:00:00"] * 2
+    assert batch["filename"] == sorted(v.filename for v in versions)
+    assert batch["count"] == [6, 6]
+
+
+def test_export_channel_metrics_pages(auth_client, public_channel, exported_metrics):
+    versions, days = exported_metrics
+    url = f"/metrics/channels/{public_channel.name}/export"
+
+    # pages contain complete intervals
+    response = auth_client.get(url, params={"limit": 3})
+    assert response.headers["x-next-cursor"] == "2020-01-02T00:00:00"
+    assert len(response.text.splitlines()) == 4
+
+    response = auth_client.get(
+        url, params={"limit": 3, "cursor": response.headers["x-next-cursor"]}
+    )
+    assert "x-next-cursor" not in response.headers
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["timestamp"] for row in rows] == ["2020-01-03T00:00:00"] * 2
+
+    response = auth_client.get(url, params={"limit": 0})
+    assert response.status_code == 422
+
+
+def test_compact_metrics(public_channel, package_version, db, dao: Dao):
+    m = PackageVersionMetric
+    channel = public_channel.name
+    key = (channel, package_version.filename, package_version.platform)
+
+    dao.incr_download_counts({key: 1}, datetime(2020, 1, 5, 21, 1))
+    dao.incr_download_counts({key: 2}, datetime(2020, 1, 6, 10, 1))
+    dao.incr_download_counts({key: 4}, datetime(2020, 3, 1, 10, 1))
+    # hourly rows without daily rollup, e.g. imported from older versions
+    db.query(m).filter(m.period == IntervalType.day).filter(
+        m.timestamp < datetime(2020, 3, 1)
+    ).delete()
+
+    removed = dao.compact_metrics(
+        channel,
+        {IntervalType.hour: timedelta(days=30), IntervalType.day: None},
+        now=datetime(2020, 3, 1, 12),
+    )
+
+    # only hours of days before the 30 day retention are removed
+    assert removed == {IntervalType.hour: 2}
+
+    def counts(period):
+        rows = (
+            db.query(m.timestamp, m.count)
+            .filter(m.channel_name == channel, m.period == period)
+            .order_by(m.timestamp)
+        )
+        return [(ts, count) for ts, count in rows]
+
+    assert counts(IntervalType.hour) == [(datetime(2020, 3, 1, 10), 4)]
+    assert counts(IntervalType.day) == [
+        (datetime(2020, 1, 5), 1),
+        (datetime(2020, 1, 6), 2),
+        (datetime(2020, 3, 1), 4),
+    ]
+
+    removed = dao.compact_metrics(
+        channel,
+        {IntervalType.day: timedelta(days=10), IntervalType.year: timedelta(days=0)},
+        now=datetime(2020, 3, 1, 12),
+    )
+    assert removed == {IntervalType.day: 2, IntervalType.year: 1}
+    assert counts(IntervalType.month) == [
+        (datetime(2020, 1, 1), 3),
+        (datetime(2020, 3, 1), 4),
+    ]
+
+    # summaries are kept
+    summary = dao.get_metric_summary(channel, IntervalType.year, "download")
+    assert [s.count for s in summary] == [7]
+
+
+@pytest.mark.parametrize(
+    "config_extra", ["[metrics]\nhourly_retention_days = 1\nyearly_retention_days = 0"]
+)
+def test_compact_metrics_task(public_channel, package_version, db, dao: Dao, config):
+    timestamp = datetime(2020, 1, 5, 21, 1)
+    dao.incr_download_count(
+        public_channel.name,
+        package_version.filename,
+        package_version.platform,
+        timestamp,
+    )
+
+    compact_metrics(public_channel.name, dao, config, now=datetime(2020, 1, 7))
+
+    periods = db.query(PackageVersionMetric.period).all()
+    assert sorted(p.value for (p,) in periods) == ["D", "M"]
+
+
 @pytest.fixture
 def channel_mirror(public_channel, dao: Dao):
     mirror_url = "http://mirror_server/get/my-mirror"
@@ -1,3 +1,6 @@
+import time
+from unittest import mock
+
 import pytest
 from fastapi import Request, Response
 from starlette.testclient import TestClient
@@ -41,3 +44,48 @@ def test_login_endpoint(app, dummy_authenticator):
 
     assert response.status_code == 200
     assert response.text == "success"
+
+
+class ValidatingAuthenticator(BaseAuthenticator):
+    handler_cls = DummyHandlers
+    provider = "validatingprovider"
+
+    def configure(self, config):
+        super().configure(config)
+        self.is_enabled = True
+        self.validated_tokens = []
+
+    async def validate_token(self, token):
+        self.validated_tokens.append(token)
+        return token != "revoked"
+
+
+@pytest.mark.asyncio
+async def test_check_token_cached(config):
+    authenticator = ValidatingAuthenticator(config)
+    assert authenticator.token_revalidation_interval == 60
+
+    assert await authenticator.check_token("token")
+    assert await authenticator.check_token("token")
+    assert authenticator.validated_tokens == ["token"]
+
+    # invalid tokens are validated on every check
+    assert not await authenticator.check_token("revoked")
+    assert not await authenticator.check_token("revoked")
+    assert authenticator.validated_tokens == ["token", "revoked", "revoked"]
+
+    # valid tokens are validated again after the revalidation interval
+    expired = time.monotonic() + 61
+    with mock.patch("quetz.authentication.base.time.monotonic", return_value=expired):
+        assert await authenticator.check_token("token")
+    assert authenticator.validated_tokens == ["token", "revoked", "revoked", "token"]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("config_extra", ["[general]\ntoken_revalidation_interval=0"])
+async def test_check_token_not_cached(config):
+    authenticator = ValidatingAuthenticator(config)
+
+    assert await authenticator.check_token("token")
+    assert await authenticator.check_token("token")
+    assert authenticator.validated_tokens == ["token", "token"]
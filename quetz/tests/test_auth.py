@@ -5,9 +5,11 @@ from datetime import date
 from unittest import mock
 from urllib.parse import quote
 
+import pytest
+from fastapi import HTTPException
 from pytest import fixture
 
-from quetz.authorization import Rules
+from quetz.authorization import AuthorizationCache, Rules, get_shared_cache
 from quetz.db_models import (
     ApiKey,
     Channel,
@@ -642,6 +644,70 @@ def test_authorizations_with_deleted_api_key(data: Data, db):
     data.keya_obj.deleted = False
 
 
+def test_authorization_cache(data: Data, db):
+    cache = AuthorizationCache(ttl=60)
+    channel_name = data.channel2.name
+
+    auth = Rules(data.keya, {}, db, cache=cache)
+    auth.assert_channel_roles(channel_name, ["maintainer"])
+
+    # identities and roles are served from the cache by other requests
+    with mock.patch.object(db, "query", side_effect=AssertionError("no query")):
+        auth = Rules(data.keya, {}, db, cache=cache)
+        assert auth.assert_user() == data.user_a.id
+        auth.assert_channel_roles(channel_name, ["maintainer"])
+
+    # role changes invalidate the cache
+    data.channel_member.role = "member"
+    db.commit()
+    auth = Rules(data.keya, {}, db, cache=cache)
+    with pytest.raises(HTTPException) as excinfo:
+        auth.assert_channel_roles(channel_name, ["maintainer"])
+    assert excinfo.value.status_code == 403
+    auth.assert_channel_roles(channel_name, ["member"])
+
+    # bulk deletes too
+    db.query(ChannelMember).filter(ChannelMember.user_id == data.user_a.id).delete()
+    db.commit()
+    with pytest.raises(HTTPException):
+        Rules(data.keya, {}, db, cache=cache).assert_channel_read(data.channel2)
+
+
+def test_authorization_cache_expires(data: Data, db):
+    cache = AuthorizationCache(ttl=10)
+    auth = Rules(data.keya, {}, db, cache=cache)
+    assert auth.get_user() == data.user_a.id
+
+    # changes of other processes are seen after ttl seconds
+    with mock.patch("quetz.utils.time.monotonic", return_value=1e12):
+        with mock.patch.object(db, "query", wraps=db.query) as query:
+            assert Rules(data.keya, {}, db, cache=cache).get_user() == data.user_a.id
+            assert query.called
+
+    assert get_shared_cache(0) is None
+    assert get_shared_cache(5) is get_shared_cache(5)
+
+
+def test_authorization_cache_api_keys(data: Data, db):
+    cache = AuthorizationCache(ttl=60)
+    cache.max_entries = 3
+
+    # invalid keys are not cached, valid ones are cached by their hash
+    for i in range(5):
+        assert Rules(f"invalid-{i}", {}, db, cache=cache).get_user() is None
+    assert Rules(data.keya, {}, db, cache=cache).get_user() == data.user_a.id
+    assert len(cache._entries) == 1
+    assert all(data.keya not in key for key in cache._entries)
+
+    # the cache is bounded, expired entries are pruned when it is full
+    for user in [data.user_a, data.user_b, data.user_c]:
+        Rules(data.keya, {}, db, cache=cache)._user_role(user.id)
+    assert len(cache._entries) == 3
+    with mock.patch("quetz.utils.time.monotonic", return_value=1e12):
+        Rules(data.keyb, {}, db, cache=cache).get_user()
+    assert len(cache._entries) == 1
+
+
 def test_authorizations_with_expired_api_key(data, client):
     response = client.get(f"/api/dummylogin/{data.user_c.username}")
     assert response.status_code == 200
@@ -1,15 +1,25 @@
 import datetime
+import json
 import uuid
 
 import pytest
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+from sqlalchemy.engine.url import make_url
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm.exc import ObjectDeletedError
 
 from quetz import errors, rest_models
-from quetz.dao import Dao
-from quetz.database import get_session
-from quetz.db_models import Channel, Package, PackageVersion
+from quetz.dao import AsyncDao, Dao
+from quetz.database import ASYNC_DRIVERS, get_async_session, get_session
+from quetz.db_models import (
+    Channel,
+    Package,
+    PackageVersion,
+    restore_sqlite_package_search_index,
+)
 from quetz.metrics.db_models import IntervalType, PackageVersionMetric, round_timestamp
+from quetz.utils import has_package_search_index
 
 
 @pytest.fixture
@@ -169,6 +179,47 @@ def test_update_channel_size(dao, channel, db, package_version):
     assert channel.size == package_version.size
 
 
+def test_channel_size_bookkeeping(dao, channel, package, db, user):
+    def channel_size():
+        return db.query(Channel.size).filter(Channel.name == channel.name).scalar()
+
+    def create_version(version, size, upsert=False):
+        return dao.create_version(
+            channel_name=channel.name,
+            package_name=package.name,
+            package_format="tarbz2",
+            platform="noarch",
+            version=version,
+            build_number="0",
+            build_string="",
+            filename=f"{package.name}-{version}-0.tar.bz2",
+            info="{}",
+            uploader_id=user.id,
+            size=size,
+            upsert=upsert,
+        )
+
+    assert channel_size() == 0
+
+    create_version("0.1", 100)
+    version_2 = create_version("0.2", 20)
+    assert channel_size() == 120
+
+    # overwrite
+    create_version("0.1", 50, upsert=True)
+    assert channel_size() == 70
+
+    db.delete(version_2)
+    db.commit()
+    assert channel_size() == 50
+
+    # drift is corrected by recomputing the size
+    dao.update_channel(channel.name, {"size": 1000})
+    assert dao.update_channel_size(channel.name) == -950
+    assert channel_size() == 50
+    assert dao.update_channel_size(channel.name) == 0
+
+
 def test_increment_download_count(
     dao: Dao, channel, db, package_version, session_maker
 ):
@@ -213,6 +264,48 @@ def test_increment_download_count(
     assert package_version.download_count == 3
 
 
+def test_increment_download_counts_batch(
+    dao: Dao, channel, db, package_version, user, monkeypatch
+):
+    other_version = dao.create_version(
+        channel.name,
+        package_version.package_name,
+        "tarbz2",
+        "noarch",
+        "0.2",
+        0,
+        "",
+        "test-package-0.2-0.tar.bz2",
+        "{}",
+        user.id,
+        size=0,
+    )
+    # force multiple statements per interval
+    monkeypatch.setattr("quetz.dao.UPSERT_BATCH_SIZE", 1)
+
+    now = datetime.datetime(2020, 10, 1, 10, 1, 10)
+    counts = {
+        (channel.name, package_version.filename, package_version.platform): 3,
+        (channel.name, other_version.filename, other_version.platform): 5,
+        (channel.name, "missing-0.1-0.tar.bz2", "linux-64"): 1,
+    }
+    dao.incr_download_counts(counts, timestamp=now)
+    dao.incr_download_counts(counts, timestamp=now)
+
+    db.refresh(package_version)
+    db.refresh(other_version)
+    assert package_version.download_count == 6
+    assert other_version.download_count == 10
+
+    metrics = (
+        db.query(PackageVersionMetric)
+        .filter(PackageVersionMetric.filename == other_version.filename)
+        .all()
+    )
+    assert len(metrics) == len(IntervalType)
+    assert all(m.count == 10 for m in metrics)
+
+
 def test_get_package_version_metrics(dao: Dao, channel, db, package_version):
     now = datetime.datetime(2020, 10, 1, 10, 1, 10)
     dao.incr_download_count(
@@ -460,3 +553,238 @@ def test_rollback_on_collision(
 
     db.delete(requested)
     db.commit()
+
+
+@pytest.mark.asyncio
+async def test_async_dao(dao: Dao, channel, package, package_version):
+    async_dao = AsyncDao(dao.db)
+
+    channel_names = await async_dao.get_channels(
+        0, -1, None, None, convert=lambda channels: [c.name for c in channels]
+    )
+    assert channel_names == [channel.name]
+
+    filenames = await async_dao.get_package_versions(
+        package, convert=lambda rows: [version.filename for version, _, _ in rows]
+    )
+    assert filenames == [package_version.filename]
+
+    assert await async_dao.get_package(channel.name, package.name) is package
+
+
+@pytest.mark.parametrize("sqlite_in_memory", [False])
+@pytest.mark.parametrize("auto_rollback", [False])
+@pytest.mark.asyncio
+async def test_async_dao_with_async_session(database_url, user_with_channel):
+    pytest.importorskip(ASYNC_DRIVERS[make_url(database_url).get_backend_name()])
+
+    db = get_async_session(database_url, reuse_engine=False)
+    try:
+        channel = await AsyncDao(db).get_channel("new-test-channel")
+    finally:
+        await db.close()
+        await db.bind.dispose()
+
+    assert channel.name == "new-test-channel"
+
+
+def test_get_packages_with_cursor(dao: Dao, channel, user):
+    names = [f"package-{i}" for i in range(5)]
+    for name in names:
+        dao.create_package(
+            channel.name, rest_models.Package(name=name), user.id, "owner"
+        )
+
+    def get_pages(order_by):
+        pages = []
+        cursor = ""
+        while cursor is not None:
+            page = dao.get_packages(
+                channel.name, 0, 2, order_by=order_by, cursor=cursor
+            )
+            pages.append([p.name for p in page["result"]])
+            cursor = page["pagination"]["next_cursor"]
+        return pages
+
+    assert get_pages(None) == [names[:2], names[2:4], names[4:]]
+    assert get_pages("name:desc") == [names[:2:-1], names[2:0:-1], names[:1]]
+
+    page = dao.get_packages(channel.name, 0, 2, cursor="", count="exact")
+    assert page["pagination"]["all_records_count"] == 5
+
+    with pytest.raises(errors.ValidationError):
+        dao.get_packages(channel.name, 0, 2, order_by="latest_change", cursor="")
+
+
+def test_get_packages_with_cursor_null_sort_keys(dao: Dao, channel, user):
+    summaries = {"a": None, "b": "y", "c": None, "d": "x", "e": None, "f": "x"}
+    for name, summary in summaries.items():
+        dao.create_package(
+            channel.name,
+            rest_models.Package(name=name, summary=summary),
+            user.id,
+            "owner",
+        )
+
+    def get_names(order_by, limit):
+        names = []
+        cursor = ""
+        while cursor is not None:
+            page = dao.get_packages(
+                channel.name, 0, limit, order_by=order_by, cursor=cursor
+            )
+            names.extend(p.name for p in page["result"])
+            cursor = page["pagination"]["next_cursor"]
+        return names
+
+    # null values come last, pages may end on them
+    for limit in [1, 2, 4]:
+        assert get_names("summary:asc", limit) == ["d", "f", "b", "a", "c", "e"]
+        assert get_names("summary:desc", limit) == ["b", "d", "f", "a", "c", "e"]
+
+
+def test_search_packages(dao: Dao, db, channel, user):
+    packages = {
+        "numpy-stubs": "type stubs",
+        "numpy": "array computing",
+        "scipy": "scientific computing built on numpy",
+        "pandas": "data analysis",
+        "xnumpyx": "",
+    }
+    for name, summary in packages.items():
+        dao.create_package(
+            channel.name,
+            rest_models.Package(name=name, summary=summary),
+            user.id,
+            "owner",
+        )
+
+    def search(query):
+        return [p.name for p in dao.search_packages([query], [], user.id)]
+
+    # exact name, name prefix, name substring, then summary match
+    assert search("numpy") == ["numpy", "numpy-stubs", "xnumpyx", "scipy"]
+    assert search("NumPy") == ["numpy", "numpy-stubs", "xnumpyx", "scipy"]
+    assert search("computing") == ["numpy", "scipy"]
+    # short keywords are not in the trigram index
+    assert search("nd") == ["pandas"]
+
+    # downloads break ties
+    dao.create_version(
+        channel_name=channel.name,
+        package_name="scipy",
+        package_format="tarbz2",
+        platform="noarch",
+        version="0.0.1",
+        build_number="0",
+        build_string="",
+        filename="scipy.tar.bz2",
+        info="{}",
+        uploader_id=user.id,
+        size=101,
+        upsert=False,
+    )
+    dao.incr_download_count(channel.name, "scipy.tar.bz2", "noarch", incr=10)
+    assert search("computing") == ["scipy", "numpy"]
+
+    # the index follows the updates of the packages
+    pandas = dao.get_package(channel.name, "pandas")
+    pandas.summary = "tabular data analysis and computing"
+    db.commit()
+    assert search("tabular") == ["pandas"]
+    db.delete(pandas)
+    db.commit()
+    assert search("tabular") == []
+
+
+def test_search_index_restored_after_batch_migration(dao: Dao, db, channel, user):
+    if db.get_bind().dialect.name != "sqlite" or not has_package_search_index(db):
+        pytest.skip("requires the SQLite search index")
+
+    for name, summary in [("numpy", "array computing"), ("pandas", "dataframes")]:
+        dao.create_package(
+            channel.name,
+            rest_models.Package(name=name, summary=summary),
+            user.id,
+            "owner",
+        )
+    db.commit()
+
+    def search(query):
+        return [p.name for p in dao.search_packages([query], [], user.id)]
+
+    # recreating the table drops the triggers of the search index
+    connection = db.connection()
+    with Operations(MigrationContext.configure(connection)).batch_alter_table(
+        "packages", recreate="always"
+    ):
+        pass
+    pandas = dao.get_package(channel.name, "pandas")
+    pandas.summary = "tabular data"
+    db.commit()
+    assert search("tabular") == []
+
+    assert restore_sqlite_package_search_index(db.connection())
+    assert not restore_sqlite_package_search_index(db.connection())
+    assert search("tabular") == ["pandas"]
+    assert search("computing") == ["numpy"]
+
+    db.delete(dao.get_package(channel.name, "numpy"))
+    db.commit()
+    assert search("computing") == []
+    assert search("tabular") == ["pandas"]
+
+
+def test_cleanup_channel_db(dao: Dao, db, channel, user):
+    def create_version(package_name, version, platform="noarch"):
+        return dao.create_version(
+            channel_name=channel.name,
+            package_name=package_name,
+            package_format="tarbz2",
+            platform=platform,
+            version=version,
+            build_number=0,
+            build_string="",
+            filename=f"{package_name}-{version}-0.tar.bz2",
+            info="{}",
+            uploader_id=user.id,
+            size=1,
+        )
+
+    for name in ["empty", "sorted", "unsorted"]:
+        dao.create_package(
+            channel.name, rest_models.Package(name=name), user.id, "owner"
+        )
+    dao.update_package_channeldata(
+        channel.name, "sorted", {"subdirs": ["noarch", "linux-64", "noarch"]}
+    )
+
+    sorted_versions = [
+        create_version("sorted", "0.1", "linux-64"),
+        create_version("sorted", "0.2", "linux-64"),
+        create_version("sorted", "0.1"),
+    ]
+    unsorted_versions = [
+        create_version("unsorted", version) for version in ["0.1", "0.3", "0.2"]
+    ]
+    for version, order in zip(unsorted_versions, [0, 2, 1]):
+        version.version_order = order
+    db.commit()
+
+    def version_orders(versions):
+        for version in versions:
+            db.refresh(version)
+        return [version.version_order for version in versions]
+
+    dao.cleanup_channel_db(channel.name, dry_run=True)
+    assert dao.get_package(channel.name, "empty") is not None
+    assert version_orders(unsorted_versions) == [0, 2, 1]
+
+    dao.cleanup_channel_db(channel.name)
+    assert dao.get_package(channel.name, "empty") is None
+    package = dao.get_package(channel.name, "sorted")
+    db.refresh(package)
+    assert json.loads(package.channeldata)["subdirs"] == ["linux-64", "noarch"]
+    assert package.platforms == "linux-64:noarch"
+    assert version_orders(sorted_versions) == [1, 0, 2]
+    assert version_orders(unsorted_versions) == [2, 0, 1]
@@ -0,0 +1,105 @@
+import threading
+from collections import Counter
+
+import pytest
+
+from quetz.metrics.download_counter import DownloadCounter
+
+
+@pytest.fixture
+def committed():
+    return []
+
+
+@pytest.fixture
+def counter(committed):
+    return DownloadCounter(
+        committed.append, max_downloads=3, delay_seconds=60, max_buffer_size=2
+    )
+
+
+def test_download_counter_aggregates(counter: DownloadCounter, committed):
+    counter.add("channel", "a-0.1-0.tar.bz2", "linux-64")
+    counter.add("channel", "a-0.1-0.tar.bz2", "linux-64")
+    assert len(counter) == 2
+    assert not counter.should_flush()
+
+    counter.add("channel", "b-0.1-0.tar.bz2", "noarch")
+    assert counter.should_flush()
+
+    assert counter.flush() == 3
+    assert committed == [
+        Counter(
+            {
+                ("channel", "a-0.1-0.tar.bz2", "linux-64"): 2,
+                ("channel", "b-0.1-0.tar.bz2", "noarch"): 1,
+            }
+        )
+    ]
+    assert len(counter) == 0
+    assert not counter.should_flush()
+    assert counter.flush() == 0
+    assert len(committed) == 1
+
+
+def test_download_counter_flush_after_delay(counter: DownloadCounter):
+    counter.add("channel", "a-0.1-0.tar.bz2", "linux-64")
+    assert not counter.should_flush()
+    assert counter.should_flush(now=counter._last_flush + 60)
+
+
+def test_download_counter_failed_flush_is_retried(caplog):
+    committed = []
+    fail = True
+
+    def commit(counts):
+        if fail:
+            raise RuntimeError("database unavailable")
+        committed.append(counts)
+
+    counter = DownloadCounter(commit)
+    counter.add("channel", "a-0.1-0.tar.bz2", "linux-64", incr=2)
+
+    assert counter.flush() == 0
+    assert "could not save 2 download counts" in caplog.text
+
+    counter.add("channel", "a-0.1-0.tar.bz2", "linux-64")
+    assert len(counter) == 3
+
+    fail = False
+    assert counter.flush() == 3
+    assert committed == [Counter({("channel", "a-0.1-0.tar.bz2", "linux-64"): 3})]
+
+
+def test_download_counter_backpressure(counter: DownloadCounter, committed):
+    counter.max_wait_seconds = 10
+    counter.add("channel", "a-0.1-0.tar.bz2", "linux-64")
+    counter.add("channel", "b-0.1-0.tar.bz2", "linux-64")
+
+    # existing files can always be counted
+    counter.add("channel", "a-0.1-0.tar.bz2", "linux-64")
+
+    # a new file waits until the buffer was flushed
+    adding = threading.Thread(
+        target=counter.add, args=("channel", "c-0.1-0.tar.bz2", "linux-64")
+    )
+    adding.start()
+    adding.join(0.1)
+    assert adding.is_alive()
+
+    assert counter.flush() == 3
+    adding.join(5)
+    assert not adding.is_alive()
+    assert counter.flush() == 1
+
+    assert sum(sum(c.values()) for c in committed) == 4
+
+
+def test_download_counter_backpressure_timeout(counter: DownloadCounter, committed):
+    counter.max_wait_seconds = 0.01
+    for name in "abc":
+        counter.add("channel", f"{name}-0.1-0.tar.bz2", "linux-64")
+
+    # counts are not dropped when the buffer is not flushed in time
+    assert len(counter) == 3
+    assert counter.flush() == 3
@@ -1,3 +1,6 @@
+import contextlib
+import json
+from collections import Counter
 import os
 import pickle
 import sys
@@ -7,13 +10,25 @@ from datetime import datetime, timedelta
 from pathlib import Path
 
 import pytest
+import sqlalchemy as sa
 
 from quetz.config import Config
 from quetz.dao import Dao
 from quetz.db_models import User
 from quetz.jobs.dao import JobsDao
 from quetz.jobs.models import Job, JobStatus, Task, TaskStatus
-from quetz.jobs.runner import Supervisor, mk_sql_expr, parse_conda_spec
+from quetz.jobs.notifications import JobWaiter, SQLiteJobWaiter, get_job_waiter
+from quetz.jobs.progress import TaskProgress
+from quetz.jobs.scheduling import ConcurrencyLimits, RunningTasks, schedule_tasks
+from quetz.database_extensions import _version_match
+from quetz.jobs.runner import (
+    Supervisor,
+    match_version,
+    mk_sql_expr,
+    mk_version_filter,
+    parse_conda_spec,
+)
+from quetz.metrics.view import JobProgressCollector
 from quetz.rest_models import Channel, Package
 from quetz.tasks.workers import SubprocessWorker
 from quetz.testing.mockups import MockWorker
@@ -149,6 +164,18 @@ def dummy_func(package_version: dict):
     pass
 
 
+def reporting_func(package_version: dict, progress: TaskProgress):
+    progress.set_phase("process")
+    progress.add_total(4)
+    progress.advance(3, nbytes=1000)
+    progress.set_result({"processed": 3})
+
+
+def fail_on_version_3(package_version: dict):
+    if package_version["version"] == "0.3":
+        raise Exception("some exception")
+
+
 @pytest.mark.asyncio
 async def test_create_job(db, user, package_version, supervisor):
     func_serialized = pickle.dumps(func)
@@ -179,7 +206,7 @@ async def test_create_job(db, user, package_version, supervisor):
 
 @pytest.mark.asyncio
 async def test_run_tasks_only_on_new_versions(
-    db, user, package_version, dao, channel_name, package_name, supervisor
+    db, user, package_version, dao, channel_name, package_name, supervisor, mocker
 ):
     func_serialized = pickle.dumps(dummy_func)
     job = Job(owner_id=user.id, manifest=func_serialized, items_spec="*")
@@ -209,6 +236,8 @@ async def test_run_tasks_only_on_new_versions(
     filename = "test-package-0.2-0.tar.bz2"
     add_package_version(filename, "0.2", channel_name, user, dao, package_name)
 
+    # the dispatched tasks are not executed, so that they stay pending
+    mocker.patch.object(supervisor.manager, "execute")
     job.status = JobStatus.pending
     db.commit()
     supervisor.run_jobs()
@@ -225,7 +254,8 @@ async def test_run_tasks_only_on_new_versions(
     db.refresh(job)
     new_jobs = supervisor.run_tasks()
     assert len(job.tasks) == 4
-    assert len(new_jobs) == 2
+    # both new tasks are dispatched in a single batch
+    assert len(new_jobs) == 1
 
 
 @pytest.mark.asyncio
@@ -308,6 +338,36 @@ async def test_restart_worker_process(
     assert job.status == JobStatus.failed
 
 
+def test_resume_tasks_after_restart(db, user, supervisor, caplog):
+    sync_job = Job(
+        owner_id=user.id,
+        manifest=b"synchronize",
+        extra_args=json.dumps({"channel_name": "my-channel"}),
+        status=JobStatus.running,
+    )
+    other_job = Job(
+        owner_id=user.id,
+        manifest=pickle.dumps(long_running),
+        status=JobStatus.running,
+    )
+    db.add_all([sync_job, other_job])
+    db.flush()
+    sync_task = Task(job=sync_job, status=TaskStatus.running)
+    other_task = Task(job=other_job, status=TaskStatus.pending)
+    db.add_all([sync_task, other_task])
+    db.commit()
+
+    # simulate restart
+    Supervisor(db, supervisor.manager)
+
+    db.refresh(sync_task)
+    db.refresh(other_task)
+    # mirror synchronization resumes from its checkpoints
+    assert sync_task.status == TaskStatus.created
+    assert other_task.status == TaskStatus.failed
+    assert "1 tasks resumed" in caplog.text
+
+
 @pytest.mark.asyncio
 async def test_failed_task(db, user, package_version, supervisor):
     func_serialized = pickle.dumps(failed_func)
@@ -475,6 +535,102 @@ def test_parse_conda_spec():
     dict_spec = parse_conda_spec("my-*")
     assert dict_spec == [{"package_name": ("like", "my-*")}]
 
+    dict_spec = parse_conda_spec("my-package!=0.1,other-package")
+    assert dict_spec == [
+        {"version": ("ne", "0.1"), "package_name": ("eq", "my-package")},
+        {"package_name": ("eq", "other-package")},
+    ]
+
+    dict_spec = parse_conda_spec("my-package=1.2")
+    assert dict_spec == [
+        {"version": ("startswith", "1.2"), "package_name": ("eq", "my-package")}
+    ]
+
+    dict_spec = parse_conda_spec("my-package 1.2.*")
+    assert dict_spec == [
+        {"version": ("startswith", "1.2"), "package_name": ("eq", "my-package")}
+    ]
+
+    dict_spec = parse_conda_spec("my-package~=1.4.2")
+    assert dict_spec == [
+        {"version": ("compatible", "1.4.2"), "package_name": ("eq", "my-package")}
+    ]
+
+    dict_spec = parse_conda_spec("my-package >=1.0rc1,<2|>=3")
+    assert dict_spec == [
+        {
+            "version": ("or", ("and", ("gte", "1.0rc1"), ("lt", "2")), ("gte", "3")),
+            "package_name": ("eq", "my-package"),
+        }
+    ]
+
+    with pytest.raises(ValueError):
+        parse_conda_spec(">=0.1")
+
+
+@pytest.mark.parametrize(
+    "expr,version,expected",
+    [
+        (("gt", "0.9"), "0.10", True),
+        (("lt", "0.9"), "0.10", False),
+        (("eq", "1.0"), "1.0.0", True),
+        (("ne", "1.0"), "1.0.0", False),
+        (("lte", "1.0"), "1.0rc1", True),
+        (("startswith", "1.2"), "1.2.3", True),
+        (("startswith", "1.2"), "1.20", False),
+        (("compatible", "1.4.2"), "1.4.5", True),
+        (("compatible", "1.4.2"), "1.5", False),
+        (("or", ("and", ("gte", "1"), ("lt", "2")), ("gt", "3")), "2.5", False),
+        (("or", ("and", ("gte", "1"), ("lt", "2")), ("gt", "3")), "3.1", True),
+        (("gte", "0.1"), "invalid version!", False),
+    ],
+)
+def test_match_version(expr, version, expected):
+    assert match_version(expr, version) is expected
+
+
+def test_mk_version_filter():
+    assert mk_version_filter(parse_conda_spec("my-package,other-*")) is None
+
+    version_filter = mk_version_filter(parse_conda_spec("my-*>=0.9,<0.11,other"))
+    assert version_filter("my-package", "0.10")
+    assert not version_filter("my-package", "0.2")
+    assert version_filter("other", "0.2")
+    assert not version_filter("another", "0.10")
+
+
+@pytest.mark.parametrize(
+    "dialect,expected",
+    [
+        (
+            "sqlite",
+            "version_match(package_versions.version, '>=0.1,(<0.2|>0.3)') "
+            "AND package_versions.package_name = 'my-package'",
+        ),
+        (
+            "postgresql",
+            "version_compare(package_versions.version, '>=0.1,(<0.2|>0.3)') "
+            "AND package_versions.package_name = 'my-package'",
+        ),
+    ],
+)
+def test_mk_query_version_match(monkeypatch, dialect, expected):
+    from sqlalchemy.dialects import postgresql, sqlite
+
+    monkeypatch.setattr("quetz.jobs.runner.version_match", _version_match)
+
+    spec = [
+        {
+            "version": ("and", ("gte", "0.1"), ("or", ("lt", "0.2"), ("gt", "0.3"))),
+            "package_name": ("eq", "my-package"),
+        }
+    ]
+    dialect = {"sqlite": sqlite, "postgresql": postgresql}[dialect].dialect()
+    s = mk_sql_expr(spec)
+    sql_expr = str(s.compile(dialect=dialect, compile_kwargs={"literal_binds": True}))
+
+    assert sql_expr == expected
+
 
 @pytest.mark.parametrize(
     "spec,n_tasks",
@@ -484,6 +640,12 @@ def test_parse_conda_spec():
         ("my-package==0.1,my-package==0.2", 1),
         ("my-package", 1),
         ("*", 1),
+        ("my-package>=0.1,<0.2", 1),
+        ("my-package>0.01", 0),
+        ("my-package=0", 1),
+        ("my-package!=0.1", 0),
+        ("my-package==0.2|>=0.1.0a", 1),
+        ("other-package>=0.1,my-package", 1),
     ],
 )
 def test_filter_versions(db, user, package_version, spec, n_tasks, supervisor):
@@ -503,6 +665,82 @@ def test_filter_versions(db, user, package_version, spec, n_tasks, supervisor):
     assert n_created_tasks == n_tasks
 
 
+@pytest.mark.parametrize(
+    "spec,n_tasks",
+    [("*", 5), ("test-package", 5), ("test-package>=0.2,<0.5", 3)],
+)
+def test_create_tasks_in_chunks(
+    db, user, dao, channel_name, public_package, supervisor, mocker, spec, n_tasks
+):
+    mocker.patch("quetz.jobs.runner.TASK_INSERT_CHUNK_SIZE", 2)
+    for i in range(5):
+        add_package_version(
+            f"test-package-0.{i}-0.tar.bz2", f"0.{i}", channel_name, user, dao
+        )
+    job = Job(owner_id=user.id, manifest=pickle.dumps(func), items_spec=spec)
+    db.add(job)
+    db.commit()
+
+    supervisor.run_jobs()
+    db.refresh(job)
+
+    assert job.status == JobStatus.running
+    assert len(job.tasks) == n_tasks
+    assert all(task.status == TaskStatus.created for task in job.tasks)
+
+    # tasks are not created again for the same versions
+    job.status = JobStatus.pending
+    db.commit()
+    supervisor.run_jobs()
+    db.refresh(job)
+    assert len(job.tasks) == n_tasks
+
+
+def test_run_tasks_in_batches(
+    db, user, dao, config, channel_name, public_package, mocker
+):
+    for i in range(5):
+        add_package_version(
+            f"test-package-0.{i}-0.tar.bz2", f"0.{i}", channel_name, user, dao
+        )
+    job = Job(
+        owner_id=user.id, manifest=pickle.dumps(fail_on_version_3), items_spec="*"
+    )
+    db.add(job)
+    db.commit()
+
+    manager = MockWorker(config, db, dao)
+    execute = mocker.spy(manager, "execute")
+    get_remote_session = mocker.patch("quetz.deps.get_remote_session")
+    supervisor = Supervisor(db, manager, task_batch_size=2)
+    supervisor.run_jobs()
+    supervisor.run_tasks()
+
+    # one worker call and setup per batch of tasks
+    assert execute.call_count == 3
+    assert get_remote_session.call_count == 3
+    batch = execute.call_args_list[0].kwargs["batch"]
+    assert [kwargs["package_version"]["version"] for _, kwargs in batch] == [
+        "0.0",
+        "0.1",
+    ]
+
+    supervisor.check_status()
+    db.refresh(job)
+    statuses = {
+        task.package_version.version: task.status
+        for task in db.query(Task).filter(Task.job_id == job.id)
+    }
+    assert statuses == {
+        "0.0": TaskStatus.success,
+        "0.1": TaskStatus.success,
+        "0.2": TaskStatus.success,
+        "0.3": TaskStatus.failed,
+        "0.4": TaskStatus.success,
+    }
+    assert job.status == JobStatus.failed
+
+
 @pytest.mark.parametrize("user_role", ["owner"])
 def test_refresh_job(auth_client, user, db, package_version, supervisor):
     func_serialized = pickle.dumps(dummy_func)
@@ -649,6 +887,30 @@ def test_post_new_job_from_plugin(
         dummy_func.assert_not_called()
 
 
+@pytest.mark.parametrize("user_role", ["owner"])
+def test_job_priority_api(auth_client, user, db, mock_action):
+    response = auth_client.post(
+        "/api/jobs",
+        json={"items_spec": "*", "manifest": "test_action", "priority": 2},
+    )
+    assert response.status_code == 201
+    assert response.json()["priority"] == 2
+    job = db.get(Job, response.json()["id"])
+    assert job.priority == 2
+
+    response = auth_client.patch(f"/api/jobs/{job.id}", json={"priority": -1})
+    assert response.status_code == 200
+    db.refresh(job)
+    assert job.priority == -1
+    assert job.status == JobStatus.pending
+
+    response = auth_client.get(f"/api/jobs/{job.id}")
+    assert response.json()["priority"] == -1
+
+    response = auth_client.patch(f"/api/jobs/{job.id}", json={"priority": 100})
+    assert response.status_code == 422
+
+
 @pytest.mark.parametrize("user_role", ["owner"])
 def test_post_new_job_with_handler(
     auth_client, user, db, mock_action, sync_supervisor, package_version
@@ -805,6 +1067,88 @@ def test_get_tasks(
         assert data["result"][0]["job_id"] == job.id
 
 
+@pytest.mark.parametrize("user_role", ["owner"])
+def test_get_tasks_progress(auth_client, db, user, package_version, sync_supervisor):
+    job = Job(items_spec="*", owner=user, manifest=pickle.dumps(reporting_func))
+    db.add(job)
+    db.commit()
+
+    sync_supervisor.run_once()
+
+    db.refresh(job)
+    task = job.tasks[0]
+    assert task.status == TaskStatus.success
+    assert task.started is not None
+    assert (task.progress_done, task.progress_total) == (3, 4)
+    assert task.progress_bytes == 1000
+    assert task.progress_phase == "process"
+
+    response = auth_client.get(f"/api/jobs/{job.id}/tasks?status=success")
+    assert response.status_code == 200
+    data = response.json()["result"][0]
+    assert data["progress_done"] == 3
+    assert data["progress_total"] == 4
+    assert data["progress_bytes"] == 1000
+    assert data["progress_phase"] == "process"
+    assert data["result"] == {"processed": 3}
+    assert data["started"]
+    assert "items_per_second" in data
+
+
+def test_task_progress_throttled(db, user, mocker):
+    job = Job(owner=user, manifest=b"test_action")
+    task = Task(job=job)
+    db.add(task)
+    db.commit()
+
+    monotonic = mocker.patch("quetz.jobs.progress.time.monotonic", return_value=0)
+    progress = TaskProgress(db, task.id, "test_action", min_interval=10)
+    progress.add_total(10)
+    progress.advance(2)
+    db.refresh(task)
+    assert (task.progress_done, task.progress_total) == (0, 10)
+
+    monotonic.return_value = 11
+    progress.advance()
+    db.refresh(task)
+    assert task.progress_done == 3
+
+    progress.advance()
+    progress.flush()
+    db.refresh(task)
+    assert task.progress_done == 4
+
+
+def test_job_progress_collector(db, user):
+    started = datetime(2026, 1, 1, 10, 0, 0)
+    job = Job(owner=user, manifest=b"synchronize", status=JobStatus.running)
+    for done, total in [(10, 20), (5, 20)]:
+        db.add(
+            Task(
+                job=job,
+                status=TaskStatus.running,
+                started=started,
+                progress_done=done,
+                progress_total=total,
+                progress_bytes=100,
+                progress_updated=started + timedelta(seconds=10),
+            )
+        )
+    db.add(Job(owner=user, manifest=b"reindex", status=JobStatus.success))
+    db.commit()
+
+    collector = JobProgressCollector(lambda: contextlib.nullcontext(db))
+    metrics = {metric.name: metric.samples for metric in collector.collect()}
+
+    labels = {"job_id": str(job.id), "action": "synchronize"}
+    assert [(s.labels, s.value) for s in metrics["quetz_job_items_done"]] == [
+        (labels, 15)
+    ]
+    assert metrics["quetz_job_progress_ratio"][0].value == 15 / 40
+    assert metrics["quetz_job_bytes_processed"][0].value == 200
+    assert metrics["quetz_job_items_per_second"][0].value == 1.5
+
+
 @pytest.fixture()
 def other_user(db):
     other_user = User(id=uuid.uuid4().bytes, username="otheruser")
@@ -1022,3 +1366,244 @@ def test_run_periodic_package_version_job(
     sync_supervisor.run_once()
     assert len(package_version_job.tasks) == 2
     assert package_version_job.status == JobStatus.pending
+
+
+def test_run_once_idle(sync_supervisor, db, action_job, mock_action):
+    assert sync_supervisor.run_once()
+    assert not sync_supervisor.run_once()
+
+
+def test_next_due_job(sync_supervisor, db, action_job, mock_action):
+    start_at = datetime.utcnow() + timedelta(seconds=30)
+    action_job.start_at = start_at
+    db.commit()
+
+    assert not sync_supervisor.run_once()
+    assert sync_supervisor._next_due == start_at
+    assert 0 < sync_supervisor._poll_interval(60) <= 30
+    assert sync_supervisor._poll_interval(1) == 1
+
+
+def test_job_commit_wakes_waiter(db, user):
+    waiter = JobWaiter()
+    waiter.wait(0)
+    assert not waiter.wait(0)
+
+    job = Job(owner=user, manifest=b"")
+    db.add(job)
+    db.commit()
+    assert waiter.wait(0)
+    assert not waiter.wait(0)
+
+    # changes of other models do not wake up the supervisor
+    user.username = "other-name"
+    db.commit()
+    assert not waiter.wait(0)
+
+    db.delete(job)
+    db.commit()
+    assert waiter.wait(0)
+
+
+def test_sqlite_waiter_other_connection(tmp_path):
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'jobs.db'}")
+    with engine.begin() as connection:
+        connection.exec_driver_sql("CREATE TABLE t (x INTEGER)")
+
+    waiter = get_job_waiter(engine)
+    assert isinstance(waiter, SQLiteJobWaiter)
+    try:
+        assert not waiter.wait(0.1)
+
+        # commits of other processes are only visible in the database file
+        other_engine = sa.create_engine(f"sqlite:///{tmp_path / 'jobs.db'}")
+        with other_engine.begin() as connection:
+            connection.exec_driver_sql("INSERT INTO t VALUES (1)")
+        other_engine.dispose()
+
+        start = time.monotonic()
+        assert waiter.wait(5)
+        assert time.monotonic() - start < 1
+        assert not waiter.wait(0.1)
+    finally:
+        waiter.close()
+        engine.dispose()
+
+
+def test_postgres_waiter_connection_not_returned_to_pool(engine):
+    if engine.dialect.name != "postgresql":
+        pytest.skip("requires PostgreSQL")
+
+    waiter = get_job_waiter(engine)
+    listening = waiter._dbapi_connection
+    waiter.close()
+
+    # the autocommit connection listening to the jobs channel is closed
+    assert listening.closed
+    with engine.connect() as connection:
+        assert connection.connection.driver_connection is not listening
+
+
+def make_job_tasks(job_id, n_tasks, priority=0, manifest=b"test_action", channel="a"):
+    job = Job(
+        id=job_id,
+        manifest=manifest,
+        priority=priority,
+        extra_args=json.dumps({"channel_name": channel}),
+    )
+    return job, [Task(id=job_id * 100 + i, job=job) for i in range(n_tasks)]
+
+
+def test_schedule_tasks_weighted():
+    jobs_tasks = [make_job_tasks(1, 6), make_job_tasks(2, 6, priority=1)]
+
+    batches = schedule_tasks(jobs_tasks, 1, RunningTasks())
+
+    assert [batch[0].job.id for batch in batches] == [2, 2, 1] * 3 + [1] * 3
+    assert sorted(task.id for batch in batches for task in batch) == sorted(
+        task.id for _, tasks in jobs_tasks for task in tasks
+    )
+
+
+def test_schedule_tasks_low_priority_not_starved():
+    jobs_tasks = [make_job_tasks(1, 3, priority=-1), make_job_tasks(2, 6)]
+
+    batches = schedule_tasks(jobs_tasks, 2, RunningTasks())
+
+    assert [len(batch) for batch in batches] == [2, 2, 2, 2, 1]
+    assert [batch[0].job.id for batch in batches] == [2, 2, 1, 2, 1]
+
+
+def test_schedule_tasks_fair_across_calls():
+    jobs_tasks = [
+        make_job_tasks(1, 20),
+        make_job_tasks(2, 20),
+        make_job_tasks(3, 20, priority=-1),
+    ]
+    limits = ConcurrencyLimits(max_running_tasks=4)
+    running = RunningTasks()
+    virtual_times = {}
+    counts = Counter()
+
+    # the workers are full, a slot is freed before every call
+    for i in range(24):
+        if i > 0:
+            running.add("a", "test_action", -1)
+        batches = schedule_tasks(jobs_tasks, 1, running, limits, virtual_times)
+        assert len(batches) == (4 if i == 0 else 1)
+        for (task,) in batches:
+            jobs_tasks = [
+                (job, [t for t in tasks if t is not task]) for job, tasks in jobs_tasks
+            ]
+            counts[task.job.id] += 1
+
+    # jobs of the same priority get the same share, lower priorities half
+    assert counts == {1: 11, 2: 11, 3: 5}
+
+
+def test_schedule_tasks_limits():
+    jobs_tasks = [
+        make_job_tasks(1, 3, manifest=b"synchronize", channel="a"),
+        make_job_tasks(2, 3, manifest=b"synchronize", channel="b"),
+        make_job_tasks(3, 3, manifest=b"generate_indexes", channel="a"),
+    ]
+    running = RunningTasks()
+    running.add("b", "synchronize")
+    limits = ConcurrencyLimits(
+        max_running_per_channel=3, max_running_per_action={"synchronize": 3}
+    )
+
+    batches = schedule_tasks(jobs_tasks, 10, running, limits)
+
+    # synchronize jobs are limited to 3 tasks, channel a to 3 tasks
+    assert [[task.id for task in batch] for batch in batches] == [[100, 101], [300]]
+    assert running.total == 4
+    assert running.per_channel == {"a": 3, "b": 1}
+    assert running.per_action == {"synchronize": 3, "generate_indexes": 1}
+
+    limits = ConcurrencyLimits(max_running_tasks=4)
+    assert not schedule_tasks(jobs_tasks, 10, running, limits)
+
+
+def test_run_tasks_concurrency_limits(
+    db, user, dao, config, channel_name, public_package, mocker
+):
+    for i in range(3):
+        add_package_version(
+            f"test-package-0.{i}-0.tar.bz2", f"0.{i}", channel_name, user, dao
+        )
+    job = Job(owner_id=user.id, manifest=pickle.dumps(dummy_func), items_spec="*")
+    db.add(job)
+    db.commit()
+
+    manager = MockWorker(config, db, dao)
+    execute = mocker.patch.object(manager, "execute")
+    limits = ConcurrencyLimits(max_running_per_channel=2)
+    supervisor = Supervisor(db, manager, limits=limits)
+    supervisor.run_jobs()
+    supervisor.run_tasks()
+
+    statuses = sorted(task.status for task in job.tasks)
+    assert statuses == [TaskStatus.created, TaskStatus.pending, TaskStatus.pending]
+    assert execute.call_count == 1
+
+    # channel is full until the dispatched tasks finish
+    supervisor.run_tasks()
+    assert execute.call_count == 1
+
+    for task in job.tasks:
+        if task.status == TaskStatus.pending:
+            task.status = TaskStatus.success
+    db.commit()
+    supervisor.run_tasks()
+    assert execute.call_count == 2
+    assert all(task.status != TaskStatus.created for task in job.tasks)
+
+
+def test_run_tasks_limited_to_worker_capacity(
+    db, user, dao, config, channel_name, public_package, mocker
+):
+    for i in range(3):
+        add_package_version(
+            f"test-package-0.{i}-0.tar.bz2", f"0.{i}", channel_name, user, dao
+        )
+    low = Job(owner_id=user.id, manifest=pickle.dumps(dummy_func), items_spec="*")
+    db.add(low)
+    db.commit()
+
+    manager = MockWorker(config, db, dao)
+    manager.num_workers = 1
+    execute = mocker.patch.object(manager, "execute")
+    scheduled = mocker.patch("quetz.jobs.runner.schedule_tasks", wraps=schedule_tasks)
+    supervisor = Supervisor(db, manager, task_batch_size=1)
+    assert supervisor.limits.max_running_tasks == 1
+    supervisor.run_jobs()
+    supervisor.run_tasks()
+    assert execute.call_count == 1
+    # only the tasks which can be dispatched are loaded
+    ((jobs_tasks, *_), _) = scheduled.call_args
+    assert [len(tasks) for _, tasks in jobs_tasks] == [1]
+
+    # nothing is loaded while the workers are full
+    supervisor.run_tasks()
+    assert scheduled.call_count == 1
+
+    # tasks of a later job with higher priority overtake the queued ones
+    high = Job(
+        owner_id=user.id,
+        manifest=pickle.dumps(dummy_func),
+        items_spec="*",
+        priority=5,
+    )
+    db.add(high)
+    db.commit()
+    supervisor.run_jobs()
+    for task in low.tasks:
+        if task.status == TaskStatus.pending:
+            task.status = TaskStatus.success
+    db.commit()
+    supervisor.run_tasks()
+
+    assert execute.call_count == 2
+    assert [task.status for task in high.tasks].count(TaskStatus.pending) == 1
+    assert [task.status for task in low.tasks].count(TaskStatus.created) == 2
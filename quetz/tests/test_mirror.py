@@ -1,6 +1,8 @@
 import concurrent.futures
+import hashlib
 import json
 import os
+import threading
 import uuid
 from io import BytesIO
 from pathlib import Path
@@ -14,15 +16,18 @@ from quetz.authorization import Rules
 from quetz.condainfo import CondaInfo
 from quetz.db_models import Channel, Package, PackageVersion, User
 from quetz.jobs.runner import Supervisor
-from quetz.tasks.indexing import update_indexes
+from quetz.tasks.indexing import update_indexes, validate_packages
 from quetz.tasks.mirror import (
     KNOWN_SUBDIRS,
+    MirrorPipeline,
     RemoteRepository,
     RemoteServerError,
     create_packages_from_channeldata,
+    create_version_from_metadata,
     create_versions_from_repodata,
     handle_repodata_package,
     initial_sync_mirror,
+    prefetch_packages,
 )
 from quetz.testing.mockups import MockWorker
 
@@ -449,7 +454,6 @@ def test_synchronisation_sha(
     mirror_channel,
     dao,
     config,
-    dummy_response,
     db,
     user,
     n_new_packages,
@@ -460,9 +464,15 @@ def test_synchronisation_sha(
     pkgstore = config.get_package_store()
     rules = Rules("", {"user_id": str(uuid.UUID(bytes=user.id))}, db)
 
+    # packages are downloaded in parallel, serve them by file name
+    repodata, *package_files = repo_content
+
     class DummySession:
         def get(self, path, stream=False):
-            return dummy_response()
+            for package_file in package_files:
+                if path.endswith(package_file.name):
+                    return DummyResponse(package_file)
+            return DummyResponse(repodata)
 
         def close(self):
             pass
@@ -557,6 +567,462 @@ def test_synchronisation_no_checksums_in_db(
     assert len(versions) == n_new_packages + 1
 
 
+class RecordingSession:
+    def __init__(self, files):
+        self.files = files
+        self.requested = []
+
+    def get(self, path, stream=False):
+        self.requested.append(path)
+        if path in self.files:
+            return DummyResponse(self.files[path])
+        return DummyResponse(b"", status_code=404)
+
+    def close(self):
+        pass
+
+
+def _sync_versions(db, channel_name):
+    versions = (
+        db.query(PackageVersion.filename)
+        .filter(PackageVersion.channel_name == channel_name)
+        .all()
+    )
+    return {v.filename for v in versions}
+
+
+def test_synchronisation_resumes_from_checkpoint(mirror_channel, dao, config, db, user):
+    pkgstore = config.get_package_store()
+    rules = Rules("", {"user_id": str(uuid.UUID(bytes=user.id))}, db)
+    repodata = json.dumps(
+        {
+            "packages": {
+                "test-package-0.1-0.tar.bz2": {"sha256": "SHA"},
+                "other-package-0.2-0.tar.bz2": {"sha256": "SHA-V2"},
+            }
+        }
+    ).encode()
+    session = RecordingSession(
+        {
+            "noarch/repodata_from_packages.json": repodata,
+            "noarch/test-package-0.1-0.tar.bz2": DUMMY_PACKAGE,
+            "noarch/other-package-0.2-0.tar.bz2": OTHER_DUMMY_PACKAGE_V2,
+        }
+    )
+
+    # an interrupted synchronization processed the first package
+    dao.save_mirror_checkpoint(
+        mirror_channel.name,
+        "noarch",
+        hashlib.sha256(repodata).hexdigest(),
+        "test-package-0.1-0.tar.bz2",
+    )
+
+    initial_sync_mirror(
+        mirror_channel.name,
+        RemoteRepository("", session),
+        "noarch",
+        dao,
+        pkgstore,
+        rules,
+        skip_errors=False,
+    )
+
+    assert "noarch/test-package-0.1-0.tar.bz2" not in session.requested
+    assert _sync_versions(db, mirror_channel.name) == {"other-package-0.2-0.tar.bz2"}
+
+    checkpoint = dao.get_mirror_checkpoint(mirror_channel.name, "noarch")
+    assert checkpoint.completed
+
+    # the subdir is not synchronized again until the sync of all subdirs ends
+    session.requested.clear()
+    initial_sync_mirror(
+        mirror_channel.name,
+        RemoteRepository("", session),
+        "noarch",
+        dao,
+        pkgstore,
+        rules,
+        skip_errors=False,
+    )
+    assert session.requested == ["noarch/repodata_from_packages.json"]
+
+    dao.delete_mirror_checkpoints(mirror_channel.name)
+    assert dao.get_mirror_checkpoint(mirror_channel.name, "noarch") is None
+
+
+@pytest.mark.parametrize("config_extra", ["[mirroring]\nbatch_length = 1"])
+def test_synchronisation_checkpoint_stops_at_failed_batch(
+    mirror_channel, dao, config, db, user
+):
+    pkgstore = config.get_package_store()
+    rules = Rules("", {"user_id": str(uuid.UUID(bytes=user.id))}, db)
+    repodata = json.dumps(
+        {
+            "packages": {
+                "test-package-0.1-0.tar.bz2": {"sha256": "SHA"},
+                "other-package-0.2-0.tar.bz2": {"sha256": "SHA-V2"},
+                "test-package-0.2-0.tar.bz2": {"sha256": "SHA-TEST-V2"},
+            }
+        }
+    ).encode()
+    files = {
+        "noarch/repodata_from_packages.json": repodata,
+        "noarch/test-package-0.1-0.tar.bz2": DUMMY_PACKAGE,
+        "noarch/other-package-0.2-0.tar.bz2": b"corrupted",
+        "noarch/test-package-0.2-0.tar.bz2": DUMMY_PACKAGE_V2,
+    }
+
+    # other-package can not be extracted, its batch is skipped
+    initial_sync_mirror(
+        mirror_channel.name,
+        RemoteRepository("", RecordingSession(files)),
+        "noarch",
+        dao,
+        pkgstore,
+        rules,
+    )
+    assert _sync_versions(db, mirror_channel.name) == {
+        "test-package-0.1-0.tar.bz2",
+        "test-package-0.2-0.tar.bz2",
+    }
+    checkpoint = dao.get_mirror_checkpoint(mirror_channel.name, "noarch")
+    assert checkpoint.last_filename == "test-package-0.1-0.tar.bz2"
+    assert not checkpoint.completed
+
+    # the failed package is retried by the next synchronization
+    files["noarch/other-package-0.2-0.tar.bz2"] = OTHER_DUMMY_PACKAGE_V2
+    initial_sync_mirror(
+        mirror_channel.name,
+        RemoteRepository("", RecordingSession(files)),
+        "noarch",
+        dao,
+        pkgstore,
+        rules,
+    )
+    assert "other-package-0.2-0.tar.bz2" in _sync_versions(db, mirror_channel.name)
+    assert dao.get_mirror_checkpoint(mirror_channel.name, "noarch").completed
+
+
+def test_synchronisation_new_repodata_restarts(mirror_channel, dao, config, db, user):
+    pkgstore = config.get_package_store()
+    rules = Rules("", {"user_id": str(uuid.UUID(bytes=user.id))}, db)
+    repodata = b'{"packages": {"test-package-0.1-0.tar.bz2": {"sha256": "SHA"}}}'
+    session = RecordingSession(
+        {
+            "noarch/repodata_from_packages.json": repodata,
+            "noarch/test-package-0.1-0.tar.bz2": DUMMY_PACKAGE,
+        }
+    )
+
+    # checkpoint of an older upstream repodata
+    dao.save_mirror_checkpoint(
+        mirror_channel.name, "noarch", "OLD-HASH", "test-package-0.1-0.tar.bz2"
+    )
+
+    initial_sync_mirror(
+        mirror_channel.name,
+        RemoteRepository("", session),
+        "noarch",
+        dao,
+        pkgstore,
+        rules,
+        skip_errors=False,
+    )
+
+    assert _sync_versions(db, mirror_channel.name) == {"test-package-0.1-0.tar.bz2"}
+    checkpoint = dao.get_mirror_checkpoint(mirror_channel.name, "noarch")
+    assert checkpoint.repodata_sha256 == hashlib.sha256(repodata).hexdigest()
+
+
+def test_synchronisation_reuses_stored_files(mirror_channel, dao, config, db, user):
+    pkgstore = config.get_package_store()
+    rules = Rules("", {"user_id": str(uuid.UUID(bytes=user.id))}, db)
+    with open(DUMMY_PACKAGE, "rb") as fid:
+        content = fid.read()
+    sha256 = hashlib.sha256(content).hexdigest()
+
+    # downloaded by an interrupted synchronization but not in the database
+    pkgstore.create_channel(mirror_channel.name)
+    pkgstore.add_file(content, mirror_channel.name, "noarch/test-package-0.1-0.tar.bz2")
+    pkgstore.add_file(
+        b"truncated", mirror_channel.name, "noarch/other-package-0.2-0.tar.bz2"
+    )
+
+    repodata = json.dumps(
+        {
+            "packages": {
+                "test-package-0.1-0.tar.bz2": {"sha256": sha256},
+                "other-package-0.2-0.tar.bz2": {"sha256": "SHA-V2"},
+            }
+        }
+    ).encode()
+    session = RecordingSession(
+        {
+            "noarch/repodata_from_packages.json": repodata,
+            "noarch/other-package-0.2-0.tar.bz2": OTHER_DUMMY_PACKAGE_V2,
+        }
+    )
+
+    initial_sync_mirror(
+        mirror_channel.name,
+        RemoteRepository("", session),
+        "noarch",
+        dao,
+        pkgstore,
+        rules,
+        skip_errors=False,
+    )
+
+    assert "noarch/test-package-0.1-0.tar.bz2" not in session.requested
+    assert "noarch/other-package-0.2-0.tar.bz2" in session.requested
+    assert _sync_versions(db, mirror_channel.name) == {
+        "test-package-0.1-0.tar.bz2",
+        "other-package-0.2-0.tar.bz2",
+    }
+
+
+@pytest.mark.parametrize(
+    "config_extra", ["[mirroring]\nbatch_length = 1\nmax_pending_batches = 2"]
+)
+def test_synchronisation_reserves_size_of_pending_batches(
+    mirror_channel, dao, config, db, user
+):
+    pkgstore = config.get_package_store()
+    rules = Rules("", {"user_id": str(uuid.UUID(bytes=user.id))}, db)
+    # there is room for one of the packages only
+    mirror_channel.size_limit = max(
+        DUMMY_PACKAGE.stat().st_size, OTHER_DUMMY_PACKAGE_V2.stat().st_size
+    )
+    db.commit()
+
+    repodata = json.dumps(
+        {
+            "packages": {
+                "test-package-0.1-0.tar.bz2": {"sha256": "SHA"},
+                "other-package-0.2-0.tar.bz2": {"sha256": "SHA-V2"},
+            }
+        }
+    ).encode()
+    session = RecordingSession(
+        {
+            "noarch/repodata_from_packages.json": repodata,
+            "noarch/test-package-0.1-0.tar.bz2": DUMMY_PACKAGE,
+            "noarch/other-package-0.2-0.tar.bz2": OTHER_DUMMY_PACKAGE_V2,
+        }
+    )
+
+    # both batches are checked before the first one is registered
+    initial_sync_mirror(
+        mirror_channel.name,
+        RemoteRepository("", session),
+        "noarch",
+        dao,
+        pkgstore,
+        rules,
+    )
+
+    assert _sync_versions(db, mirror_channel.name) == {"test-package-0.1-0.tar.bz2"}
+    db.refresh(mirror_channel)
+    assert mirror_channel.size <= mirror_channel.size_limit
+
+
+def _package_metadata(filename, **kwargs):
+    name, version, build = filename[: -len(".tar.bz2")].rsplit("-", 2)
+    return {
+        "name": name,
+        "version": version,
+        "build": build,
+        "build_number": 0,
+        "size": 100,
+        "subdir": "noarch",
+        **kwargs,
+    }
+
+
+@pytest.fixture
+def lazy_mirror_channel(mirror_channel, db):
+    mirror_channel.channel_metadata = json.dumps({"lazy": True})
+    db.commit()
+    return mirror_channel
+
+
+def test_lazy_mirror_synchronisation(lazy_mirror_channel, dao, config, db, user):
+    pkgstore = config.get_package_store()
+    rules = Rules("", {"user_id": str(uuid.UUID(bytes=user.id))}, db)
+    repodata = json.dumps(
+        {
+            "packages": {
+                "test-package-0.1-0.tar.bz2": _package_metadata(
+                    "test-package-0.1-0.tar.bz2", sha256="SHA"
+                ),
+                "other-package-0.2-0.tar.bz2": _package_metadata(
+                    "other-package-0.2-0.tar.bz2", sha256="SHA-V2"
+                ),
+            }
+        }
+    ).encode()
+    session = RecordingSession({"noarch/repodata_from_packages.json": repodata})
+
+    initial_sync_mirror(
+        lazy_mirror_channel.name,
+        RemoteRepository("", session),
+        "noarch",
+        dao,
+        pkgstore,
+        rules,
+        skip_errors=False,
+        lazy=True,
+    )
+
+    # only the repodata is downloaded
+    assert session.requested == ["noarch/repodata_from_packages.json"]
+    assert _sync_versions(db, lazy_mirror_channel.name) == {
+        "test-package-0.1-0.tar.bz2",
+        "other-package-0.2-0.tar.bz2",
+    }
+    assert not pkgstore.file_exists(
+        lazy_mirror_channel.name, "noarch/test-package-0.1-0.tar.bz2"
+    )
+
+    # missing files of lazy mirrors are not removed by validation
+    validate_packages(dao, pkgstore, lazy_mirror_channel.name)
+    assert len(_sync_versions(db, lazy_mirror_channel.name)) == 2
+
+
+def _sha256(path: Path) -> str:
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+@pytest.mark.parametrize(
+    "repo_content",
+    [
+        {
+            "/noarch/test-package-0.1-0.tar.bz2": DUMMY_PACKAGE,
+            "/noarch/other-package-0.1-0.tar.bz2": OTHER_DUMMY_PACKAGE,
+        }
+    ],
+)
+def test_lazy_mirror_download_on_request(
+    client, owner, dummy_repo, lazy_mirror_channel, dao, user, config
+):
+    response = client.get("/api/dummylogin/bartosz")
+    assert response.status_code == 200
+
+    create_version_from_metadata(
+        lazy_mirror_channel.name,
+        user.id,
+        "test-package-0.1-0.tar.bz2",
+        _package_metadata("test-package-0.1-0.tar.bz2", sha256=_sha256(DUMMY_PACKAGE)),
+        dao,
+    )
+    url = f"/get/{lazy_mirror_channel.name}/noarch/test-package-0.1-0.tar.bz2"
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.content == DUMMY_PACKAGE.read_bytes()
+    assert dummy_repo == ["http://host/noarch/test-package-0.1-0.tar.bz2"]
+
+    # served from the package store
+    dummy_repo.clear()
+    response = client.get(url)
+    assert response.status_code == 200
+    assert dummy_repo == []
+
+    # files of packages which are not registered are not fetched
+    response = client.get(
+        f"/get/{lazy_mirror_channel.name}/noarch/other-package-0.1-0.tar.bz2"
+    )
+    assert response.status_code == 404
+    assert dummy_repo == []
+
+    # files which do not match the registered checksum are not stored
+    create_version_from_metadata(
+        lazy_mirror_channel.name,
+        user.id,
+        "other-package-0.1-0.tar.bz2",
+        _package_metadata("other-package-0.1-0.tar.bz2", sha256="WRONG"),
+        dao,
+    )
+    response = client.get(
+        f"/get/{lazy_mirror_channel.name}/noarch/other-package-0.1-0.tar.bz2"
+    )
+    assert response.status_code == 502
+    assert dummy_repo == ["http://host/noarch/other-package-0.1-0.tar.bz2"]
+    pkgstore = config.get_package_store()
+    assert not pkgstore.file_exists(
+        lazy_mirror_channel.name, "noarch/other-package-0.1-0.tar.bz2"
+    )
+
+
+def test_prefetch_packages(lazy_mirror_channel, dao, config, db, user):
+    pkgstore = config.get_package_store()
+    filenames = ["test-package-0.1-0.tar.bz2", "other-package-0.2-0.tar.bz2"]
+    for filename in filenames:
+        create_version_from_metadata(
+            lazy_mirror_channel.name,
+            user.id,
+            filename,
+            _package_metadata(filename, sha256=_sha256(Path(filename))),
+            dao,
+        )
+    db.query(PackageVersion).filter(
+        PackageVersion.filename == "other-package-0.2-0.tar.bz2"
+    ).update({"download_count": 5})
+    db.commit()
+
+    session = RecordingSession(
+        {"http://host/noarch/other-package-0.2-0.tar.bz2": OTHER_DUMMY_PACKAGE_V2}
+    )
+
+    prefetch_packages(lazy_mirror_channel.name, dao, pkgstore, session, limit=10)
+
+    # only downloaded packages are prefetched
+    assert session.requested == ["http://host/noarch/other-package-0.2-0.tar.bz2"]
+    assert pkgstore.file_exists(
+        lazy_mirror_channel.name, "noarch/other-package-0.2-0.tar.bz2"
+    )
+
+    # files already in the store are skipped
+    session.requested.clear()
+    prefetch_packages(lazy_mirror_channel.name, dao, pkgstore, session, limit=10)
+    assert session.requested == []
+
+
+def test_mirror_pipeline():
+    registered = threading.Event()
+
+    def download(item):
+        if item == 3:
+            # downloads of the next batch overlap with registration
+            assert registered.wait(5)
+        return item
+
+    def extract(item, context):
+        if item == 4:
+            raise ValueError("corrupted package")
+        return item * context
+
+    with MirrorPipeline(
+        download, extract, prepare=len, num_parallel_downloads=2
+    ) as pipeline:
+        assert pipeline.submit([1, 2], "b") == []
+
+        (batch,) = pipeline.submit([3], "c")
+        assert batch.last_filename == "b"
+        assert batch.downloaded == [1, 2]
+        assert batch.extracted == [2, 4]
+        assert batch.error is None
+        registered.set()
+
+        (batch,) = pipeline.submit([4, 5], "e")
+        assert batch.extracted == [3]
+
+        (batch,) = pipeline.drain()
+        assert batch.last_filename == "e"
+        assert isinstance(batch.error, ValueError)
+
+
 def test_download_remote_file(client, owner, dummy_repo):
     """Test downloading from cache."""
     response = client.get("/api/dummylogin/bartosz")
@@ -222,6 +222,29 @@ def test_store_add_list_files(any_store, channel, channel_name):
     assert isinstance(metadata[2], str)
 
 
+def test_store_list_files_paged(any_store, channel, channel_name):
+    pkg_store = any_store
+
+    for i in range(5):
+        pkg_store.add_file("content", channel_name, f"linux-64/test-{i}.txt")
+    pkg_store.add_file("other content", channel_name, "noarch/test.txt")
+
+    pages = list(pkg_store.list_files_paged(channel_name, "linux-64", page_size=2))
+    assert [len(page) for page in pages] == [2, 2, 1]
+    assert sorted(f for page in pages for f in page) == [
+        (f"linux-64/test-{i}.txt", 7) for i in range(5)
+    ]
+
+    files = dict(pkg_store.iter_files(channel_name))
+    assert len(files) == 6
+    assert files["noarch/test.txt"] == 13
+
+    assert list(pkg_store.iter_files(channel_name, "osx-64")) == []
+
+    with pytest.raises(FileNotFoundError):
+        list(pkg_store.iter_files(f"{channel_name}-missing"))
+
+
 @pytest.mark.asyncio
 async def test_add_package_async(any_store, channel, channel_name):
     pkg_store = any_store
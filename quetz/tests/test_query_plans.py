@@ -0,0 +1,127 @@
+"""Query plan regression tests for the hot package_versions lookups.
+
+The statements emitted by the tested functions are recorded and explained
+with EXPLAIN (QUERY PLAN) to make sure they are served by an index filtering
+on both channel_name and platform instead of a sequential scan, and that
+package searches use the search index.
+"""
+
+import contextlib
+
+import pytest
+from sqlalchemy import event
+
+from quetz.dao import Dao
+from quetz.tasks.mirror import _check_checksum
+
+
+@pytest.fixture
+def package_versions(make_package_version):
+    versions = [
+        make_package_version("test-package-0.1-0.tar.bz2", "0.1", "linux-64"),
+        make_package_version("test-package-0.2-0.tar.bz2", "0.2", "osx-64"),
+    ]
+    return versions
+
+
+@contextlib.contextmanager
+def record_statements(db):
+    statements = []
+
+    def before_cursor_execute(
+        conn, cursor, statement, parameters, context, executemany
+    ):
+        if "package_versions" in statement and not executemany:
+            statements.append((statement, parameters))
+
+    connection = db.connection()
+    event.listen(connection, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(connection, "before_cursor_execute", before_cursor_execute)
+
+
+def explain(db, statement, parameters):
+    connection = db.connection()
+    if connection.dialect.name == "sqlite":
+        rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)
+        return [row[-1] for row in rows]
+    else:
+        # tables in tests are tiny, so the planner would always prefer a
+        # sequential scan, if an index can be used
+        connection.exec_driver_sql("SET LOCAL enable_seqscan = off")
+        rows = connection.exec_driver_sql(f"EXPLAIN {statement}", parameters)
+        return [row[0] for row in rows]
+
+
+def assert_index_scan(db, statements, ordered=False):
+    assert statements
+
+    for statement, parameters in statements:
+        plan = explain(db, statement, parameters)
+        plan_str = "\n".join(plan)
+
+        if db.connection().dialect.name == "sqlite":
+            pv_plan = [line for line in plan if "package_versions" in line]
+            assert pv_plan, plan_str
+            for line in pv_plan:
+                assert line.startswith("SEARCH"), plan_str
+                assert "channel_name=?" in line, plan_str
+                assert "platform=?" in line, plan_str
+            if ordered:
+                assert "TEMP B-TREE" not in plan_str
+        else:
+            assert "Seq Scan on package_versions" not in plan_str
+            assert any(
+                "Index Cond" in line and "platform" in line for line in plan
+            ), plan_str
+            if ordered:
+                assert "Sort" not in plan_str
+
+
+def test_get_package_infos_plan(dao: Dao, db, channel_name, package_versions):
+    with record_statements(db) as statements:
+        assert len(dao.get_package_infos(channel_name, "linux-64").all()) == 1
+
+    assert_index_scan(db, statements, ordered=True)
+
+
+def test_is_active_platform_plan(dao: Dao, db, channel_name, package_versions):
+    with record_statements(db) as statements:
+        assert dao.is_active_platform(channel_name, "osx-64")
+        assert not dao.is_active_platform(channel_name, "win-64")
+
+    assert len(statements) == 2
+    for statement, _ in statements:
+        assert "EXISTS" in statement.upper()
+        assert "count(" not in statement.lower()
+    assert_index_scan(db, statements)
+
+
+def test_incr_download_count_plan(dao: Dao, db, channel_name, package_versions):
+    with record_statements(db) as statements:
+        dao.incr_download_count(channel_name, "test-package-0.1-0.tar.bz2", "linux-64")
+
+    assert_index_scan(db, statements)
+
+
+def test_mirror_checksums_plan(dao: Dao, db, channel_name, package_versions):
+    with record_statements(db) as statements:
+        with _check_checksum(dao, channel_name, "linux-64") as is_uptodate:
+            is_uptodate("test-package-0.1-0.tar.bz2", {"sha256": "0"})
+
+    assert_index_scan(db, statements)
+
+
+def test_search_packages_plan(dao: Dao, db, package_name, package_versions):
+    with record_statements(db) as statements:
+        assert len(dao.search_packages([package_name], [], None)) == 1
+
+    assert len(statements) == 1
+    plan = "\n".join(explain(db, *statements[0]))
+    if db.connection().dialect.name == "sqlite":
+        assert "packages_fts VIRTUAL TABLE INDEX" in plan, plan
+    else:
+        assert "package_name_trgm_index" in plan, plan
+        assert "package_search_document_index" in plan, plan
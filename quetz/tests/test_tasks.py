@@ -142,3 +142,76 @@ def test_validate_packages(
     assert len(repodata["packages"]) == 0
     assert set(repodata["packages"].keys()) == set([])
     assert len(channel.packages[0].package_versions) == 0
+
+
+def test_validate_packages_sha256(
+    config,
+    user,
+    package_files,
+    channel,
+    channel_name,
+    db,
+    dao,
+    pkgstore: PackageStore,
+    package_filenames,
+    remove_package_versions,
+):
+    reindex_packages_from_store(dao, config, channel.name, user.id)
+    db.refresh(channel)
+    channel_size = channel.size
+
+    # same size, different content
+    filename = package_filenames[0]
+    with pkgstore.serve_path(channel_name, f"linux-64/{filename}") as f:
+        content = f.read()
+    pkgstore.add_file(bytes(len(content)), channel_name, f"linux-64/{filename}")
+
+    # only checked by size
+    result = validate_packages(dao, pkgstore, channel_name)
+    assert result == {"valid": 2, "missing": 0, "wrong_size": 0, "wrong_sha256": 0}
+
+    result = validate_packages(dao, pkgstore, channel_name, sha256_sample_rate=1)
+    assert result == {"valid": 1, "missing": 0, "wrong_size": 0, "wrong_sha256": 1}
+
+    assert not pkgstore.file_exists(channel_name, f"linux-64/{filename}")
+    versions = db.query(PackageVersion.filename).all()
+    assert versions == [(package_filenames[1],)]
+    db.refresh(channel)
+    assert channel.size == channel_size - len(content)
+
+
+def test_validate_packages_missing_store_files(
+    config,
+    user,
+    package_files,
+    channel,
+    channel_name,
+    db,
+    dao,
+    pkgstore: PackageStore,
+    package_filenames,
+    remove_package_versions,
+    tmp_path,
+):
+    reindex_packages_from_store(dao, config, channel.name, user.id)
+    for filename in package_filenames:
+        pkgstore.delete_file(channel_name, f"linux-64/{filename}")
+
+    # a subdir without any file is not emptied
+    result = validate_packages(dao, pkgstore, channel_name)
+    assert result == {"valid": 0, "missing": 0, "wrong_size": 0, "wrong_sha256": 0}
+    assert db.query(PackageVersion).count() == 2
+
+    # nor is the channel missing from the store
+    channels_dir = pkgstore.channels_dir
+    pkgstore.channels_dir = str(tmp_path)
+    try:
+        with pytest.raises(FileNotFoundError):
+            validate_packages(dao, pkgstore, channel_name, remove_missing_subdirs=True)
+    finally:
+        pkgstore.channels_dir = channels_dir
+    assert db.query(PackageVersion).count() == 2
+
+    result = validate_packages(dao, pkgstore, channel_name, remove_missing_subdirs=True)
+    assert result["missing"] == 2
+    assert db.query(PackageVersion).count() == 0
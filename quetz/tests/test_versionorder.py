@@ -16,7 +16,7 @@ import pytest
 
 from quetz.dao import Dao
 from quetz.rest_models import Channel, Package
-from quetz.versionorder import VersionOrder
+from quetz.versionorder import VersionOrder, _parse_version
 
 
 def test_versionorder():
@@ -216,6 +216,37 @@ def test_hexrd():
     assert sorted(vos) == vos
 
 
+def test_parse_cache():
+    _parse_version.cache_clear()
+
+    v1 = VersionOrder("1.2.3rc1")
+    v2 = VersionOrder("1.2.3rc1")
+
+    assert _parse_version.cache_info().hits == 1
+    assert v1._key is v2._key
+    assert v1 == v2
+    assert hash(v1) == hash(v2)
+
+    # equal versions hash equally even if the strings differ
+    assert hash(VersionOrder("1.1")) == hash(VersionOrder("1.1.0"))
+    assert len({VersionOrder("0.4"), VersionOrder("0.4.0"), VersionOrder("0.4.1")}) == 2
+
+    # parse errors are not cached
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            VersionOrder("5.5++")
+
+
+def test_zero_padding_order():
+    # missing components and subcomponents are treated as zeros
+    assert VersionOrder("1.0.a") < VersionOrder("1")
+    assert VersionOrder("1") < VersionOrder("1.0.1")
+    assert VersionOrder("1.0.0dev") < VersionOrder("1")
+    assert VersionOrder("1") < VersionOrder("1.0.0post")
+    assert VersionOrder("1_") < VersionOrder("1.0a")
+    assert VersionOrder("1.2+0.a") < VersionOrder("1.2")
+
+
 @pytest.fixture
 def package_with_versions(channel_name, package_name, dao, user, db):
     channel_data = Channel(name=channel_name, private=False)
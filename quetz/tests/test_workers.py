@@ -1,5 +1,7 @@
 import os
 import socket
+import time
+from concurrent.futures.process import BrokenProcessPool
 from contextlib import closing
 
 import pytest
@@ -123,6 +125,37 @@ def function_with_dao(dao: Dao):
     dao.create_user_with_role("my-user")
 
 
+def write_pid(config_dir):
+    with open(os.path.join(config_dir, "pids.txt"), "a") as fid:
+        fid.write(f"{os.getpid()}\n")
+
+
+def crash_process():
+    os._exit(1)
+
+
+def sleep(seconds):
+    time.sleep(seconds)
+
+
+def read_pids(config_dir):
+    with open(os.path.join(config_dir, "pids.txt")) as fid:
+        return [int(pid) for pid in fid.read().split()]
+
+
+@pytest.fixture
+def pool_worker(config, max_tasks_per_child):
+    SubprocessWorker._executor = None
+    worker = SubprocessWorker(
+        config,
+        executor_args={"max_workers": 1},
+        max_tasks_per_child=max_tasks_per_child,
+    )
+    yield worker
+    worker._executor.shutdown()
+    SubprocessWorker._executor = None
+
+
 @pytest.fixture
 def db_cleanup(config):
     # we can't use the db fixture for cleaning up because
@@ -166,3 +199,44 @@ async def test_threading_worker_execute_with_dao(
 
     # we need to explicitly cleanup because sub-process did not use
     # our db fixture, this will be done at teardown in the db_cleanup fixture
+
+
+@pytest.mark.parametrize("max_tasks_per_child,n_processes", [(None, 1), (1, 3)])
+def test_subprocess_worker_pool(pool_worker, config_dir, n_processes):
+    for _ in range(3):
+        pool_worker.execute(write_pid, config_dir=config_dir)
+        pool_worker.future.result(timeout=60)
+
+    pids = read_pids(config_dir)
+    assert len(pids) == 3
+    assert os.getpid() not in pids
+    assert len(set(pids)) == n_processes
+
+
+@pytest.mark.parametrize("max_tasks_per_child", [None])
+def test_subprocess_worker_health_check(pool_worker, config_dir):
+    assert pool_worker.check_health()
+
+    pool_worker.execute(crash_process)
+    with pytest.raises(BrokenProcessPool):
+        pool_worker.future.result(timeout=60)
+
+    assert not pool_worker.check_health()
+    assert pool_worker.check_health()
+
+    pool_worker.execute(write_pid, config_dir=config_dir)
+    pool_worker.future.result(timeout=60)
+    assert len(read_pids(config_dir)) == 1
+
+
+@pytest.mark.parametrize("max_tasks_per_child", [None])
+def test_subprocess_worker_health_check_busy_pool(pool_worker):
+    pool_worker.execute(sleep, seconds=3)
+    job = pool_worker.future
+    executor = pool_worker._executor
+
+    # the running job would delay a ping, the pool is not restarted
+    assert pool_worker.check_health(timeout=0.1)
+    assert pool_worker._executor is executor
+    job.result(timeout=60)
+    assert pool_worker.is_idle()
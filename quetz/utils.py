@@ -11,18 +11,44 @@ import secrets
 import shlex
 import string
 import sys
+import threading
 import time
 import traceback
 import uuid
+import weakref
 from datetime import datetime, timezone
 from functools import wraps
+from itertools import chain
 from pathlib import Path
-from typing import Any, Callable
+from typing import Any, Callable, Dict, Hashable, Tuple, Type
 from urllib.parse import unquote
 
-from sqlalchemy import String, and_, cast, collate, not_, or_
-
-from .db_models import Channel, Package, PackageVersion, User
+from sqlalchemy import (
+    String,
+    and_,
+    case,
+    cast,
+    collate,
+    column,
+    event,
+    func,
+    literal_column,
+    not_,
+    or_,
+    select,
+    table,
+    text,
+    tuple_,
+)
+from sqlalchemy.orm import Session
+
+from .db_models import (
+    PACKAGE_SEARCH_DOCUMENT,
+    Channel,
+    Package,
+    PackageVersion,
+    User,
+)
 
 
 def check_package_membership(package_name, includelist, excludelist):
@@ -149,6 +175,108 @@ def parse_query(search_type, query):
     return keywords, filters
 
 
+packages_fts = table("packages_fts", column("channel_name"), column("name"))
+
+_package_search_index: "weakref.WeakKeyDictionary[Any, bool]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def has_package_search_index(db: Session) -> bool:
+    """Whether the database has a package search index (see db_models)."""
+    bind = db.get_bind()
+    if bind.dialect.name == "postgresql":
+        return True
+    if bind.dialect.name != "sqlite":
+        return False
+    engine = bind.engine
+    if engine not in _package_search_index:
+        _package_search_index[engine] = (
+            db.execute(
+                text("SELECT 1 FROM sqlite_master WHERE name = 'packages_fts'")
+            ).first()
+            is not None
+        )
+    return _package_search_index[engine]
+
+
+def search_terms(keywords):
+    """Keywords of a search query, without the NOT operators and their operands."""
+    return [
+        keyword
+        for i, keyword in enumerate(keywords)
+        if keyword != "NOT" and (i == 0 or keywords[i - 1] != "NOT")
+    ]
+
+
+def package_keyword_condition(db: Session, keyword: str):
+    """Packages matching the keyword in the name, summary or description.
+
+    The conditions are served by the search index: the trigram index on the
+    names and the full-text index of the summaries and descriptions on
+    PostgreSQL and the trigram FTS5 table on SQLite, which only matches
+    keywords of three characters or more.
+    """
+    name_condition = Package.name.ilike(f"%{keyword}%")
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        return or_(
+            name_condition,
+            literal_column(PACKAGE_SEARCH_DOCUMENT).op("@@")(
+                func.plainto_tsquery("english", keyword)
+            ),
+        )
+    if len(keyword) >= 3 and has_package_search_index(db):
+        phrase = '"{}"'.format(keyword.replace('"', '""'))
+        matches = select(packages_fts.c.channel_name, packages_fts.c.name).where(
+            literal_column("packages_fts").op("MATCH")(phrase)
+        )
+        return tuple_(Package.channel_name, Package.name).in_(matches)
+    return or_(
+        name_condition,
+        Package.summary.ilike(f"%{keyword}%"),
+        Package.description.ilike(f"%{keyword}%"),
+    )
+
+
+def package_search_order(db: Session, keywords):
+    """Order search results by relevance to the keywords, then by downloads.
+
+    Exact name matches come first, then name prefixes, then names containing
+    the keywords and finally the summary and description matches (ranked by
+    ts_rank on PostgreSQL).
+    """
+    order = []
+    terms = search_terms(keywords)
+    if terms:
+        order.append(
+            sum(
+                case(
+                    (func.lower(Package.name) == term.lower(), 0),
+                    (Package.name.ilike(f"{term}%"), 1),
+                    (Package.name.ilike(f"%{term}%"), 2),
+                    else_=3,
+                )
+                for term in terms
+            )
+        )
+        if db.get_bind().dialect.name == "postgresql":
+            query = func.plainto_tsquery("english", " ".join(terms))
+            order.append(
+                func.ts_rank(literal_column(PACKAGE_SEARCH_DOCUMENT), query).desc()
+            )
+    downloads = (
+        select(func.coalesce(func.sum(PackageVersion.download_count), 0))
+        .where(
+            PackageVersion.channel_name == Package.channel_name,
+            PackageVersion.package_name == Package.name,
+        )
+        .scalar_subquery()
+    )
+    order.extend([downloads.desc(), Package.name])
+    return order
+
+
 def apply_custom_query(search_type, db, keywords, filters):
     keyword_conditions = []
     negation_argument = None
@@ -167,7 +295,9 @@ def apply_custom_query(search_type, db, keywords, filters):
         else:
             if each_keyword != negation_argument:
                 if search_type == "package":
-                    each_keyword_condition = Package.name.ilike(f"%{each_keyword}%")
+                    each_keyword_condition = package_keyword_condition(
+                        db.session, each_keyword
+                    )
                 elif search_type == "channel":
                     each_keyword_condition = collate(Channel.name, "und-x-icu").ilike(
                         f"%{each_keyword}%"
@@ -279,3 +409,101 @@ def background_task_wrapper(func: Callable, logger: logging.Logger) -> Callable:
             )
 
     return wrapper
+
+
+class GenerationCache:
+    """Cache with entries expiring after ttl seconds or when invalidated.
+
+    All instances of a subclass share its generation: invalidate() makes
+    every entry of older generations stale. Subclasses define their own
+    ``generation = 0``. At most max_entries entries are kept, stale entries
+    are pruned when the cache is full.
+    """
+
+    generation = 0
+    _generation_lock = threading.Lock()
+    max_entries = 10000
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._entries: Dict[Hashable, Tuple[float, int, Any]] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def invalidate(cls):
+        with cls._generation_lock:
+            cls.generation += 1
+
+    def get(
+        self, key: Hashable, load: Callable[[], Any], cache_none: bool = True
+    ) -> Any:
+        """Cached value of key, loaded with load if missing or stale.
+
+        With cache_none False, None values (for example failed lookups) are
+        not stored.
+        """
+        generation = self.generation
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires, entry_generation, value = entry
+            if entry_generation == generation and expires > time.monotonic():
+                return value
+
+        value = load()
+        # do not store values loaded while the cache was invalidated
+        if (cache_none or value is not None) and generation == self.generation:
+            self._store(key, (time.monotonic() + self.ttl, generation, value))
+        return value
+
+    def _store(self, key: Hashable, entry: Tuple[float, int, Any]):
+        with self._lock:
+            if key not in self._entries and len(self._entries) >= self.max_entries:
+                now = time.monotonic()
+                self._entries = {
+                    k: (expires, entry_generation, value)
+                    for k, (expires, entry_generation, value) in self._entries.items()
+                    if entry_generation == self.generation and expires > now
+                }
+                if len(self._entries) >= self.max_entries:
+                    return
+            self._entries[key] = entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def invalidate_on_changes(cache_cls: Type[GenerationCache], models: Tuple[type, ...]):
+    """Invalidate cache_cls when a session changes instances of models.
+
+    The cache is invalidated when the changes are flushed, or executed as
+    bulk updates and deletes, and again when the transaction ends since
+    entries may have been loaded from uncommitted changes.
+    """
+
+    tables = {model.__tablename__ for model in models}
+    flag = f"quetz_{cache_cls.__name__}_changed"
+
+    def mark_changed(session: Session):
+        session.info[flag] = True
+        cache_cls.invalidate()
+
+    @event.listens_for(Session, "after_flush")
+    def after_flush(session, flush_context):
+        changed = chain(session.new, session.dirty, session.deleted)
+        if any(isinstance(instance, models) for instance in changed):
+            mark_changed(session)
+
+    @event.listens_for(Session, "do_orm_execute")
+    def on_orm_execute(orm_execute_state):
+        # bulk updates and deletes bypass the unit of work
+        if orm_execute_state.is_update or orm_execute_state.is_delete:
+            table = getattr(orm_execute_state.statement, "table", None)
+            if getattr(table, "name", None) in tables:
+                mark_changed(orm_execute_state.session)
+
+    @event.listens_for(Session, "after_commit")
+    @event.listens_for(Session, "after_rollback")
+    def after_transaction(session):
+        if session.info.pop(flag, False):
+            cache_cls.invalidate()
@@ -9,6 +9,7 @@
 # SPDX-License-Identifier: BSD-3-Clause
 
 import re
+from functools import lru_cache
 from itertools import zip_longest
 
 
@@ -21,6 +22,9 @@ class InvalidVersionSpec(ValueError):
 version_check_re = re.compile(r"^[\*\.\+!_0-9a-z]+$")
 version_split_re = re.compile(r"([0-9]+|[*]+|[^0-9*]+)")
 
+# number of parsed version strings kept in memory
+VERSION_CACHE_SIZE = 65536
+
 
 class VersionOrder:
     """
@@ -133,87 +137,22 @@ class VersionOrder:
       1.0.1_ < 1.0.1a =>  True   # ensure correct ordering for openssl
     """
 
+    __slots__ = ("norm_version", "_version", "_local", "_key")
+
+    # when fillvalue ==  0  =>  1.1 == 1.1.0
+    # when fillvalue == -1  =>  1.1  < 1.1.0
+    fillvalue = 0
+
     def __init__(self, vstr: str):
-        # version comparison is case-insensitive
-        version = vstr.strip().rstrip().lower()
-        # basic validity checks
-        if version == "":
-            raise InvalidVersionSpec(vstr, "empty version string")
-        invalid = not version_check_re.match(version)
-        if invalid and "-" in version and "_" not in version:
-            # Allow for dashes as long as there are no underscores
-            # as well, by converting the former to the latter.
-            version = version.replace("-", "_")
-            invalid = not version_check_re.match(version)
-        if invalid:
-            raise InvalidVersionSpec(vstr, "invalid character(s)")
-
-        # when fillvalue ==  0  =>  1.1 == 1.1.0
-        # when fillvalue == -1  =>  1.1  < 1.1.0
-        self.norm_version = version
-        self.fillvalue = 0
-
-        # find epoch
-        split_epoch = version.split("!")
-        if len(split_epoch) == 1:
-            # epoch not given => set it to '0'
-            epoch = ["0"]
-        elif len(split_epoch) == 2:
-            # epoch given, must be an integer
-            if not split_epoch[0].isdigit():
-                raise InvalidVersionSpec(vstr, "epoch must be an integer")
-            epoch = [split_epoch[0]]
-            version = split_epoch[1]
-        else:
-            raise InvalidVersionSpec(vstr, "duplicated epoch separator '!'")
-
-        # find local version string
-        split_local = version.split("+")
-        if len(split_local) == 1:
-            # no local version
-            self.local = []
-        elif len(split_local) == 2:
-            # local version given
-            self.local = split_local[1].replace("_", ".").split(".")
-            version = split_local[0]
-        else:
-            raise InvalidVersionSpec(vstr, "duplicated local version separator '+'")
-
-        # split version
-        if version[-1] == "_":
-            # If the last character of version is "-" or "_", don't split that out
-            # individually. Implements the instructions for openssl-like versions
-            # > You can work-around this problem by appending a dash to plain version
-            #   numbers
-            split_version = version[:-1].replace("_", ".").split(".")
-            split_version[-1] += "_"
-        else:
-            split_version = version.replace("_", ".").split(".")
-        self.version = epoch + split_version
-
-        # split components into runs of numerals and non-numerals,
-        # convert numerals to int, handle special strings
-        for v in (self.version, self.local):
-            for k in range(len(v)):
-                c = version_split_re.findall(v[k])
-                if not c:
-                    raise InvalidVersionSpec(vstr, "empty version component")
-                for j in range(len(c)):
-                    if c[j].isdigit():
-                        c[j] = int(c[j])
-                    elif c[j] == "post":
-                        # ensure number < 'post' == infinity
-                        c[j] = float("inf")
-                    elif c[j] == "dev":
-                        # ensure '*' < 'DEV' < '_' < 'a' < number
-                        # by upper-casing (all other strings are lower case)
-                        c[j] = "DEV"
-                if v[k][0].isdigit():
-                    v[k] = c  # type: ignore
-                else:
-                    # components shall start with a number to keep numbers and
-                    # strings in phase => prepend fillvalue
-                    v[k] = [self.fillvalue] + c  # type: ignore
+        self.norm_version, self._version, self._local, self._key = _parse_version(vstr)
+
+    @property
+    def version(self):
+        return [list(c) for c in self._version]
+
+    @property
+    def local(self):
+        return [list(c) for c in self._local]
 
     def __str__(self):
         return self.norm_version
@@ -221,32 +160,33 @@ class VersionOrder:
     def __repr__(self):
         return f'{self.__class__.__name__}("{self}")'
 
+    def __hash__(self):
+        return hash(self._key)
+
     def _eq(self, t1, t2):
-        for v1, v2 in zip_longest(t1, t2, fillvalue=[]):
+        for v1, v2 in zip_longest(t1, t2, fillvalue=()):
             for c1, c2 in zip_longest(v1, v2, fillvalue=self.fillvalue):
                 if c1 != c2:
                     return False
         return True
 
     def __eq__(self, other):
-        return self._eq(self.version, other.version) and self._eq(
-            self.local, other.local
-        )
+        return self._key == other._key
 
     def startswith(self, other):
         # Tests if the version lists match up to the last element in "other".
-        if other.local:
-            if not self._eq(self.version, other.version):
+        if other._local:
+            if not self._eq(self._version, other._version):
                 return False
-            t1 = self.local
-            t2 = other.local
+            t1 = self._local
+            t2 = other._local
         else:
-            t1 = self.version
-            t2 = other.version
+            t1 = self._version
+            t2 = other._version
         nt = len(t2) - 1
         if not self._eq(t1[:nt], t2[:nt]):
             return False
-        v1 = [] if len(t1) <= nt else t1[nt]
+        v1 = () if len(t1) <= nt else t1[nt]
         v2 = t2[nt]
         nt = len(v2) - 1
         if not self._eq([v1[:nt]], [v2[:nt]]):
@@ -258,31 +198,151 @@ class VersionOrder:
         return c1 == c2
 
     def __ne__(self, other):
-        return not (self == other)
+        return self._key != other._key
 
     def __lt__(self, other):
-        for t1, t2 in zip([self.version, self.local], [other.version, other.local]):
-            for v1, v2 in zip_longest(t1, t2, fillvalue=[]):
-                for c1, c2 in zip_longest(v1, v2, fillvalue=self.fillvalue):
-                    if c1 == c2:
-                        continue
-                    elif isinstance(c1, str):
-                        if not isinstance(c2, str):
-                            # str < int
-                            return True
-                    elif isinstance(c2, str):
-                        # not (int < str)
-                        return False
-                    # c1 and c2 have the same type
-                    return c1 < c2
-        # self == other
-        return False
+        return self._key < other._key
 
     def __gt__(self, other):
-        return other < self
+        return self._key > other._key
 
     def __le__(self, other):
-        return not (other < self)
+        return self._key <= other._key
 
     def __ge__(self, other):
-        return not (self < other)
+        return self._key >= other._key
+
+
+# Sort keys are built so that plain tuple comparison reproduces the conda
+# ordering described above. Components are padded with zeros, so zeros are
+# run-length encoded: every non-zero item carries the number of zeros that
+# precede it, and the end of a sequence stands for "zeros forever". Items
+# smaller than zero (strings) sort below the terminator, items larger than
+# zero (numbers, 'post') above it.
+_END = (1,)
+
+
+def _sort_key(items, zero, is_negative):
+    key = []
+    zeros = 0
+    for item in items:
+        if item == zero:
+            zeros += 1
+        elif is_negative(item):
+            key.append((0, zeros, item))
+            zeros = 0
+        else:
+            key.append((2, -zeros, item))
+            zeros = 0
+    key.append(_END)
+    return tuple(key)
+
+
+def _component_key(component):
+    return _sort_key(component, 0, lambda c: isinstance(c, str))
+
+
+_ZERO_COMPONENT = _component_key(())
+
+
+def _parts_key(parts):
+    return _sort_key(
+        [_component_key(c) for c in parts],
+        _ZERO_COMPONENT,
+        lambda c: c < _ZERO_COMPONENT,
+    )
+
+
+def _split_components(vstr, components, fillvalue):
+    # split components into runs of numerals and non-numerals,
+    # convert numerals to int, handle special strings
+    result = []
+    for component in components:
+        c = version_split_re.findall(component)
+        if not c:
+            raise InvalidVersionSpec(vstr, "empty version component")
+        for j in range(len(c)):
+            if c[j].isdigit():
+                c[j] = int(c[j])
+            elif c[j] == "post":
+                # ensure number < 'post' == infinity
+                c[j] = float("inf")
+            elif c[j] == "dev":
+                # ensure '*' < 'DEV' < '_' < 'a' < number
+                # by upper-casing (all other strings are lower case)
+                c[j] = "DEV"
+        if not component[0].isdigit():
+            # components shall start with a number to keep numbers and
+            # strings in phase => prepend fillvalue
+            c.insert(0, fillvalue)
+        result.append(tuple(c))
+    return tuple(result)
+
+
+@lru_cache(maxsize=VERSION_CACHE_SIZE)
+def _parse_version(vstr: str):
+    """Parse a version string into its normalized form, the exploded version
+    and local components (as tuples) and a sort key.
+
+    Results are memoized, so parsing the same version string again (which is
+    what happens when sorting all versions of a package) returns the same
+    objects."""
+    # version comparison is case-insensitive
+    version = vstr.strip().rstrip().lower()
+    # basic validity checks
+    if version == "":
+        raise InvalidVersionSpec(vstr, "empty version string")
+    invalid = not version_check_re.match(version)
+    if invalid and "-" in version and "_" not in version:
+        # Allow for dashes as long as there are no underscores
+        # as well, by converting the former to the latter.
+        version = version.replace("-", "_")
+        invalid = not version_check_re.match(version)
+    if invalid:
+        raise InvalidVersionSpec(vstr, "invalid character(s)")
+
+    norm_version = version
+
+    # find epoch
+    split_epoch = version.split("!")
+    if len(split_epoch) == 1:
+        # epoch not given => set it to '0'
+        epoch = ["0"]
+    elif len(split_epoch) == 2:
+        # epoch given, must be an integer
+        if not split_epoch[0].isdigit():
+            raise InvalidVersionSpec(vstr, "epoch must be an integer")
+        epoch = [split_epoch[0]]
+        version = split_epoch[1]
+    else:
+        raise InvalidVersionSpec(vstr, "duplicated epoch separator '!'")
+
+    # find local version string
+    split_local = version.split("+")
+    if len(split_local) == 1:
+        # no local version
+        local = []
+    elif len(split_local) == 2:
+        # local version given
+        local = split_local[1].replace("_", ".").split(".")
+        version = split_local[0]
+    else:
+        raise InvalidVersionSpec(vstr, "duplicated local version separator '+'")
+
+    # split version
+    if version[-1] == "_":
+        # If the last character of version is "-" or "_", don't split that out
+        # individually. Implements the instructions for openssl-like versions
+        # > You can work-around this problem by appending a dash to plain version
+        #   numbers
+        split_version = version[:-1].replace("_", ".").split(".")
+        split_version[-1] += "_"
+    else:
+        split_version = version.replace("_", ".").split(".")
+
+    fillvalue = VersionOrder.fillvalue
+    exploded_version = _split_components(vstr, epoch + split_version, fillvalue)
+    exploded_local = _split_components(vstr, local, fillvalue)
+    key = (_parts_key(exploded_version), _parts_key(exploded_local))
+
+    return norm_version, exploded_version, exploded_local, key
@@ -0,0 +1,98 @@
+"""Benchmark Dao.cleanup_channel_db on a synthetic large channel.
+
+Usage:
+
+    python utils/benchmark_cleanup_channel_db.py [DATABASE_URL] \
+        [--packages 60000] [--versions 5]
+
+The database (a temporary SQLite file by default) is filled with a channel
+of packages with a few versions each. One package in ten has no versions,
+one in ten has duplicated subdirs in its channeldata and one in ten has its
+version_order shuffled. The cleanup is timed twice: the first run fixes the
+channel, the second one runs on the consistent channel.
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+import uuid
+
+from sqlalchemy import insert
+
+from quetz.dao import Dao
+from quetz.database import get_session
+from quetz.db_models import Base, Channel, Package, PackageVersion
+
+CHANNEL = "benchmark"
+
+
+def populate(db, n_packages, n_versions):
+    db.execute(insert(Channel), [{"name": CHANNEL}])
+    packages, versions = [], []
+    for i in range(n_packages):
+        name = f"package-{i}"
+        subdirs = ["linux-64", "noarch"]
+        if i % 10 == 1:
+            subdirs = subdirs + ["linux-64"]
+        packages.append(
+            {
+                "channel_name": CHANNEL,
+                "name": name,
+                "channeldata": json.dumps({"subdirs": subdirs}),
+                "url": "",
+                "platforms": ":".join(sorted(set(subdirs))),
+            }
+        )
+        if i % 10 == 0:
+            continue
+        orders = list(range(n_versions))
+        if i % 10 == 2:
+            random.shuffle(orders)
+        for j, order in zip(range(n_versions, 0, -1), orders):
+            versions.append(
+                {
+                    "id": uuid.uuid4().bytes,
+                    "channel_name": CHANNEL,
+                    "package_name": name,
+                    "platform": "linux-64",
+                    "version": f"1.{j}",
+                    "build_string": "0",
+                    "build_number": 0,
+                    "filename": f"{name}-1.{j}-0.tar.bz2",
+                    "version_order": order,
+                    "size": 1,
+                }
+            )
+    db.execute(insert(Package), packages)
+    db.execute(insert(PackageVersion), versions)
+    db.commit()
+    print(f"{len(packages)} packages, {len(versions)} package versions")
+
+
+def main(args):
+    if args.database_url:
+        db_url = args.database_url
+    else:
+        tmp_dir = tempfile.mkdtemp()
+        db_url = f"sqlite:///{os.path.join(tmp_dir, 'benchmark.sqlite')}"
+
+    db = get_session(db_url)
+    Base.metadata.create_all(db.get_bind())
+    populate(db, args.packages, args.versions)
+
+    dao = Dao(db)
+    for label in ["inconsistent channel", "consistent channel"]:
+        tic = time.perf_counter()
+        dao.cleanup_channel_db(CHANNEL)
+        print(f"{label:<30} {time.perf_counter() - tic:8.2f} s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("database_url", nargs="?", default=None)
+    parser.add_argument("--packages", type=int, default=60000)
+    parser.add_argument("--versions", type=int, default=5)
+    main(parser.parse_args())
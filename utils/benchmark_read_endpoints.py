@@ -0,0 +1,83 @@
+"""Load benchmark of the read endpoints of a running Quetz server.
+
+Usage:
+
+    python utils/benchmark_read_endpoints.py URL CHANNEL PACKAGE \
+        [--concurrency 64] [--requests 2000] [--api-key KEY]
+
+Requests are sent with the given concurrency to the channel list, package
+search and package versions endpoints, and the latency percentiles are
+printed for each of them. Run it against a server started with
+``async_enabled = false`` and ``async_enabled = true`` in the ``sqlalchemy``
+section to compare the sync and asyncio data paths.
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+
+def percentile(latencies, p):
+    latencies = sorted(latencies)
+    index = min(len(latencies) - 1, round(p / 100 * (len(latencies) - 1)))
+    return latencies[index]
+
+
+async def run(client, path, n_requests, concurrency):
+    latencies = []
+    errors = 0
+    remaining = iter(range(n_requests))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            tic = time.perf_counter()
+            response = await client.get(path)
+            latencies.append(time.perf_counter() - tic)
+            if response.status_code != 200:
+                errors += 1
+
+    tic = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - tic
+
+    print(
+        f"{path:<60} {n_requests / elapsed:8.0f} req/s"
+        f" p50 {statistics.median(latencies) * 1000:7.1f} ms"
+        f" p99 {percentile(latencies, 99) * 1000:7.1f} ms"
+        f" max {max(latencies) * 1000:7.1f} ms"
+        f" errors {errors}"
+    )
+
+
+async def main(args):
+    headers = {"X-API-Key": args.api_key} if args.api_key else {}
+    paths = [
+        "/api/channels",
+        f"/api/packages/search/?q={args.package}",
+        f"/api/channels/{args.channel}/packages/{args.package}/versions",
+    ]
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(
+        base_url=args.url, headers=headers, limits=limits, timeout=60
+    ) as client:
+        for path in paths:
+            # warm up connections and caches
+            await run(client, path, args.concurrency, args.concurrency)
+        print()
+        for path in paths:
+            await run(client, path, args.requests, args.concurrency)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("url", help="URL of the Quetz server")
+    parser.add_argument("channel", help="channel of the package")
+    parser.add_argument("package", help="package to search and list versions of")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--api-key", default=None)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,117 @@
+"""Benchmark the package search with and without the search index.
+
+Usage:
+
+    python utils/benchmark_search.py [DATABASE_URL] [--packages 100000]
+
+The database (a temporary SQLite file by default) is filled with random
+packages and the search of a few keywords is timed with Dao.search_packages,
+which uses the search index, and with the equivalent ILIKE '%term%' scans of
+the names, summaries and descriptions.
+"""
+
+import argparse
+import os
+import random
+import string
+import tempfile
+import time
+
+from sqlalchemy import insert, or_
+
+from quetz.dao import Dao
+from quetz.database import get_session
+from quetz.db_models import Base, Channel, Package
+
+WORDS = [
+    "array",
+    "compute",
+    "data",
+    "frame",
+    "image",
+    "learn",
+    "network",
+    "parse",
+    "plot",
+    "server",
+    "stats",
+    "test",
+]
+
+
+def random_name():
+    letters = "".join(random.choices(string.ascii_lowercase, k=6))
+    return f"{random.choice(WORDS)}-{letters}"
+
+
+def populate(db, n_packages, n_channels=10):
+    channels = [f"channel-{i}" for i in range(n_channels)]
+    db.execute(insert(Channel), [{"name": name} for name in channels])
+    packages = {}
+    while len(packages) < n_packages:
+        packages[(random.choice(channels), random_name())] = " ".join(
+            random.choices(WORDS, k=8)
+        )
+    db.execute(
+        insert(Package),
+        [
+            {"channel_name": c, "name": n, "summary": s, "channeldata": "{}"}
+            for (c, n), s in packages.items()
+        ],
+    )
+    db.commit()
+
+
+def ilike_search(db, keyword):
+    pattern = f"%{keyword}%"
+    return (
+        db.query(Package)
+        .join(Channel)
+        .filter(
+            or_(
+                Package.name.ilike(pattern),
+                Package.summary.ilike(pattern),
+                Package.description.ilike(pattern),
+            )
+        )
+        .filter(Channel.private == False)  # noqa
+        .order_by(Package.name)
+        .all()
+    )
+
+
+def timeit(label, func, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        tic = time.perf_counter()
+        n_results = len(func())
+        best = min(best, time.perf_counter() - tic)
+    print(f"{label:<40} {best * 1000:9.1f} ms {n_results:8d} results")
+
+
+def main(args):
+    if args.database_url:
+        db_url = args.database_url
+    else:
+        tmp_dir = tempfile.mkdtemp()
+        db_url = f"sqlite:///{os.path.join(tmp_dir, 'benchmark.sqlite')}"
+
+    db = get_session(db_url)
+    Base.metadata.create_all(db.get_bind())
+    populate(db, args.packages)
+    print(f"{args.packages} packages in {db_url}")
+
+    dao = Dao(db)
+    for keyword in ["learn", "frame-ab", "xyzzy"]:
+        timeit(
+            f"search index  {keyword!r}",
+            lambda: dao.search_packages([keyword], [], None),
+        )
+        timeit(f"ILIKE scan    {keyword!r}", lambda: ilike_search(db, keyword))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("database_url", nargs="?", default=None)
+    parser.add_argument("--packages", type=int, default=100000)
+    main(parser.parse_args())
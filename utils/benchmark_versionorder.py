@@ -0,0 +1,63 @@
+"""Benchmark VersionOrder parsing and sorting on a conda-forge version corpus.
+
+Usage:
+
+    python utils/benchmark_versionorder.py [repodata.json]
+
+Without argument the linux-64 repodata of conda-forge is downloaded.
+"""
+
+import json
+import sys
+import time
+from collections import defaultdict
+from itertools import chain
+
+import requests
+
+from quetz.versionorder import VersionOrder, _parse_version
+
+if len(sys.argv) > 1:
+    with open(sys.argv[1]) as fid:
+        repodata = json.load(fid)
+else:
+    repodata = requests.get(
+        "https://conda.anaconda.org/conda-forge/linux-64/repodata.json",
+        headers={"accept-encoding": "gzip"},
+    ).json()
+    print("got conda-forge repodata")
+
+versions_per_package = defaultdict(list)
+for key in ("packages", "packages.conda"):
+    for metadata in repodata.get(key, {}).values():
+        versions_per_package[metadata["name"]].append(metadata["version"])
+
+n_versions = sum(len(v) for v in versions_per_package.values())
+print(
+    f"{n_versions} versions ({len(set(chain(*versions_per_package.values())))} "
+    f"unique) in {len(versions_per_package)} packages"
+)
+
+
+def sort_all():
+    for versions in versions_per_package.values():
+        sorted(versions, key=VersionOrder, reverse=True)
+
+
+def timeit(label, func, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        tic = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - tic)
+    print(f"{label:<30} {best:8.3f} s {n_versions / best:12.0f} versions/s")
+
+
+def cold():
+    _parse_version.cache_clear()
+    sort_all()
+
+
+timeit("sort, cold parse cache", cold)
+timeit("sort, warm parse cache", sort_all)
+print(_parse_version.cache_info())